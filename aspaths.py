@@ -0,0 +1,218 @@
+from array import array
+
+RECORD_TYPES = ('rib', 'updates', 'withdrawal')
+RECORD_TYPE_CODES = dict((t, i) for i, t in enumerate(RECORD_TYPES))
+
+
+def path_to_asns(path):
+    """ ASNs of an as-path string, AS-sets '{a,b}' are expanded.
+    """
+    asns = []
+    for token in path.split(' '):
+        if '{' in token:
+            asns.extend(int(asn) for asn in token[1:-1].split(',') if asn.isdigit())
+        elif token.isdigit():
+            asns.append(int(token))
+    return asns
+
+
+class _NestedView(object):
+    """ Read-only view that iterates like the old
+    paths[collector][peer][prefix] = [(time, record_type, as_path), ..]
+    """
+    def __init__(self, store, tree):
+        self._store = store
+        self._tree = tree
+
+    def _wrap(self, value):
+        if isinstance(value, tuple):
+            return self._store.rows(*value)
+        return _NestedView(self._store, value)
+
+    def __getitem__(self, key):
+        return self._wrap(self._tree[key])
+
+    def __contains__(self, key):
+        return key in self._tree
+
+    def __iter__(self):
+        return iter(self._tree)
+
+    def __len__(self):
+        return len(self._tree)
+
+    def get(self, key, default=None):
+        if key in self._tree:
+            return self[key]
+        return default
+
+    def keys(self):
+        return list(self._tree)
+
+    def iterkeys(self):
+        return iter(self._tree)
+
+    def itervalues(self):
+        for key in self._tree:
+            yield self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        for key in self._tree:
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class ASPaths(_NestedView):
+    """ Columnar store of the paths collected by HistoBGPStream.
+    Every (time, record_type, as_path) entry is a row in parallel arrays
+    of time, record type code and path id. Rows of the same
+    (collector, peer, prefix) are contiguous and in time order, and each
+    such group has its start row and collector/peer/prefix ids in
+    another set of parallel arrays.
+    Strings are interned once, and each distinct as-path also has its
+    ASNs in a flat array (path_asns[path_offsets[i]:path_offsets[i+1]]).
+    Indexing and iteritems() work like the old nested dict.
+    """
+    def __init__(self):
+        # interned strings
+        self.collectors = []
+        self.peers = []
+        self.prefixes = []
+        self.paths = []
+        self.path_offsets = array('I', [0])
+        self.path_asns = array('I')
+        # one per entry
+        self.times = array('I')
+        self.types = array('B')
+        self.path_ids = array('I')
+        # one per (collector, peer, prefix),
+        # a group ends where the next one starts
+        self.group_starts = array('I')
+        self.collector_ids = array('H')
+        self.peer_ids = array('I')
+        self.prefix_ids = array('I')
+        self._reset_lookups()
+
+    def _reset_lookups(self):
+        self._ids = {}
+        for name in ('collectors', 'peers', 'prefixes', 'paths'):
+            self._ids[name] = dict((v, i) for i, v in enumerate(getattr(self, name)))
+        self._tree_cache = None
+
+    def _intern(self, name, value):
+        ids = self._ids[name]
+        if value not in ids:
+            ids[value] = len(ids)
+            getattr(self, name).append(value)
+            if name == 'paths':
+                self.path_asns.extend(path_to_asns(value))
+                self.path_offsets.append(len(self.path_asns))
+        return ids[value]
+
+    @property
+    def _tree(self):
+        if self._tree_cache is None:
+            tree = {}
+            for collector, peer, prefix, start, stop in self.iter_groups():
+                tree.setdefault(collector, {}).setdefault(peer, {})[prefix] = (start, stop)
+            self._tree_cache = tree
+        return self._tree_cache
+
+    @property
+    def _store(self):
+        return self
+
+    def append_timeline(self, collector, peer, prefix, entries):
+        """ Add the whole (time ordered) history of a (collector, peer, prefix).
+        :param entries: iterable of (time, record_type, as_path)
+        """
+        start = len(self.times)
+        for timestamp, record_type, as_path in entries:
+            self.times.append(timestamp)
+            self.types.append(RECORD_TYPE_CODES[record_type])
+            self.path_ids.append(self._intern('paths', as_path))
+        if len(self.times) != start:
+            self.group_starts.append(start)
+            self.collector_ids.append(self._intern('collectors', collector))
+            self.peer_ids.append(self._intern('peers', peer))
+            self.prefix_ids.append(self._intern('prefixes', prefix))
+            self._tree_cache = None
+
+    @classmethod
+    def from_timelines(cls, timelines):
+        """ :param timelines: {(collector, peer, prefix): Timeline}
+        Groups are ordered by key, so the result does not depend on the
+        order the time lines were filled in.
+        """
+        store = cls()
+        for key in sorted(timelines):
+            collector, peer, prefix = key
+            store.append_timeline(collector, peer, prefix, timelines[key])
+        return store
+
+    @classmethod
+    def from_nested(cls, paths):
+        """ Convert the old paths[collector][peer][prefix] lists.
+        """
+        if isinstance(paths, cls):
+            return paths
+        store = cls()
+        for collector, P in paths.items():
+            for peer, A in P.items():
+                for prefix, entries in A.items():
+                    store.append_timeline(collector, peer, prefix, entries)
+        return store
+
+    def to_nested(self):
+        return dict((collector, dict((peer, dict(A.items())) for peer, A in P.items()))
+                    for collector, P in self.items())
+
+    def iter_groups(self):
+        """ (collector, peer, prefix, start row, stop row) per time line
+        """
+        starts = self.group_starts
+        for i in range(len(starts)):
+            stop = starts[i + 1] if i + 1 < len(starts) else len(self.times)
+            yield (self.collectors[self.collector_ids[i]], self.peers[self.peer_ids[i]],
+                   self.prefixes[self.prefix_ids[i]], starts[i], stop)
+
+    def rows(self, start, stop):
+        paths = self.paths
+        return [(self.times[i], RECORD_TYPES[self.types[i]], paths[self.path_ids[i]])
+                for i in range(start, stop)]
+
+    def iter_entries(self):
+        """ Flat iteration over all rows:
+        (collector, peer, prefix, time, record_type, as_path)
+        """
+        times, types, path_ids, paths = self.times, self.types, self.path_ids, self.paths
+        for collector, peer, prefix, start, stop in self.iter_groups():
+            for i in range(start, stop):
+                yield (collector, peer, prefix, times[i],
+                       RECORD_TYPES[types[i]], paths[path_ids[i]])
+
+    def get_path_asns(self, path_id):
+        return self.path_asns[self.path_offsets[path_id]:self.path_offsets[path_id + 1]]
+
+    def __getstate__(self):
+        state = {'collectors': self.collectors, 'peers': self.peers,
+                 'prefixes': self.prefixes, 'paths': self.paths}
+        for name in ('path_offsets', 'path_asns', 'times', 'types', 'path_ids',
+                     'group_starts', 'collector_ids', 'peer_ids', 'prefix_ids'):
+            arr = getattr(self, name)
+            state[name] = (arr.typecode, arr.tostring())
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            if isinstance(value, tuple):
+                arr = array(value[0])
+                arr.fromstring(value[1])
+                value = arr
+            setattr(self, name, value)
+        self._reset_lookups()
@@ -0,0 +1,1560 @@
+#!/usr/bin/env python
+""" Micro-benchmarks for the collection pipeline, timings only: the tests
+(python -m pytest tests) check the results.
+Run as: python benchmark.py <name> [options]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import pickle
+import random
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import logging
+import argparse
+import requests
+from datetime import datetime, timedelta
+from multiprocessing import Pool, Process, cpu_count
+from collections import defaultdict
+from timeline import Timeline
+from aspaths import ASPaths, path_to_asns
+from eventstore import EventStore, migrate_pickle
+from hegecache import HegemonyCache
+from standins import FakeIHR, FakeBGPStream, FakeBGPRecord, FakeBGPSource, records_from_elems, \
+    elems_from_event, hegemony_table_from_event, synthetic_elem_stream, synthetic_event_elems, \
+    synthetic_hegemony_table
+from histobgpstream import HistoBGPStream
+from elemcache import ElemCache
+from sinks import PrefixOriginSink, read_elems
+from ihr import IHRClient
+from pathnorm import group_paths
+from scheduler import Scheduler, Job, _run_timed
+from leases import Task, run_claimed, FAILED_EXTENSION
+from checkpoints import Checkpoint
+from prefixes import parse_prefix
+from origins import prefix_origins
+
+
+def legacy_insert(timeline, timestamp, record_type, as_path):
+    """ The reverse scan that get_bgpstream used before Timeline,
+    kept as a reference for benchmarks.
+    :param timeline:(list) of (time, record_type, as_path)
+    """
+    if len(timeline) == 0:
+        timeline.append((timestamp, record_type, as_path))
+        return
+    length = len(timeline)
+    for index in reversed(range(length)):
+        p_time, p_type, p_as_path = timeline[index]
+        if timestamp >= p_time:
+            if p_as_path != as_path:
+                if (index + 1 != length):
+                    f_time, f_type, f_as_path = timeline[index + 1]
+                    if as_path == f_as_path:
+                        del timeline[index + 1]
+                timeline.insert(index + 1, (timestamp, record_type, as_path))
+            break
+        else:
+            if (index == 0) and (record_type != 'withdrawal'):
+                if as_path == p_as_path:
+                    del timeline[index]
+                timeline.insert(index, (timestamp, record_type, as_path))
+
+
+def read_elem_stream(fpath):
+    """ Read a recorded elem stream (see sinks.ElemWriterSink)
+    """
+    return list(read_elems(fpath))
+
+
+def bench_timeline(args):
+    """ Replay an elem stream through the legacy reverse scan and
+    through Timeline, and report the time of each.
+    """
+    if args.stream:
+        elems = read_elem_stream(args.stream)
+    else:
+        elems = synthetic_elem_stream(args.elems, args.keys, args.disorder)
+
+    stime = time.time()
+    legacy = defaultdict(list)
+    for collector, peer, prefix, timestamp, record_type, as_path in elems:
+        legacy_insert(legacy[(collector, peer, prefix)],
+                      timestamp, record_type, as_path)
+    legacy_time = time.time() - stime
+
+    stime = time.time()
+    timelines = defaultdict(Timeline)
+    for collector, peer, prefix, timestamp, record_type, as_path in elems:
+        timelines[(collector, peer, prefix)].insert(timestamp, record_type, as_path)
+    timeline_time = time.time() - stime
+
+    print "elems: %s, keys: %s" % (len(elems), len(legacy))
+    print "legacy:   %.3fs (%.0f elems/s)" % (legacy_time, len(elems) / legacy_time)
+    print "timeline: %.3fs (%.0f elems/s)" % (timeline_time, len(elems) / timeline_time)
+    return 0
+
+
+def deep_sizeof(obj, seen=None):
+    """ Rough in-memory size of an object graph in bytes.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for value in obj:
+            size += deep_sizeof(value, seen)
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
+
+
+def timed_loads(data, repeat=3):
+    best = None
+    for _ in range(repeat):
+        stime = time.time()
+        obj = pickle.loads(data)
+        elapsed = time.time() - stime
+        best = elapsed if best is None else min(best, elapsed)
+    return obj, best
+
+
+def bench_aspaths(args):
+    """ Compare pickle size, load time and memory of event['as_paths']
+    as nested dicts (old pickles) and as ASPaths.
+    """
+    print "%-28s %10s %10s %9s %9s %10s %10s" % \
+        ('event', 'old_bytes', 'new_bytes', 'old_load', 'new_load', 'old_mem', 'new_mem')
+    for fpath in sorted(glob.glob(os.path.join(args.directory, '*.pickle'))):
+        with open(fpath, 'r') as f:
+            event = pickle.load(f)
+        if 'as_paths' not in event:
+            continue
+        old = event['as_paths']
+        if isinstance(old, ASPaths):
+            old = old.to_nested()
+        else:
+            old = dict((c, dict((p, dict(A)) for p, A in P.items())) for c, P in old.items())
+        new = ASPaths.from_nested(old)
+        old_data = pickle.dumps(old, pickle.HIGHEST_PROTOCOL)
+        new_data = pickle.dumps(new, pickle.HIGHEST_PROTOCOL)
+        old, old_load = timed_loads(old_data)
+        new, new_load = timed_loads(new_data)
+        print "%-28s %10d %10d %8.3fs %8.3fs %10d %10d" % \
+            (os.path.basename(fpath), len(old_data), len(new_data), old_load, new_load,
+             deep_sizeof(old), deep_sizeof(new))
+    return 0
+
+
+def bench_eventstore(args):
+    """ Latency of loading one field from an event file
+    against pickle.load of the whole event.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print "%-28s %9s %9s %9s" % ('event', 'pickle', 'store', 'speedup')
+        for fpath in sorted(glob.glob(os.path.join(args.directory, '*.pickle'))):
+            title = os.path.basename(fpath).split('.pickle')[0]
+            migrate_pickle(fpath, tmp_dir)
+            stime = time.time()
+            with open(fpath, 'r') as f:
+                event = pickle.load(f)
+            value = event.get(args.field)
+            pickle_time = time.time() - stime
+
+            stime = time.time()
+            store = EventStore(tmp_dir, title)
+            if args.field in store:
+                value = store.load(args.field)
+            store_time = time.time() - stime
+            print "%-28s %8.4fs %8.4fs %8.1fx" % \
+                (title, pickle_time, store_time, pickle_time / max(store_time, 1e-6))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+
+def _query_local_hegemony(args):
+    """ One 'event' of bench_hegecache, run in a pool worker
+    """
+    from hegemony import GetHegemony
+    base_url, cache_path, title, origins, dt_time = args
+    if cache_path is None:
+        # what we had before: a fresh dict per GetHegemony
+        cache = HegemonyCache(path=None)
+    else:
+        cache = HegemonyCache(path=cache_path)
+    hege_handler = GetHegemony(title, cache=cache, base_url=base_url,
+                               client=IHRClient(rate=None))
+    for origin in origins:
+        hege_handler.get_hegemony(str(origin), dt_time, '4', 'local')
+    return cache.counters
+
+
+def bench_hegecache(args):
+    """ Events querying overlapping local hegemony from pool workers,
+    with a per-event cache and with the shared two tier cache.
+    """
+    rnd = random.Random(0)
+    dt_time = datetime(2018, 6, 29, 11, 0)
+    origins = range(65000, 65000 + args.origins)
+    fake = FakeIHR(synthetic_hegemony_table(origins, ['2018-06-29T11:00']))
+    base_url = fake.start()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        events = [rnd.sample(origins, args.per_event) for _ in range(args.events)]
+        for name, cache_path in (('per-event', None),
+                                 ('shared', os.path.join(tmp_dir, 'hegemony.sqlite'))):
+            fake.reset_counters()
+            stime = time.time()
+            pool = Pool(args.workers)
+            counters = pool.map(_query_local_hegemony,
+                                [(base_url, cache_path, 'event_%s' % i, origins, dt_time)
+                                 for i, origins in enumerate(events)], chunksize=1)
+            pool.close()
+            pool.join()
+            total = defaultdict(int)
+            for counter in counters:
+                for key, value in counter.items():
+                    total[key] += value
+            hits = total['memory_hits'] + total['disk_hits']
+            print "%-10s %6.2fs, IHR requests: %5d, cache hits: %5d (memory %d, disk %d), " \
+                  "hit rate %.3f" % (name, time.time() - stime, fake.requests, hits,
+                                     total['memory_hits'], total['disk_hits'],
+                                     float(hits) / max(hits + total['misses'], 1))
+    finally:
+        fake.stop()
+        shutil.rmtree(tmp_dir)
+    return 0
+
+
+def legacy_local_hegemony(base_url, origin_as, dt_time, af):
+    """ What get_batch_local_hege_path used to ask IHR for one origin:
+    a point query and a +-2 hours window query on fresh connections.
+    """
+    query_time = datetime.strftime(dt_time, '%Y-%m-%dT%H:%M')
+    rsp = requests.get(base_url + "originasn=%s&af=%s&timebin=%s&format=json"
+                       % (origin_as, af, query_time)).json()
+    hegemony = dict((re['asn'], re['hege']) for re in rsp['results'])
+    gte_time = datetime.strftime(dt_time - timedelta(hours=2), '%Y-%m-%dT%H:%M')
+    lte_time = datetime.strftime(dt_time + timedelta(hours=2), '%Y-%m-%dT%H:%M')
+    rsp = requests.get(base_url + "originasn=%s&af=%s&timebin__gte=%s&timebin__lte=%s"
+                       "&format=json" % (origin_as, af, gte_time, lte_time)).json()
+    local_hege = dict()
+    for re in rsp['results']:
+        local_hege.setdefault(re['timebin'], dict())[re['asn']] = re['hege']
+    return hegemony, local_hege
+
+
+def bench_localhege(args):
+    """ Local hegemony of all origin ASes of an event: two requests per
+    origin against one pooled, paginated, concurrent window query per
+    group of origins.
+    """
+    from hegemony import GetHegemony
+    dt_time = datetime(2018, 6, 29, 11, 0)
+    timebins = [datetime.strftime(dt_time + timedelta(minutes=15 * i), '%Y-%m-%dT%H:%M')
+                for i in range(-8, 9)]
+    origins = [str(asn) for asn in range(65000, 65000 + args.origins)]
+    fake = FakeIHR(synthetic_hegemony_table([int(o) for o in origins], timebins),
+                   page_size=args.page_size, delay=args.delay)
+    base_url = fake.start()
+    try:
+        stime = time.time()
+        legacy = dict((origin_as, legacy_local_hegemony(base_url, origin_as, dt_time, '4'))
+                      for origin_as in origins)
+        legacy_time = time.time() - stime
+        legacy_requests = fake.requests
+
+        fake.reset_counters()
+        stime = time.time()
+        hege_handler = GetHegemony('bench', cache=HegemonyCache(path=None), base_url=base_url,
+                                   client=IHRClient(concurrency=args.concurrency, rate=None))
+        # start_time is 2 hours after the hegemony time
+        start_time = dt_time + timedelta(hours=hege_handler.hours_ago_before_the_event)
+        hege_handler.prefetch_local_hegemony(origins, start_time, '4')
+        batched = dict()
+        for origin_as in origins:
+            hege_paths, local_hege = hege_handler.get_batch_local_hege_path(
+                ['3356 %s' % origin_as], '192.0.2.0/24', start_time, origin_as)
+            batched[origin_as] = (hege_handler.get_hegemony(origin_as, dt_time, '4', 'local'),
+                                  local_hege)
+        batched_time = time.time() - stime
+        print "origins: %s" % len(origins)
+        print "legacy:  %6.2fs, %5d requests" % (legacy_time, legacy_requests)
+        print "batched: %6.2fs, %5d requests" % (batched_time, fake.requests)
+    finally:
+        fake.stop()
+    return 0
+
+
+def bench_ihrclient(args):
+    """ Bursts of queries against a throttling, flaky IHR stand-in,
+    without and with the client side rate limit.
+    """
+    dt_time = datetime(2018, 6, 29, 11, 0)
+    query_time = datetime.strftime(dt_time, '%Y-%m-%dT%H:%M')
+    origins = range(65000, 65000 + args.queries)
+    fake = FakeIHR(synthetic_hegemony_table(origins, [query_time]),
+                   max_rate=args.max_rate, error_rate=args.error_rate)
+    base_url = fake.start()
+    try:
+        urls = [base_url + "originasn=%s&af=4&timebin=%s&format=json" % (origin, query_time)
+                for origin in origins]
+        for name, rate in (('no limit', None), ('limited', args.max_rate * 0.9)):
+            fake.reset_counters()
+            client = IHRClient(concurrency=args.concurrency, rate=rate, burst=1,
+                               backoff=args.backoff)
+            stime = time.time()
+            responses = client.get_many(urls)
+            complete = all(len(rsp['results']) > 0 for rsp in responses)
+            print "%-9s %6.2fs, sent %4d, rejected %4d (throttled %d), retries %4d, " \
+                  "complete: %s" % (name, time.time() - stime, client.counters['requests'],
+                                    fake.rejected, client.counters['throttled'],
+                                    client.counters['retries'], complete)
+    finally:
+        fake.stop()
+    return 0
+
+
+def synthetic_paths(ases, n_paths, origin, seed=0):
+    """ as-path strings over the given transit ASes, some prepended
+    """
+    rnd = random.Random(seed)
+    paths = set()
+    while len(paths) < n_paths:
+        hops = [str(asn) for asn in rnd.sample(ases, rnd.randint(1, 5))] + [str(origin)]
+        if rnd.random() < 0.2:
+            hops = hops + [hops[-1]] * rnd.randint(1, 4)
+        paths.add(' '.join(hops))
+    return paths
+
+
+def bench_globalhege(args):
+    """ Global hege paths of prefixes with large, overlapping AS sets:
+    one giant asn= url per prefix (no pagination, like before) against
+    chunked, cached, paginated queries.
+    """
+    from hegemony import GetHegemony
+    dt_time = datetime(2018, 6, 29, 11, 0)
+    query_time = datetime.strftime(dt_time, '%Y-%m-%dT%H:%M')
+    table = synthetic_hegemony_table([64999], [query_time], ases_per_origin=args.ases // 5)
+    fake = FakeIHR(table, page_size=args.page_size)
+    base_url = fake.start()
+    rnd = random.Random(0)
+    transit = sorted(table[(0, 4, query_time)])
+    prefixes = dict()
+    for i in range(args.prefixes):
+        paths = synthetic_paths(rnd.sample(transit, int(len(transit) * 0.8)), args.paths, 64999,
+                                seed=i)
+        ases = set(asn for path in paths for asn in path.split(' '))
+        prefixes['10.%s.0.0/16' % i] = (ases, paths)
+
+    try:
+        start_time = dt_time + timedelta(hours=2)
+        # one url per prefix, first page only
+        max_url = 0
+        stime = time.time()
+        for pfx, (ases, paths) in sorted(prefixes.items()):
+            url = base_url + "originasn=0&af=4&timebin=%s&format=json&asn=%s" \
+                % (query_time, ','.join(ases))
+            max_url = max(max_url, len(url))
+            hegemony = dict((str(r['asn']), r['hege']) for r in requests.get(url).json()['results'])
+            hege_paths = []
+            for path in paths:
+                path = path.split(' ')
+                new_path = [v for i, v in enumerate(path) if i == 0 or v != path[i - 1]]
+                hege_paths.append((new_path, [hegemony.get(asn, 0) for asn in new_path]))
+        print "single url: %6.2fs, %5d requests, %9d bytes, longest url %6d" \
+            % (time.time() - stime, fake.requests, fake.bytes_sent, max_url)
+
+        fake.reset_counters()
+        hege_handler = GetHegemony('bench', cache=HegemonyCache(path=None), base_url=base_url,
+                                   client=IHRClient(rate=None))
+        stime = time.time()
+        for pfx, (ases, paths) in sorted(prefixes.items()):
+            hege_handler.get_batch_global_hege_path(ases, paths, pfx, start_time)
+        print "chunked:    %6.2fs, %5d requests, %9d bytes" \
+            % (time.time() - stime, fake.requests, fake.bytes_sent)
+    finally:
+        fake.stop()
+    return 0
+
+
+def legacy_group_paths(as_paths):
+    """ The grouping collect_hege_paths did before pathnorm, including
+    the split and de-prepend get_batch_*_hege_path did on every path.
+    """
+    unique_ases_global = dict()
+    unique_paths_global = dict()
+    u_paths_local = dict()
+    for col, P in as_paths.iteritems():
+        for peer, A in P.iteritems():
+            for prefix, all_paths in A.iteritems():
+                for timestamp, r_type, path in all_paths:
+                    if r_type == 'withdrawal':
+                        continue
+                    if prefix not in unique_ases_global:
+                        unique_ases_global[prefix] = set()
+                    for _p in path.split(' '):
+                        if '{' in _p:
+                            _p = _p[1:-1]
+                        unique_ases_global[prefix].add(_p)
+                    if prefix not in unique_paths_global:
+                        unique_paths_global[prefix] = set()
+                    unique_paths_global[prefix].add(path)
+                    if prefix not in u_paths_local:
+                        u_paths_local[prefix] = dict()
+                    origin_as = path.split(' ')[-1]
+                    if origin_as not in u_paths_local[prefix]:
+                        u_paths_local[prefix][origin_as] = set()
+                    u_paths_local[prefix][origin_as].add(path)
+    for groups in [unique_paths_global] + u_paths_local.values():
+        for paths in groups.values():
+            for path in paths:
+                path = path.split(' ')
+                [v for i, v in enumerate(path) if i == 0 or v != path[i - 1]]
+    return unique_ases_global, unique_paths_global, u_paths_local
+
+
+def load_as_paths(directory, largest):
+    """ (title, ASPaths) of the largest events in a directory
+    """
+    fpaths = sorted(glob.glob(os.path.join(directory, '*.pickle')),
+                    key=os.path.getsize, reverse=True)[:largest]
+    for fpath in fpaths:
+        with open(fpath, 'r') as f:
+            event = pickle.load(f)
+        if 'as_paths' in event:
+            yield os.path.basename(fpath).split('.pickle')[0], ASPaths.from_nested(event['as_paths'])
+
+
+def legacy_overlapping(parsed, prefix):
+    """ Less and more specifics of prefix, by comparing it with every
+    prefix of parsed, [(prefix, parse_prefix(prefix))]
+    """
+    bits, network, length = parse_prefix(prefix)
+    found = []
+    for other, (other_bits, other_network, other_length) in parsed:
+        if other_bits != bits or other == prefix:
+            continue
+        shift = bits - min(length, other_length)
+        if network >> shift == other_network >> shift:
+            found.append(other)
+    return found
+
+
+def bench_prefixindex(args):
+    """ Less and more specifics among the prefixes of the largest events
+    (as_paths and pfxes_of_hijacker), PrefixTrie against a pairwise scan,
+    for the prefixes of as_paths and --queries random ones.
+    """
+    rnd = random.Random(0)
+    fpaths = sorted(glob.glob(os.path.join(args.directory, '*.pickle')),
+                    key=os.path.getsize, reverse=True)[:args.largest]
+    for fpath in fpaths:
+        with open(fpath, 'r') as f:
+            event = pickle.load(f)
+        if 'as_paths' not in event:
+            continue
+        as_paths = ASPaths.from_nested(event['as_paths'])
+        prefixes_of = dict(event['pfxes_of_hijacker'])
+        known = sorted(set(prefix for prefixes in prefixes_of.values() for prefix in prefixes) |
+                       set(as_paths.prefixes))
+        queries = list(as_paths.prefixes) + rnd.sample(known, min(args.queries, len(known)))
+
+        parsed = [(prefix, parse_prefix(prefix)) for prefix in known]
+        stime = time.time()
+        for prefix in queries:
+            legacy_overlapping(parsed, prefix)
+        legacy_time = time.time() - stime
+        stime = time.time()
+        trie = prefix_origins(prefixes_of)
+        for prefix in as_paths.prefixes:
+            trie.setdefault(prefix, set())
+        build_time = time.time() - stime
+        stime = time.time()
+        for prefix in queries:
+            list(trie.overlapping(prefix))
+        query_time = time.time() - stime
+
+        legacy_query = legacy_time / len(queries)
+        trie_query = query_time / len(queries)
+        print "%-20s %6s prefixes: per query pairwise %.2fms, trie %.3fms (x%.0f), " \
+            "trie built in %.2fs (worth it from %d queries)" % \
+            (os.path.basename(fpath)[:-len('.pickle')], len(known), legacy_query * 1000,
+             trie_query * 1000, legacy_query / max(trie_query, 1e-9), build_time,
+             build_time / max(legacy_query - trie_query, 1e-9))
+    return 0
+
+
+def synthetic_as2pfx(n_asns, n_prefixes, seed=0):
+    """ {asn (str): [prefix, ..]}, a few ASes with most prefixes like in
+    the routing table
+    """
+    rnd = random.Random(seed)
+    asns = rnd.sample(xrange(1, 400000), n_asns)
+    weights = [rnd.paretovariate(1.2) for asn in asns]
+    total = sum(weights)
+    as2pfx = dict()
+    k = 0
+    for asn, weight in zip(asns, weights):
+        prefixes = []
+        for i in range(max(1, int(n_prefixes * weight / total))):
+            prefixes.append('%d.%d.%d.0/24' % (1 + (k >> 16) % 223, (k >> 8) & 255, k & 255))
+            k += 1
+        as2pfx[str(asn)] = prefixes
+    return as2pfx
+
+
+# ru_maxrss would keep the peak of the benchmark, it is kept across exec
+IMPORT_COLLECTOR = """
+import time
+stime = time.time()
+import collector
+%s
+seconds = time.time() - stime
+with open('/proc/self/status') as f:
+    peak = [line.split()[1] for line in f if line.startswith('VmHWM:')][0]
+print seconds, peak
+"""
+
+
+def _import_collector(code, directory, repeat):
+    """ :return: (best seconds, peak RSS in kB) of importing collector and
+                 running code in a new interpreter in directory (Linux)
+    """
+    env = dict(os.environ)
+    paths = [os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH')]
+    env['PYTHONPATH'] = os.pathsep.join(path for path in paths if path)
+    measures = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', IMPORT_COLLECTOR % code],
+                                      cwd=directory, env=env)
+        seconds, rss = out.split()[-2:]
+        measures.append((float(seconds), int(rss)))
+    return min(measures)
+
+
+def bench_prefixstore(args):
+    """ import collector when it unpickled asn2pfx.pickle, against the
+    lazy memory-mapped store, on a synthetic map of the size of the
+    routing table. And lookups in the dict against the store.
+    """
+    from prefixstore import convert, PrefixStore
+    as2pfx = synthetic_as2pfx(args.asns, args.prefixes)
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, 'asn2pfx.pickle'), 'wb') as f:
+            pickle.dump(as2pfx, f, pickle.HIGHEST_PROTOCOL)
+        stime = time.time()
+        convert(os.path.join(directory, 'asn2pfx.pickle'), os.path.join(directory, 'asn2pfx.store'))
+        print "%s ASNs, %s prefixes: converted in %.2fs, pickle %.1f MB, store %.1f MB" % \
+            (len(as2pfx), sum(len(prefixes) for prefixes in as2pfx.values()), time.time() - stime,
+             os.path.getsize(os.path.join(directory, 'asn2pfx.pickle')) / 1e6,
+             os.path.getsize(os.path.join(directory, 'asn2pfx.store')) / 1e6)
+
+        asn = sorted(as2pfx)[0]
+        for name, code in (('unpickled at import', "import pickle\n"
+                            "with open('asn2pfx.pickle', 'r') as f:\n"
+                            "    collector.AS2PFX = pickle.load(f)"),
+                           ('lazy store', ''),
+                           ('lazy store, a lookup', "collector.AS2PFX.get('%s')" % asn)):
+            seconds, rss = _import_collector(code, directory, args.repeat)
+            print "import collector, %-20s %.3fs, peak RSS %6.1f MB" % (name, seconds, rss / 1024.0)
+
+        rnd = random.Random(0)
+        asns = [rnd.choice([str(rnd.randint(1, 400000)), rnd.choice(as2pfx.keys())])
+                for i in range(args.lookups)]
+        store = PrefixStore(os.path.join(directory, 'asn2pfx.store'))
+        stime = time.time()
+        for asn in asns:
+            as2pfx.get(asn)
+        dict_time = time.time() - stime
+        stime = time.time()
+        for asn in asns:
+            store.get(asn)
+        store_time = time.time() - stime
+        store.close()
+        print "%s lookups: dict %.1fus, store %.1fus per lookup" % \
+            (len(asns), dict_time / len(asns) * 1e6, store_time / len(asns) * 1e6)
+        return 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def legacy_snapshot(as_paths, t):
+    """ RIB at t by walking every time line, withdrawals included
+    """
+    snapshot = dict()
+    for collector, P in as_paths.items():
+        for peer, A in P.items():
+            for prefix, entries in A.items():
+                path = None
+                for timestamp, record_type, as_path in entries:
+                    if timestamp > t:
+                        break
+                    path = None if record_type == 'withdrawal' else as_path
+                if path is not None:
+                    snapshot[(collector, peer, prefix)] = path
+    return snapshot
+
+
+def legacy_propagation_over_time(as_paths, asns, start, end, step):
+    """ propagation_over_time with the RIB of every window built again
+    """
+    asns = set(int(asn) for asn in asns if str(asn).isdigit())
+    peers = set((collector, peer) for collector, P in as_paths.items() for peer in P)
+    shares = []
+    t = start
+    while t <= end:
+        reached = set(key[:2] for key, path in legacy_snapshot(as_paths, t).items()
+                      if not asns.isdisjoint(path_to_asns(path)))
+        shares.append((t, len(reached) / float(max(len(peers), 1))))
+        t += step
+    return shares
+
+
+def bench_ribs(args):
+    """ Share of the peers with a path through the hijackers every --step
+    seconds of the largest events, RIB of each window built by walking
+    as_paths against the changes between windows (ribs.RibHistory).
+    And snapshots at a few times, walk against binary searches.
+    """
+    from ribs import RibHistory, propagation_over_time
+    for title, as_paths in load_as_paths(args.directory, args.largest):
+        with open(os.path.join(args.directory, title + '.pickle'), 'r') as f:
+            hijackers = str(pickle.load(f)['hijack_as']).split(', ')
+        start, end = min(as_paths.times), max(as_paths.times)
+        times = [start + (end - start) * i // 4 for i in range(5)]
+
+        stime = time.time()
+        for t in times:
+            legacy_snapshot(as_paths, t)
+        legacy_propagation_over_time(as_paths, hijackers, start, end, args.step)
+        legacy_time = time.time() - stime
+        stime = time.time()
+        history = RibHistory(as_paths)
+        for t in times:
+            history.snapshot(t)
+        snapshot_time = time.time() - stime
+        stime = time.time()
+        shares = propagation_over_time(history, hijackers, start, end, args.step)
+        windows_time = time.time() - stime
+
+        print "%-20s %6s rows %4s windows: walking %.3fs, snapshots %.3fs + windows %.3fs " \
+            "(x%.1f)" % (title, len(as_paths.times), len(shares), legacy_time, snapshot_time,
+                         windows_time, legacy_time / max(snapshot_time + windows_time, 1e-9))
+    return 0
+
+
+def legacy_events_on_path(directory, asns):
+    """ {asn: titles of the events with asn on a path}, unpickling and
+    scanning every event of a directory, before eventindex
+    """
+    found = dict((asn, set()) for asn in asns)
+    for fpath in glob.glob(os.path.join(directory, '*.pickle')):
+        with open(fpath, 'r') as f:
+            event = pickle.load(f)
+        if 'as_paths' not in event:
+            continue
+        title = os.path.basename(fpath).split('.pickle')[0]
+        as_paths = ASPaths.from_nested(event['as_paths'])
+        for i in set(as_paths.path_ids):
+            for asn in path_to_asns(as_paths.paths[i]):
+                if asn in found:
+                    found[asn].add(title)
+    return found
+
+
+def bench_eventindex(args):
+    """ Events with an ASN on path, for --queries ASNs: a scan of all the
+    pickles of --directory against eventindex queries. And the time to
+    build the index, and to update it when nothing changed.
+    """
+    from eventindex import EventIndex
+    tmp_directory = tempfile.mkdtemp()
+    try:
+        index = EventIndex(os.path.join(tmp_directory, 'index.sqlite'))
+        stime = time.time()
+        indexed = index.update(args.directory, args.processes)
+        build_time = time.time() - stime
+        stime = time.time()
+        index.update(args.directory, args.processes)
+        update_time = time.time() - stime
+        print "index of %s events: built in %.1fs (%.1f MB), update with no change %.3fs" \
+            % (len(indexed), build_time, os.path.getsize(index.path) / 1e6, update_time)
+
+        asns = sorted(row[0] for row in index._connection().execute(
+            "SELECT DISTINCT asn FROM path_asns"))
+        random.seed(0)
+        asns = random.sample(asns, min(args.queries, len(asns)))
+        stime = time.time()
+        legacy_events_on_path(args.directory, asns)
+        scan_time = time.time() - stime
+        stime = time.time()
+        for asn in asns:
+            index.by_asn(asn)
+        query_time = (time.time() - stime) / max(len(asns), 1)
+    finally:
+        shutil.rmtree(tmp_directory)
+    print "%s ASNs: scan of all events %.1fs, index %.1fms per ASN" \
+        % (len(asns), scan_time, query_time * 1000)
+    return 0
+
+
+def bench_pathnorm(args):
+    """ Paths per second grouped for the hegemony stage, before and
+    after pathnorm, on the largest collections.
+    """
+    print "%-24s %8s %8s %12s %12s" % ('event', 'entries', 'paths', 'legacy/s', 'pathnorm/s')
+    for title, as_paths in load_as_paths(args.directory, args.largest):
+        entries = sum(1 for e in as_paths.iter_entries() if e[4] != 'withdrawal')
+        legacy_time, new_time = None, None
+        for _ in range(args.repeat):
+            stime = time.time()
+            legacy_group_paths(as_paths)
+            elapsed = time.time() - stime
+            legacy_time = elapsed if legacy_time is None else min(legacy_time, elapsed)
+            stime = time.time()
+            group_paths(as_paths)
+            elapsed = time.time() - stime
+            new_time = elapsed if new_time is None else min(new_time, elapsed)
+        print "%-24s %8d %8d %12.0f %12.0f" % \
+            (title, entries, len(as_paths.paths), entries / max(legacy_time, 1e-6),
+             entries / max(new_time, 1e-6))
+    return 0
+
+
+def bench_stream(args):
+    """ Replay canned records through HistoBGPStream: materializing the
+    paths and aggregating them afterwards (as get_all_prefixes_given_as
+    did) against feeding the sinks while the stream is read.
+    """
+    if args.stream:
+        elems = read_elem_stream(args.stream)
+    else:
+        elems = synthetic_elem_stream(args.elems, args.keys, args.disorder)
+    records = records_from_elems(elems)
+
+    stime = time.time()
+    paths = HistoBGPStream(FakeBGPStream(records), FakeBGPRecord()).get_bgpstream(0, None)
+    legacy = dict()
+    for collector, peer, pfx, t, r_type, path in paths.iter_entries():
+        if r_type != 'withdrawal':
+            legacy.setdefault(path.split(' ')[-1], set()).add(pfx)
+    legacy_time = time.time() - stime
+    legacy_size = deep_sizeof(paths)
+
+    stime = time.time()
+    stream = HistoBGPStream(FakeBGPStream(records), FakeBGPRecord())
+    prefixes = PrefixOriginSink()
+    stream.consume(0, None, [prefixes])
+    sink_time = time.time() - stime
+    sink_size = deep_sizeof(prefixes.prefixes)
+
+    print "records: %s, elems: %s" % (len(records), len(elems))
+    print "materialized: %.3fs, %.1f KB held" % (legacy_time, legacy_size / 1024.0)
+    print "streamed:     %.3fs, %.1f KB held" % (sink_time, sink_size / 1024.0)
+    return 0
+
+
+def bench_cluster(args):
+    """ One stream per event against one stream per cluster of events
+    with overlapping intervals (collector.plan_streams), on canned
+    records covering every event.
+    """
+    from collector import plan_streams, collect_stream
+    rnd = random.Random(0)
+    convert = HistoBGPStream(FakeBGPStream([]), FakeBGPRecord()).convert_dt_to_timestamp
+    base = datetime(2017, 1, 1)
+    events = []
+    elems = []
+    for i in range(args.events):
+        # families of events a few hours apart, like backconnect_1..6
+        start_time = base + timedelta(days=(i // args.family) * 3,
+                                      hours=rnd.randint(0, 6))
+        prefix, hijacker = '10.%s.0.0/24' % i, str(64512 + i)
+        events.append({'title': 'synthetic_%s' % i, 'hijack_prefix': prefix,
+                       'hijack_as': hijacker, 'innocent_as': '', 'victim_as': '64500',
+                       'start_time': str(start_time), 'end_time': ''})
+        elems.extend(synthetic_event_elems(convert(start_time), args.elems, prefix, hijacker, seed=i))
+    elems.sort(key=lambda elem: elem[3])
+    records = records_from_elems(elems)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        stime = time.time()
+        records_alone = 0
+        for event in events:
+            source = FakeBGPSource(records)
+            HistoBGPStream(source=source).collect_events(
+                [(event['hijack_prefix'], event['hijack_as'], event['start_time'], None)])
+            records_alone += source.records_read()
+        alone_time = time.time() - stime
+
+        for event in events:
+            EventStore(tmpdir, event['title']).write_event(event)
+        stime = time.time()
+        clusters = plan_streams([{'title': event['title']} for event in events], tmpdir,
+                                HistoBGPStream(FakeBGPStream([]), FakeBGPRecord()))
+        records_clustered = 0
+        counted_alone = 0
+        for cluster in clusters:
+            source = FakeBGPSource(records)
+            titles, records_read, records_each = collect_stream(cluster, tmpdir,
+                                                                HistoBGPStream(source=source))
+            records_clustered += source.records_read()
+            counted_alone += records_each
+        clustered_time = time.time() - stime
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print "events: %s, streams: %s, records: %s" % (len(events), len(clusters), len(records))
+    print "stream per event:   %.3fs, %.0f records decoded per event" % \
+        (alone_time, float(records_alone) / len(events))
+    print "stream per cluster: %.3fs, %.0f records decoded per event " \
+        "(%.0f per event alone, counted on the cluster streams)" % \
+        (clustered_time, float(records_clustered) / len(events),
+         float(counted_alone) / len(events))
+    return 0
+
+
+def bench_shards(args):
+    """ get_bgpstream of a long interval read sequentially and in
+    shards by 1/2/4/8 processes from a fake record source.
+    """
+    rnd = random.Random(0)
+    start = 1500000000
+    end = start + args.days * 86400
+    collectors = ['rrc%02d' % i for i in range(args.collectors)]
+    prefixes = ['10.%s.%s.0/24' % (i // 256, i % 256) for i in range(args.prefixes)]
+    paths = ['3356 174 %s' % asn for asn in range(64500, 64510)] + \
+        ['1299 %s' % asn for asn in range(64500, 64505)]
+    elems = []
+    for timestamp in sorted(rnd.randint(start, end) for i in range(args.elems)):
+        collector = rnd.choice(collectors)
+        peer = '10.0.%s.%s' % (collectors.index(collector), rnd.randint(0, 9))
+        if rnd.random() < 0.05:
+            record_type, as_path = 'withdrawal', ''
+        else:
+            record_type, as_path = 'updates', rnd.choice(paths)
+        elems.append((collector, peer, rnd.choice(prefixes), timestamp, record_type, as_path))
+    source = FakeBGPSource(records_from_elems(elems), args.decode_delay)
+
+    stime = time.time()
+    handler = HistoBGPStream(*source())
+    handler.get_bgpstream(start, end)
+    sequential_time = time.time() - stime
+    print "elems: %s, records: %s, sequential: %.3fs" % \
+        (len(elems), len(source.records), sequential_time)
+
+    for processes in args.processes:
+        for sharding, collector_shards in (('time', None), ('time+collector', collectors)):
+            stime = time.time()
+            stream, record = source()
+            handler = HistoBGPStream(stream, record, processes=processes,
+                                     shard_seconds=args.shard_hours * 3600,
+                                     collectors=collector_shards, source=source)
+            handler.get_bgpstream(start, end)
+            elapsed = time.time() - stime
+            print "%s processes, %-14s shards: %.3fs (x%.2f)" % \
+                (processes, sharding, elapsed, sequential_time / elapsed)
+    return 0
+
+
+def bench_elemcache(args):
+    """ An event read from the stream, recorded to a cold cache, replayed
+    from the warm cache, with a longer window partly replayed, and the
+    paths of one collector replayed from the all-collector segment.
+    """
+    start_time = '2017-01-01 12:00:00'
+    convert = HistoBGPStream(FakeBGPStream([]), FakeBGPRecord()).convert_dt_to_timestamp
+    start = convert(start_time)
+    hijack_prefix, hijacker = '10.0.0.0/24', '64512'
+    # a day of elems around the event
+    elems = synthetic_event_elems(start, args.elems, hijack_prefix, hijacker)
+    elems.extend(synthetic_event_elems(start + 13 * 3600, args.elems, hijack_prefix, hijacker, seed=1))
+    elems.sort(key=lambda elem: elem[3])
+    source = FakeBGPSource(records_from_elems(elems), args.decode_delay)
+
+    def collect(cache, end_time=None, collector=None):
+        handler = HistoBGPStream(*source(), source=source, cache=cache)
+        if collector is not None:
+            # the filter of the first pass of collect_events, for one collector
+            handler.set_filter('prefix less %s' % hijack_prefix)
+            handler.set_filter('collector %s' % collector)
+            paths = handler.get_paths(start_time, end_time)
+            return [list(paths.iter_entries())]
+        paths, prefixes = handler.collect_events([(hijack_prefix, hijacker, start_time,
+                                                   end_time)])[0]
+        return [list(paths.iter_entries()), dict((k, sorted(v)) for k, v in prefixes.items())]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = ElemCache(tmpdir)
+        for name, use_cache, end_time, collector in (
+                ('no cache', False, None, None),
+                ('cold cache', True, None, None),
+                ('warm cache', True, None, None),
+                ('longer window', True, '2017-01-01 20:00:00', None),
+                ('one collector', True, '2017-01-01 20:00:00', 'rrc03')):
+            source.streams = []
+            collect(None, end_time, collector)
+            uncached_records = source.records_read()
+            source.streams = []
+            stime = time.time()
+            collect(cache if use_cache else None, end_time, collector)
+            elapsed = time.time() - stime
+            print "%-14s %.3fs, %6s records decoded (%6s without cache)" % \
+                (name + ':', elapsed, source.records_read(), uncached_records)
+        size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(tmpdir, '*', '*.seg')))
+        print "cache: %.1f KB, %s elems recorded, %s replayed" % \
+            (size / 1024.0, cache.counters['recorded'], cache.counters['replayed'])
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+class _Crash(Exception):
+    pass
+
+
+class _CrashingStream(FakeBGPStream):
+    """ Dies after decoding crash_after records
+    """
+    def __init__(self, records, decode_delay, times, crash_after):
+        FakeBGPStream.__init__(self, records, decode_delay, times)
+        self.crash_after = crash_after
+
+    def get_next_record(self, rec):
+        if self.crash_after is not None and self.records_read >= self.crash_after:
+            raise _Crash()
+        return FakeBGPStream.get_next_record(self, rec)
+
+
+def bench_checkpoint(args):
+    """ An event collected by runs that crash and resume from checkpoints,
+    against an uninterrupted run.
+    """
+    start_time = '2017-01-01 12:00:00'
+    convert = HistoBGPStream(FakeBGPStream([]), FakeBGPRecord()).convert_dt_to_timestamp
+    start = convert(start_time)
+    hijack_prefix, hijacker = '10.0.0.0/24', '64512'
+    source = FakeBGPSource(records_from_elems(
+        synthetic_event_elems(start, args.elems, hijack_prefix, hijacker)), args.decode_delay)
+    rnd = random.Random(0)
+
+    # of the last collect, collect_events reads a second one from crashing_source
+    streams = []
+
+    def collect(stage, checkpoint=None, crash_after=None):
+        del streams[:]
+
+        def crashing_source():
+            streams.append(_CrashingStream(source.records, source.decode_delay, source.times,
+                                           crash_after))
+            return streams[-1], FakeBGPRecord()
+
+        handler = HistoBGPStream(source=crashing_source, checkpoint=checkpoint)
+        if stage == 'get_paths':
+            handler.set_filter('prefix less ' + hijack_prefix)
+            result = [list(handler.get_paths(start_time).iter_entries())]
+        else:
+            paths, prefixes = handler.collect_events([(hijack_prefix, hijacker, start_time,
+                                                       None)])[0]
+            result = [list(paths.iter_entries()), dict((k, sorted(v)) for k, v in prefixes.items())]
+        return result, sum(stream.records_read for stream in streams)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for stage in ('get_paths', 'collect_events'):
+            stime = time.time()
+            result, records = collect(stage)
+            plain_time = time.time() - stime
+            path = os.path.join(tmpdir, stage + '.checkpoint')
+            stime = time.time()
+            checkpoint = Checkpoint(path, args.interval)
+            collect(stage, checkpoint)
+            checkpointed_time = time.time() - stime
+
+            crashes, decoded, saved = 0, 0, 0
+            stime = time.time()
+            while True:
+                crash_after = rnd.randint(1, records // (args.crashes + 1)) \
+                    if crashes < args.crashes else None
+                checkpoint = Checkpoint(path, args.interval)
+                try:
+                    result, read = collect(stage, checkpoint, crash_after)
+                except _Crash:
+                    crashes += 1
+                    decoded += sum(stream.records_read for stream in streams)
+                    saved += checkpoint.saved
+                    continue
+                decoded += read
+                saved += checkpoint.saved
+                break
+            resumed_time = time.time() - stime
+            print "%-13s %s records, uninterrupted %.3fs, with checkpoints %.3fs" % \
+                (stage + ':', records, plain_time, checkpointed_time)
+            print "%-13s %s crashes, %s checkpoints, %s records decoded, %.3fs" % \
+                ('', crashes, saved, decoded, resumed_time)
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+# elems of the stream of an event
+SIZE_CLASSES = (('small', 2000), ('medium', 20000), ('large', None))
+BASELINE_PATH = 'benchmark_baseline.json'
+
+
+def size_class(entries):
+    for name, limit in SIZE_CLASSES:
+        if limit is None or entries < limit:
+            return name
+
+
+def _canonical_hege_paths(paths):
+    """ {prefix: [(path, heges)] or {origin: [(path, heges)]}} in a stable order
+    """
+    canonical = dict()
+    for prefix, value in paths.items():
+        if isinstance(value, dict):
+            canonical[prefix] = _canonical_hege_paths(value)
+        else:
+            hege_paths = value[0] if isinstance(value, tuple) else value
+            canonical[prefix] = sorted([list(path), list(heges)] for path, heges in hege_paths)
+    return canonical
+
+
+def _offline_event(args):
+    """ Collect a recorded event again, offline: BGPStream replays its
+    as_paths and pfxes_of_hijacker, a FakeIHR serves its hegemony.
+    Runs in a pool worker of its own, for its memory peak.
+    :return: dict of measures, see bench_offline
+    """
+    fpath, directory = args
+    from collector import Collect, normalize_event
+    from hegemony import GetHegemony
+    import resource
+    import metrics
+    with open(fpath, 'r') as f:
+        recorded = normalize_event(pickle.load(f))
+    recorded['as_paths'] = ASPaths.from_nested(recorded['as_paths'])
+    entries = sorted(recorded['as_paths'].iter_entries())
+    event = dict((name, value) for name, value in recorded.items()
+                 if name in ('title', 'hijack_prefix', 'hijack_as', 'victim_as', 'innocent_as',
+                             'start_time', 'end_time'))
+    event.setdefault('innocent_as', '')
+    event.setdefault('end_time', '')
+    handler = HistoBGPStream(FakeBGPStream([]), FakeBGPRecord())
+    prefixes_start, prefixes_end = handler.get_prefixes_interval(event['start_time'])
+    elems = elems_from_event(recorded, prefixes_end - 1800)
+    source = FakeBGPSource(records_from_elems(elems))
+    timebin = datetime.strftime(GetHegemony('offline').get_hege_time(event['start_time']),
+                                '%Y-%m-%dT%H:%M')
+    fake = FakeIHR(hegemony_table_from_event(recorded, timebin))
+    base_url = fake.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    metrics.reset()
+    try:
+        collect = Collect(event, directory, source=source, cache_directory=None,
+                          hegemony_args={'base_url': base_url, 'cache': HegemonyCache(None),
+                                         'client': IHRClient(rate=None)})
+        seconds = dict()
+        for stage, function in (('as_paths', collect.collect_bgp_stream),
+                                ('pfxes_of_hijacker', collect.collect_prefixes),
+                                ('hegemony', collect.collect_hege_paths)):
+            stime = time.time()
+            event = function()
+            seconds[stage] = time.time() - stime
+    finally:
+        fake.stop()
+    counters = metrics.snapshot()
+
+    prefixes = dict((asn, sorted(p)) for asn, p in event['pfxes_of_hijacker'].items())
+    results = {'as_paths': sorted(event['as_paths'].iter_entries()),
+               'pfxes_of_hijacker': prefixes,
+               'global_paths': _canonical_hege_paths(event['global_paths']),
+               'local_paths': _canonical_hege_paths(event['local_paths'])}
+    recorded_prefixes = dict((asn, sorted(p)) for asn, p in
+                             recorded.get('pfxes_of_hijacker', {}).items())
+    return {'title': recorded['title'], 'entries': len(entries), 'class': size_class(len(elems)),
+            'elems': len(elems), 'records_read': source.records_read(),
+            'elems_read': counters.get('bgpstream_elems_total', 0),
+            'seconds': seconds, 'ihr_requests': fake.requests, 'ihr_bytes': fake.bytes_sent,
+            'rss_before_kb': rss_before,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'digest': hashlib.sha1(json.dumps(results, sort_keys=True)).hexdigest(),
+            'same_as_recorded': {'as_paths': results['as_paths'] == entries,
+                                 'pfxes_of_hijacker': prefixes == recorded_prefixes}}
+
+
+def summarize_offline(measures):
+    """ :return: {size class: totals of its events}
+    """
+    classes = dict()
+    for measure in measures:
+        summary = classes.setdefault(measure['class'], {
+            'events': 0, 'entries': 0, 'elems_read': 0, 'stream_seconds': 0.0,
+            'hegemony_seconds': 0.0, 'ihr_requests': 0, 'ihr_bytes': 0, 'peak_rss_kb': 0})
+        summary['events'] += 1
+        summary['entries'] += measure['entries']
+        summary['elems_read'] += measure['elems_read']
+        summary['stream_seconds'] += measure['seconds']['as_paths'] + \
+            measure['seconds']['pfxes_of_hijacker']
+        summary['hegemony_seconds'] += measure['seconds']['hegemony']
+        summary['ihr_requests'] += measure['ihr_requests']
+        summary['ihr_bytes'] += measure['ihr_bytes']
+        summary['peak_rss_kb'] = max(summary['peak_rss_kb'], measure['peak_rss_kb'])
+    for summary in classes.values():
+        summary['elems_per_second'] = summary['elems_read'] / max(summary['stream_seconds'], 1e-9)
+        summary['entries_per_hegemony_second'] = \
+            summary['entries'] / max(summary['hegemony_seconds'], 1e-9)
+    return classes
+
+
+def compare_offline(measures, classes, baseline, tolerance):
+    """ :return: list of differences from the baseline
+    """
+    problems = []
+    for measure in measures:
+        expected = baseline['events'].get(measure['title'])
+        if expected is None:
+            continue
+        if measure['digest'] != expected['digest']:
+            problems.append("%s: results differ from the baseline" % measure['title'])
+        if measure['ihr_requests'] > expected['ihr_requests']:
+            problems.append("%s: %s IHR requests, %s in the baseline"
+                            % (measure['title'], measure['ihr_requests'], expected['ihr_requests']))
+    for name, summary in classes.items():
+        expected = baseline['classes'].get(name)
+        if expected is None:
+            continue
+        for rate in ('elems_per_second', 'entries_per_hegemony_second'):
+            if summary[rate] < expected[rate] * (1 - tolerance):
+                problems.append("%s events: %s %.0f, %.0f in the baseline"
+                                % (name, rate, summary[rate], expected[rate]))
+    return problems
+
+
+def bench_offline(args):
+    """ Collect.collect_bgp_stream, collect_prefixes and collect_hege_paths
+    end to end on the recorded events of a directory, with stand-ins
+    derived from them (see _offline_event), compared to a baseline.
+    """
+    paths = sorted(glob.glob(os.path.join(args.directory, '*.pickle')), key=os.path.getsize)
+    if args.titles:
+        paths = [path for path in paths
+                 if os.path.basename(path)[:-len('.pickle')] in args.titles]
+    if args.limit:
+        paths = paths[:args.limit]
+    tmpdir = tempfile.mkdtemp()
+    # a process per event, for its memory peak
+    pool = Pool(processes=1, maxtasksperchild=1)
+    try:
+        measures = pool.map(_offline_event, [(path, tmpdir) for path in paths], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmpdir)
+
+    if args.verbose:
+        for measure in measures:
+            print "%-26s %-6s %7s elems %6.2fs stream %6.2fs hegemony %4s requests %7s KB rss, " \
+                "same as recorded: %s" % \
+                (measure['title'], measure['class'], measure['elems'],
+                 measure['seconds']['as_paths'] + measure['seconds']['pfxes_of_hijacker'],
+                 measure['seconds']['hegemony'], measure['ihr_requests'], measure['peak_rss_kb'],
+                 ', '.join(name for name, same in sorted(measure['same_as_recorded'].items())
+                           if same) or 'none')
+    classes = summarize_offline(measures)
+    for name, limit in SIZE_CLASSES:
+        if name not in classes:
+            continue
+        summary = classes[name]
+        print "%-6s %3s events, %8s entries: stream %9.0f elems/s, hegemony %8.0f entries/s, " \
+            "%5s IHR requests (%.0f KB), peak rss %s KB" % \
+            (name, summary['events'], summary['entries'], summary['elems_per_second'],
+             summary['entries_per_hegemony_second'], summary['ihr_requests'],
+             summary['ihr_bytes'] / 1024.0, summary['peak_rss_kb'])
+
+    if args.update_baseline:
+        baseline = {'events': dict((measure['title'], {'digest': measure['digest'],
+                                                       'ihr_requests': measure['ihr_requests']})
+                                   for measure in measures),
+                    'classes': classes}
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+        print "baseline written to %s" % args.baseline
+        return 0
+    if not os.path.exists(args.baseline):
+        print "no baseline %s, --update-baseline writes one" % args.baseline
+        return 0
+    if args.titles or args.limit:
+        # the throughput of a class is only comparable over all its events
+        classes = dict()
+    with open(args.baseline, 'r') as f:
+        problems = compare_offline(measures, classes, json.load(f), args.tolerance)
+    for problem in problems:
+        print problem
+    print "%s differences from %s" % (len(problems), args.baseline)
+    return 1 if problems else 0
+
+
+def bench_features(args):
+    """ features.py over the events of a directory: events per second
+    (tests/test_features.py checks the columns against the results file).
+    """
+    from features import extract_all
+    stime = time.time()
+    results = extract_all(args.directory, processes=args.processes)
+    seconds = time.time() - stime
+    extracted = sum(1 for title, row in results if row is not None)
+    print "%s events (%s skipped) in %.1fs with %s processes: %.1f events/s" % \
+        (extracted, len(results) - extracted, seconds, args.processes, extracted / seconds)
+    return 0
+
+
+def _sleep_stage(seconds, name):
+    time.sleep(seconds)
+    return name
+
+
+def _legacy_event(stream_seconds, hegemony_seconds, name):
+    time.sleep(stream_seconds + hegemony_seconds)
+    return name
+
+
+def bench_schedule(args):
+    """ Makespan and utilization of Pool.imap_unordered(chunksize=3) over
+    events in directory order, against the Scheduler (heaviest first,
+    separate stream and hegemony pools), with stages that sleep.
+    """
+    rnd = random.Random(0)
+    events = []
+    for i in range(args.events):
+        # a family of heavy prepend events next to each other, as in collections/
+        heavy = i >= args.events // 2 and i < args.events // 2 + args.heavy
+        stream = args.scale * rnd.uniform(0.5, 1.5) * (3 if heavy else 1)
+        hegemony = args.scale * rnd.lognormvariate(0, 0.7) * (15 if heavy else 1)
+        events.append(('event_%03d' % i, stream, hegemony))
+    total = sum(stream + hegemony for name, stream, hegemony in events)
+
+    stime = time.time()
+    busy = 0.0
+    pool = Pool(processes=args.processes)
+    for result, start, end, error in pool.imap_unordered(
+            _run_timed, ((_legacy_event, (stream, hegemony, name))
+                         for name, stream, hegemony in events), chunksize=3):
+        busy += end - start
+    pool.close()
+    pool.join()
+    legacy_makespan = time.time() - stime
+    print "events: %s, work: %.1fs, lower bound on %s processes: %.2fs" % \
+        (len(events), total, args.processes, total / args.processes)
+    print "imap_unordered(chunksize=3): makespan %.2fs, utilization %.0f%% of %s processes" % \
+        (legacy_makespan, 100 * busy / (legacy_makespan * args.processes), args.processes)
+
+    # the scheduler only sees estimates
+    stream_jobs = []
+    for name, stream, hegemony in events:
+        followup = Job(name, hegemony * rnd.uniform(0.7, 1.3), (hegemony, name))
+        stream_jobs.append(Job(name, stream * rnd.uniform(0.7, 1.3), (stream, name), [followup]))
+    stream_processes = args.stream_processes
+    scheduler = Scheduler(stream_processes, args.processes - stream_processes)
+    stats = scheduler.run(_sleep_stage, _sleep_stage, stream_jobs, [])
+    busy = stats['stream']['busy'] + stats['hegemony']['busy']
+    print "scheduler: makespan %.2fs, utilization %.0f%% of %s processes " \
+        "(stream %.0f%% of %s, hegemony %.0f%% of %s)" % \
+        (stats['makespan'], 100 * busy / (stats['makespan'] * args.processes), args.processes,
+         100 * stats['stream']['utilization'], stream_processes,
+         100 * stats['hegemony']['utilization'], args.processes - stream_processes)
+    return 0
+
+
+def _simulated_host(directory, n_events, work, ttl, crash_rate, failure_rate, seed):
+    """ A host of a distributed run, its stages sleep and may crash
+    (exit without cleaning up) or fail (raise) half way through.
+    """
+    # forked from the benchmark, which logs to stderr already
+    handler = logging.FileHandler(os.path.join(directory, 'host_%s.log' % seed))
+    logging.getLogger().addHandler(handler)
+    rnd = random.Random(seed)
+    collections = os.path.join(directory, 'collections')
+
+    def stage(title, names):
+        def run(lease):
+            time.sleep(work * rnd.uniform(0.5, 1.5))
+            if rnd.random() < crash_rate:
+                logging.info("Crashing in %s" % lease.name)
+                if rnd.random() < 0.5:
+                    # while storing: a partial copy of the event file
+                    with open(os.path.join(collections, '%s.event.host%s.tmp' % (title, seed)),
+                              'wb') as f:
+                        f.write('BGPEVENT')
+                os._exit(1)
+            if rnd.random() < failure_rate:
+                raise RuntimeError("Failing in %s" % lease.name)
+            time.sleep(work * rnd.uniform(0.5, 1.5))
+            lease.check()
+            # a stage stored twice would find its marker
+            try:
+                os.close(os.open(os.path.join(directory, lease.name + '.stored'),
+                                 os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except OSError:
+                open(os.path.join(directory, lease.name + '.duplicate.%s' % seed), 'w').close()
+            store = EventStore(collections, title)
+            for name in names:
+                store.append(name, {'stored by': seed}, atomic=True)
+        return run
+
+    def has(title, names):
+        return lambda: all(name in EventStore(collections, title) for name in names)
+
+    tasks = []
+    for i in range(n_events):
+        title = 'event_%s' % i
+        first, second = ('as_paths', 'pfxes_of_hijacker'), ('global_paths', 'local_paths')
+        tasks.append(Task(title + '.stream', has(title, first), lambda: True, stage(title, first)))
+        tasks.append(Task(title + '.hegemony', has(title, second), has(title, first),
+                          stage(title, second)))
+    rnd_order = random.Random(seed)
+    rnd_order.shuffle(tasks)
+    run_claimed(tasks, os.path.join(directory, 'leases'), owner='host%s' % seed, ttl=ttl)
+
+
+def bench_leases(args):
+    """ Hosts (local processes) claiming stages of events through leases,
+    some of them crashing mid-stage and restarted (as new hosts).
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(tmpdir, 'collections'))
+        for i in range(args.events):
+            EventStore(os.path.join(tmpdir, 'collections'), 'event_%s' % i)\
+                .write_event({'title': 'event_%s' % i})
+        stime = time.time()
+        seed = 0
+        hosts = []
+        crashes = 0
+        for i in range(args.hosts):
+            hosts.append(Process(target=_simulated_host, args=(
+                tmpdir, args.events, args.work, args.ttl, args.crash_rate, args.failure_rate,
+                seed)))
+            hosts[-1].start()
+            seed += 1
+        while hosts:
+            time.sleep(0.05)
+            for host in list(hosts):
+                if host.is_alive():
+                    continue
+                hosts.remove(host)
+                if host.exitcode != 0:
+                    crashes += 1
+                    # the host comes back
+                    hosts.append(Process(target=_simulated_host, args=(
+                        tmpdir, args.events, args.work, args.ttl, args.crash_rate,
+                        args.failure_rate, seed)))
+                    hosts[-1].start()
+                    seed += 1
+        makespan = time.time() - stime
+
+        complete = 0
+        for i in range(args.events):
+            store = EventStore(os.path.join(tmpdir, 'collections'), 'event_%s' % i)
+            event = store.load_event()
+            if all(name in event for name in ('as_paths', 'pfxes_of_hijacker',
+                                              'global_paths', 'local_paths')):
+                complete += 1
+        duplicates = len(glob.glob(os.path.join(tmpdir, '*.duplicate.*')))
+        takeovers = 0
+        for path in glob.glob(os.path.join(tmpdir, 'host_*.log')):
+            with open(path) as f:
+                takeovers += f.read().count('Taking over abandoned lease')
+        leftovers = glob.glob(os.path.join(tmpdir, 'collections', '*.tmp'))
+        failures = 0
+        for path in glob.glob(os.path.join(tmpdir, 'leases', '*' + FAILED_EXTENSION)):
+            with open(path) as f:
+                failures += sum(1 for line in f if line.strip())
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print "events: %s, hosts: %s, hosts started: %s, crashes: %s, stage failures: %s" \
+        % (args.events, args.hosts, seed, crashes, failures)
+    print "complete events: %s, stages stored twice: %s, abandoned leases taken over: %s, " \
+        "partial files left by crashes: %s" % (complete, duplicates, takeovers, len(leftovers))
+    print "makespan: %.2fs (work per host without crashes: %.2fs)" % \
+        (makespan, args.events * 2 * args.work * 2 / args.hosts)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='name')
+
+    p = subparsers.add_parser('timeline', help='timeline insertion')
+    p.add_argument('--stream', help='recorded elem stream (tab separated)')
+    p.add_argument('--elems', type=int, default=200000)
+    p.add_argument('--keys', type=int, default=50)
+    p.add_argument('--disorder', type=float, default=0.2)
+    p.set_defaults(func=bench_timeline)
+
+    p = subparsers.add_parser('stream', help='elem stream into sinks')
+    p.add_argument('--stream', help='recorded elem stream (tab separated)')
+    p.add_argument('--elems', type=int, default=200000)
+    p.add_argument('--keys', type=int, default=50)
+    p.add_argument('--disorder', type=float, default=0.2)
+    p.set_defaults(func=bench_stream)
+
+
+    p = subparsers.add_parser('cluster', help='one stream for overlapping events')
+    p.add_argument('--events', type=int, default=12)
+    p.add_argument('--family', type=int, default=4, help='events sharing a window')
+    p.add_argument('--elems', type=int, default=20000, help='per event')
+    p.set_defaults(func=bench_cluster)
+
+    p = subparsers.add_parser('shards', help='long interval read in shards')
+    p.add_argument('--elems', type=int, default=200000)
+    p.add_argument('--days', type=int, default=4)
+    p.add_argument('--collectors', type=int, default=4)
+    p.add_argument('--prefixes', type=int, default=500)
+    p.add_argument('--shard-hours', type=int, default=6)
+    p.add_argument('--decode-delay', type=float, default=0.00005, help='per record (s)')
+    p.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    p.set_defaults(func=bench_shards)
+
+    p = subparsers.add_parser('elemcache', help='local elem stream cache')
+    p.add_argument('--elems', type=int, default=50000)
+    p.add_argument('--decode-delay', type=float, default=0.00005, help='per record (s)')
+    p.set_defaults(func=bench_elemcache)
+
+    p = subparsers.add_parser('checkpoint', help='crashed streams resumed from checkpoints')
+    p.add_argument('--elems', type=int, default=100000)
+    p.add_argument('--decode-delay', type=float, default=0.00005, help='per record (s)')
+    p.add_argument('--interval', type=float, default=0.2, help='seconds between checkpoints')
+    p.add_argument('--crashes', type=int, default=5)
+    p.set_defaults(func=bench_checkpoint)
+
+    p = subparsers.add_parser('schedule', help='cost-aware scheduler against imap_unordered')
+    p.add_argument('--events', type=int, default=60)
+    p.add_argument('--heavy', type=int, default=6)
+    p.add_argument('--scale', type=float, default=0.1, help='seconds per unit of work')
+    p.add_argument('--processes', type=int, default=10)
+    p.add_argument('--stream-processes', type=int, default=4)
+    p.set_defaults(func=bench_schedule)
+
+    p = subparsers.add_parser('leases', help='hosts claiming stages through leases, with crashes')
+    p.add_argument('--events', type=int, default=20)
+    p.add_argument('--hosts', type=int, default=4)
+    p.add_argument('--work', type=float, default=0.05, help='seconds per half stage')
+    p.add_argument('--ttl', type=float, default=0.5)
+    p.add_argument('--crash-rate', type=float, default=0.1)
+    p.add_argument('--failure-rate', type=float, default=0.1)
+    p.set_defaults(func=bench_leases)
+
+    p = subparsers.add_parser('offline', help='recorded events collected again end to end, offline')
+    p.add_argument('--directory', default='collections')
+    p.add_argument('--titles', nargs='+', help='only these events')
+    p.add_argument('--limit', type=int, help='only the smallest events')
+    p.add_argument('--baseline', default=BASELINE_PATH)
+    p.add_argument('--update-baseline', action='store_true')
+    p.add_argument('--tolerance', type=float, default=0.3,
+                   help='throughput lower than the baseline by this much is a difference')
+    p.add_argument('--verbose', action='store_true')
+    p.set_defaults(func=bench_offline)
+
+    p = subparsers.add_parser('features', help='feature extraction')
+    p.add_argument('--directory', default='collections')
+    p.add_argument('--processes', type=int, default=cpu_count())
+    p.set_defaults(func=bench_features)
+
+    p = subparsers.add_parser('aspaths', help='as_paths storage format')
+    p.add_argument('--directory', default='collections')
+    p.set_defaults(func=bench_aspaths)
+
+    p = subparsers.add_parser('eventstore', help='load one field of an event')
+    p.add_argument('--directory', default='collections')
+    p.add_argument('--field', default='pfxes_of_hijacker')
+    p.set_defaults(func=bench_eventstore)
+
+    p = subparsers.add_parser('hegecache', help='shared hegemony cache')
+    p.add_argument('--events', type=int, default=40)
+    p.add_argument('--origins', type=int, default=100)
+    p.add_argument('--per-event', type=int, default=30)
+    p.add_argument('--workers', type=int, default=10)
+    p.set_defaults(func=bench_hegecache)
+
+    p = subparsers.add_parser('localhege', help='batched local hegemony queries')
+    p.add_argument('--origins', type=int, default=200)
+    p.add_argument('--page-size', type=int, default=1000)
+    p.add_argument('--delay', type=float, default=0.02, help='server latency (s)')
+    p.add_argument('--concurrency', type=int, default=4)
+    p.set_defaults(func=bench_localhege)
+
+    p = subparsers.add_parser('ihrclient', help='rate limit and retries of IHRClient')
+    p.add_argument('--queries', type=int, default=200)
+    p.add_argument('--max-rate', type=float, default=50, help='server side limit (req/s)')
+    p.add_argument('--error-rate', type=float, default=0.02)
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--backoff', type=float, default=0.2)
+    p.set_defaults(func=bench_ihrclient)
+
+    p = subparsers.add_parser('globalhege', help='chunked global hegemony queries')
+    p.add_argument('--ases', type=int, default=3000)
+    p.add_argument('--prefixes', type=int, default=5)
+    p.add_argument('--paths', type=int, default=3000)
+    p.add_argument('--page-size', type=int, default=1000)
+    p.set_defaults(func=bench_globalhege)
+
+    p = subparsers.add_parser('prefixindex', help='prefix trie against pairwise prefix scans')
+    p.add_argument('--directory', default='collections')
+    p.add_argument('--largest', type=int, default=5)
+    p.add_argument('--queries', type=int, default=50)
+    p.set_defaults(func=bench_prefixindex)
+
+    p = subparsers.add_parser('prefixstore', help='import collector with the lazy AS2PFX store')
+    p.add_argument('--asns', type=int, default=70000)
+    p.add_argument('--prefixes', type=int, default=800000)
+    p.add_argument('--lookups', type=int, default=10000)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_prefixstore)
+
+    p = subparsers.add_parser('ribs', help='RIB snapshots and windows of changes over as_paths')
+    p.add_argument('--directory', default='collections')
+    p.add_argument('--largest', type=int, default=5)
+    p.add_argument('--step', type=int, default=60)
+    p.set_defaults(func=bench_ribs)
+
+    p = subparsers.add_parser('eventindex', help='inverted index of the paths of all events')
+    p.add_argument('--directory', default='collections')
+    p.add_argument('--queries', type=int, default=20)
+    p.add_argument('--processes', type=int, default=None)
+    p.set_defaults(func=bench_eventindex)
+
+    p = subparsers.add_parser('pathnorm', help='path grouping for the hegemony stage')
+    p.add_argument('--directory', default='collections')
+    p.add_argument('--largest', type=int, default=10)
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_pathnorm)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s %(asctime)s: %(message)s",
+                        level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,89 @@
+""" Checkpoints of a stream being consumed, to resume it after a crash
+
+A checkpoint is taken between two records. It holds the sinks (pickled as
+they are), the time of the next record and how many records of that time
+were consumed already. BGPStream hands out records ordered by time, and in
+the same order when it is started again from that time, so the resumed
+stream skips those records and continues where the crashed one stopped.
+"""
+import os
+import time
+import pickle
+import socket
+import logging
+
+# seconds between two checkpoints
+DEFAULT_INTERVAL = 600
+EXTENSION = '.checkpoint'
+
+
+class Checkpoint():
+    def __init__(self, path, interval=DEFAULT_INTERVAL):
+        """
+        :param path: file of the checkpoint
+        :param interval: seconds between two checkpoints
+        """
+        self.path = path
+        self.interval = interval
+        self.last = time.time()
+        # saves of this checkpoint and of its stages
+        self.saved = 0
+        self.parent = None
+
+    def due(self):
+        return time.time() - self.last >= self.interval
+
+    def load(self, key):
+        """ :param key: what was consumed, a checkpoint of anything else is ignored
+        :return: state given to save, or None
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                saved_key, state = pickle.load(f)
+        except Exception as e:
+            logging.warning("Ignoring unreadable checkpoint %s: %s" % (self.path, e))
+            return None
+        if saved_key != key:
+            logging.info("Ignoring checkpoint %s of %s" % (self.path, saved_key))
+            return None
+        return state
+
+    def save(self, key, state):
+        """ Write atomically (tmp + rename)
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        tmp_path = '%s.%s.%s.tmp' % (self.path, socket.gethostname(), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            # protocol 2 for the __slots__ of Timeline
+            pickle.dump((key, state), f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+        self.last = time.time()
+        self.saved += 1
+        if self.parent is not None:
+            self.parent.saved += 1
+
+    def stage(self, name):
+        """ :return: Checkpoint of one stage of what this one is for, next to it
+        """
+        root, extension = os.path.splitext(self.path)
+        checkpoint = Checkpoint('%s.%s%s' % (root, name, extension), self.interval)
+        checkpoint.parent = self
+        return checkpoint
+
+    def remove(self):
+        """ Once the stream is consumed
+        """
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -1,38 +1,99 @@
 import os
+import sys
 import csv
 import time
 import pickle
+import socket
+import hashlib
 import logging
-from contextlib import closing
-from multiprocessing import Pool
+from multiprocessing import Process, cpu_count
 from histobgpstream import HistoBGPStream
 from hegemony import GetHegemony
+from ihr import TokenBucket, DEFAULT_CONCURRENCY, configure_shared_client
+from hegecache import configure_shared_cache, cache_path
+from pathnorm import group_paths
+from aspaths import ASPaths
+from eventstore import EventStore, get_titles
+from prefixstore import LazyPrefixStore
+from elemcache import ElemCache
+from scheduler import Scheduler, Job
+from leases import Task, run_claimed, DEFAULT_TTL
+from checkpoints import Checkpoint, EXTENSION as CHECKPOINT_EXTENSION
+from eventindex import EventIndex, INDEX_FILE
+import metrics
+
+# {asn: [prefix, ..]}, opened the first time it is used, and converted from
+# asn2pfx.pickle first if needed (python prefixstore.py converts it ahead)
+AS2PFX = LazyPrefixStore('asn2pfx.store', 'asn2pfx.pickle')
+
+# requests per second to IHR, over all the processes of a host (see ihr_bucket)
+IHR_MAX_RATE = 10.0
+
+# elem streams already read are replayed from here
+ELEM_CACHE_DIRECTORY = 'elem_cache'
+
+# streams longer than this are read first, in shards by all processes
+LONG_STREAM_SECONDS = 24 * 3600
+
+# stream stage is CPU bound, hegemony stage waits on IHR
+STREAM_PROCESSES = cpu_count()
+HEGEMONY_PROCESSES = 10
+
+# in the collections directory, shared by the hosts of a distributed run
+LEASE_DIRECTORY = 'leases'
+
+# in the collections directory, streams being read save their progress
+# there every CHECKPOINT_SECONDS and resume from it after a crash
+CHECKPOINT_DIRECTORY = 'checkpoints'
+CHECKPOINT_SECONDS = 600
+
+# in the collections directory, a JSON line per stage (python metrics.py <file>),
+# and the profiles of the stages with --profile
+METRICS_FILE = 'metrics.jsonl'
+PROFILE_DIRECTORY = 'profiles'
 
-with open("asn2pfx.pickle", "r") as f:
-    AS2PFX = pickle.load(f)
 
 class Collect:
-    def __init__(self, event, directory):
+    def __init__(self, event, directory, source=None, cache_directory=ELEM_CACHE_DIRECTORY,
+                 hegemony_args=None):
+        """
+        :param source: function returning a new (stream, record) to read,
+                       default BGPStream (see HistoBGPStream)
+        :param cache_directory: of the elem cache, None for no cache
+        :param hegemony_args: more keyword arguments of GetHegemony
+                              (cache, base_url, client)
+        """
         self.event = event
         self.directory = directory
+        self.source = source
+        self.cache_directory = cache_directory
+        self.hegemony_args = hegemony_args or dict()
+
+    def new_histo_handler(self, stage=None):
+        """ :param stage: of the checkpoint, see get_checkpoint
+        """
+        cache = ElemCache(self.cache_directory) if self.cache_directory is not None else None
+        return HistoBGPStream(source=self.source, cache=cache,
+                              checkpoint=get_checkpoint([self.event['title']], self.directory,
+                                                        stage))
 
     def collect_bgp_stream(self):
         # Class HistoBGPstream deals with the following
         # We will get previous + after attack paths from BGPStream
-        time_taken = time.time()
         event = self.event
-        histo_handler = HistoBGPStream()
-        # Get all paths per peer per collector
-        # since we consider one event as a prefix event,
-        # there is only one hijacked prefix
-        # (https://github.com/CAIDA/bgpstream/blob/master/FILTERING)
-        # Set the filter
-        filter_string = 'prefix less ' + event['hijack_prefix']
-        histo_handler.set_filter(filter_string)
-        if ('end_time' in event) and (event['end_time'] != ''):
-            paths = histo_handler.get_paths(event['start_time'], event['end_time'])
-        else:
-            paths = histo_handler.get_paths(event['start_time'])
+        histo_handler = self.new_histo_handler('as_paths')
+        with metrics.Stage('as_paths', event['title']) as stage:
+            # Get all paths per peer per collector
+            # since we consider one event as a prefix event,
+            # there is only one hijacked prefix
+            # (https://github.com/CAIDA/bgpstream/blob/master/FILTERING)
+            # Set the filter
+            filter_string = 'prefix less ' + event['hijack_prefix']
+            histo_handler.set_filter(filter_string)
+            if ('end_time' in event) and (event['end_time'] != ''):
+                paths = histo_handler.get_paths(event['start_time'], event['end_time'])
+            else:
+                paths = histo_handler.get_paths(event['start_time'])
         event['as_paths'] = paths
         self.event = event
 
@@ -41,24 +102,19 @@ class Collect:
         # with open(os.path.join(self.directory, title + '.pickle'), "w") as f:
         #     pickle.dump(event, f)
 
-        time_taken = time.time() - time_taken
         logging.info("[%s] Time taken for gathering bgp_paths is %s"
-                     % (event['title'], time_taken))
+                     % (event['title'], stage.seconds))
 
         return event
 
     def collect_prefixes(self):
         # Get all prefixes announced by hijacker AS
-        time_taken = time.time()
         event = self.event
-        histo_handler = HistoBGPStream()
-
-        ases = event['hijack_as']
-        if event['innocent_as'] != '':
-            ases = ases + ', ' + event['innocent_as']
+        histo_handler = self.new_histo_handler('pfxes_of_hijacker')
 
-        all_prefixes = histo_handler.get_all_prefixes_given_as\
-            (ases, event['start_time'])
+        with metrics.Stage('pfxes_of_hijacker', event['title']) as stage:
+            all_prefixes = histo_handler.get_all_prefixes_given_as\
+                (get_suspected_ases(event), event['start_time'])
         event['pfxes_of_hijacker'] = all_prefixes
         self.event = event
 
@@ -66,77 +122,80 @@ class Collect:
         # title = event['title'].lower().replace(" ", "_")
         # with open(os.path.join(self.directory, title + '.pickle'), "w") as f:
         #     pickle.dump(event, f)
-        time_taken = time.time() - time_taken
-        logging.info("[%s] Time taken for gathering bgp_paths is %s"
-                     % (event['title'], time_taken))
+        logging.info("[%s] Time taken for gathering prefixes of the hijackers is %s"
+                     % (event['title'], stage.seconds))
 
         return event
 
     def collect_hege_paths(self):
         # Class GetHegemony returns (local/global) hegemony path
         #  + Hegemony score of origin and hijacker AS
-        time_taken = time.time()
         event = self.event
         logging.info("[%s] Start collecting hege paths" % event['title'])
 
-        enable_local_cache = False
-        hege_handler = GetHegemony(event['title'], enable_local_cache)
-        global_paths = dict()
-        local_paths = dict()
-
-        unique_ases_global = dict()
-        unique_paths_global = dict()
-        u_paths_local = dict()
-        for col, P in event['as_paths'].iteritems():
-            for peer, A in P.iteritems():
-                for prefix, all_paths in A.iteritems():
-                    for timestamp, r_type, path in all_paths:
-                        if r_type == 'withdrawal':
-                            continue
-                        # global hegemony
-                        if prefix not in unique_ases_global:
-                            unique_ases_global[prefix] = set()
-                        for _p in path.split(' '):
-                            if '{' in _p:
-                                _p = _p[1:-1]
-                            unique_ases_global[prefix].add(_p)
-                        if prefix not in unique_paths_global:
-                            unique_paths_global[prefix] = set()
-                        unique_paths_global[prefix].add(path)
-                        # local hegemony
-                        if prefix not in u_paths_local:
-                            u_paths_local[prefix] = dict()
-                        origin_as = path.split(' ')[-1]
-                        if origin_as not in u_paths_local[prefix]:
-                            u_paths_local[prefix][origin_as] = set()
-                        u_paths_local[prefix][origin_as].add(path)
-
-        for pfx in unique_ases_global.keys():
-            hege_paths = hege_handler.get_batch_global_hege_path(unique_ases_global[pfx],
-                                                    unique_paths_global[pfx], pfx,
-                                                    event['start_time'])
-            global_paths[pfx] = hege_paths
-
-        for pfx in u_paths_local.keys():
-            for origin_as, paths in u_paths_local[pfx].iteritems():
-                hege_paths = hege_handler.get_batch_local_hege_path(paths,
-                                                    pfx, event['start_time'],
-                                                    origin_as)
+        with metrics.Stage('hegemony', event['title']) as stage:
+            enable_local_cache = False
+            hege_handler = GetHegemony(event['title'], enable_local_cache, **self.hegemony_args)
+            global_paths = dict()
+            local_paths = dict()
+
+            # every distinct path is tokenized once
+            groups = group_paths(event['as_paths'])
+            unique_ases_global = groups.unique_ases
+            unique_paths_global = groups.unique_paths
+            u_paths_local = groups.paths_by_origin
+
+            for pfx in unique_ases_global.keys():
+                hege_paths = hege_handler.get_batch_global_hege_path(unique_ases_global[pfx],
+                                                        unique_paths_global[pfx], pfx,
+                                                        event['start_time'])
+                global_paths[pfx] = hege_paths
+
+            # local hegemony of all origin ASes, a few origins per query
+            origins_per_af = dict()
+            for pfx in u_paths_local.keys():
+                af = hege_handler.check_ip_version(pfx)
+                origins_per_af.setdefault(af, set()).update(u_paths_local[pfx].keys())
+            for af, origin_ases in origins_per_af.iteritems():
+                hege_handler.prefetch_local_hegemony(origin_ases, event['start_time'], af)
+
+            for pfx in u_paths_local.keys():
                 local_paths[pfx] = dict()
-                local_paths[pfx][origin_as] = hege_paths
+                for origin_as, paths in u_paths_local[pfx].iteritems():
+                    hege_paths = hege_handler.get_batch_local_hege_path(paths,
+                                                        pfx, event['start_time'],
+                                                        origin_as)
+                    local_paths[pfx][origin_as] = hege_paths
 
         event['global_paths'] = global_paths
         event['local_paths'] = local_paths
         self.event = event
+        hege_handler.cache.log_stats(event['title'])
 
         # Store for record.
         # title = event['title'].lower().replace(" ", "_")
         # with open(os.path.join(self.directory, title + '.pickle'), "w") as f:
         #     pickle.dump(event, f)
 
-        time_taken = time.time() - time_taken
-        logging.info("[%s] Time taken for gathering bgp_paths is %s"
-                     % (event['title'], time_taken))
+        logging.info("[%s] Time taken for gathering hege paths is %s"
+                     % (event['title'], stage.seconds))
+
+        return event
+
+
+def get_suspected_ases(event):
+    """ :return: 'hijack_as' or 'hijack_as, innocent_as'
+    """
+    ases = event['hijack_as']
+    if event['innocent_as'] != '':
+        ases = ases + ', ' + event['innocent_as']
+    return ases
+
+
+def get_end_time(event):
+    if ('end_time' in event) and (event['end_time'] != ''):
+        return event['end_time']
+    return None
 
 
 def parse_real_examples_from_csv(fpath):
@@ -161,79 +220,386 @@ def parse_real_examples_from_csv(fpath):
 
 def get_events(directory):
     events = []
-    for fname in os.listdir(directory):
+    for title in get_titles(directory):
         event = dict()
-        event['title'] = fname.split('.pickle')[0]
+        event['title'] = title
         events.append(event)
 
     return events
 
 
-def collector(event, directory):
-    """ Collect
-    :return:
+def normalize_event(event):
+    """ Old events keep ASes as int or list, we want comma separated strings
     """
-    logging.info("Starting.. event: %s" % event['title'])
-
+    if 'hijack_as' not in event:
+        print event
+    if 'victim_as' not in event:
+        event['victim_as'] = str(event['original_asn'])
+    if isinstance(event['hijack_as'], int):
+        event['hijack_as'] = str(event['hijack_as'])
+    if isinstance(event['victim_as'], int):
+        event['victim_as'] = str(event['victim_as'])
+    if isinstance(event['hijack_as'], list):
+        temp = ''
+        for asn in event['hijack_as']:
+            temp += str(asn) + ','
+        temp = temp[:-1]
+        event['hijack_as'] = temp
+    if isinstance(event['victim_as'], list):
+        temp = ''
+        for asn in event['victim_as']:
+            temp += str(asn) + ','
+        temp = temp[:-1]
+        event['victim_as'] = temp
+    return event
+
+
+def load_event(event, directory, names=None):
+    """ Read a stored event, old pickles are migrated to an event file.
+    Hosts of a distributed run may do this at once: the event file is only
+    written if there is none, the first one wins and the others read it.
+    :param names: sections to load from an event file, default all
+    :return: event, EventStore
+    """
+    title = event['title'].lower().replace(" ", "_")
+    store = EventStore(directory, title)
     # if the file already exists, read it
     fname = event['title'] + '.pickle'
-    print fname
 
     fpath = os.path.join(directory, fname)
-    if os.path.exists(fpath):
+    if store.exists():
+        event = normalize_event(store.load_event(names))
+    elif os.path.exists(fpath):
+        # pickles from before the event store, migrate them
         with open(fpath, "r") as f:
             event = pickle.load(f)
         # event['title'] = fname.split('.json')[0]
-        if 'hijack_as' not in event:
-            print event
-        if 'victim_as' not in event:
-            event['victim_as'] = str(event['original_asn'])
-        if isinstance(event['hijack_as'], int):
-            event['hijack_as'] = str(event['hijack_as'])
-        if isinstance(event['victim_as'], int):
-            event['victim_as'] = str(event['victim_as'])
-        if isinstance(event['hijack_as'], list):
-            temp = ''
-            for asn in event['hijack_as']:
-                temp += str(asn) + ','
-            temp = temp[:-1]
-            event['hijack_as'] = temp
-        if isinstance(event['victim_as'], list):
-            temp = ''
-            for asn in event['victim_as']:
-                temp += str(asn) + ','
-            temp = temp[:-1]
-            event['victim_as'] = temp
+        event = normalize_event(event)
+        # pickles written before ASPaths hold nested dicts of lists
+        if 'as_paths' in event:
+            event['as_paths'] = ASPaths.from_nested(event['as_paths'])
+        if not store.write_event(event, replace=False):
+            event = normalize_event(store.load_event(names))
+    elif not store.write_event(event, replace=False):
+        event = normalize_event(store.load_event(names))
+    return event, store
+
+
+def get_hegemony_keys(event, hege_handler):
+    """ Hegemony that collect_hege_paths will need for an event
+    :return: set of (af, dt_time, asn) for global hegemony,
+             set of (af, dt_time, origin_as) for local hegemony
+    """
+    dt_time = hege_handler.get_hege_time(event['start_time'])
+    global_keys = set()
+    local_keys = set()
+    groups = group_paths(event['as_paths'])
+    for prefix, unique_ases in groups.unique_ases.iteritems():
+        af = hege_handler.check_ip_version(prefix)
+        global_keys.update((af, dt_time, asn) for asn in unique_ases)
+        local_keys.update((af, dt_time, origin_as.strip('{}'))
+                          for origin_as in groups.paths_by_origin[prefix])
+    return global_keys, local_keys
+
+
+def prefetch_hegemony(events, directory, hege_handler=None):
+    """ Plan pass before collecting: find the hegemony every event still
+    needs, deduplicate it over all events (many share timebins and
+    transit ASes) and read it in bulk into the shared hegemony cache.
+    :param hege_handler: GetHegemony to read with, default uses the shared cache
+    :return: (requested, unique) number of hegemony keys
+    """
+    if hege_handler is None:
+        hege_handler = GetHegemony('prefetch')
+    with metrics.Stage('prefetch_hegemony'):
+        requested, unique = _prefetch_hegemony(events, directory, hege_handler)
+    return requested, unique
+
+
+def _prefetch_hegemony(events, directory, hege_handler):
+    requested = 0
+    global_keys = set()
+    local_keys = set()
+    for event in events:
+        event, store = load_event(event, directory, names=['as_paths'])
+        if 'as_paths' not in event:
+            continue
+        if 'global_paths' in store and 'local_paths' in store:
+            continue
+        event_global_keys, event_local_keys = get_hegemony_keys(event, hege_handler)
+        requested += len(event_global_keys) + len(event_local_keys)
+        global_keys |= event_global_keys
+        local_keys |= event_local_keys
+    unique = len(global_keys) + len(local_keys)
+    logging.info("Hegemony keys: %s requested by events, %s unique (%s global, %s local)"
+                 % (requested, unique, len(global_keys), len(local_keys)))
+
+    global_ases = dict()
+    for af, dt_time, asn in global_keys:
+        global_ases.setdefault((af, dt_time), set()).add(asn)
+    for (af, dt_time), ases in global_ases.iteritems():
+        hege_handler.get_global_hegemony(ases, dt_time, af)
+    local_origins = dict()
+    for af, dt_time, origin_as in local_keys:
+        local_origins.setdefault((af, dt_time), set()).add(origin_as)
+    for (af, dt_time), origin_ases in local_origins.iteritems():
+        hege_handler.prefetch_local_hegemony_at(origin_ases, dt_time, af)
+    hege_handler.cache.log_stats('prefetch')
+    return requested, unique
+
+
+def prefetch_cluster_hegemony(events, directory):
+    """ prefetch_hegemony for the events of a cluster once it is streamed,
+    in a hegemony worker, before their hegemony jobs (see plan_jobs).
+    A failure is only logged, the jobs then read what they miss themselves.
+    :return: (requested, unique) number of hegemony keys
+    """
+    try:
+        return prefetch_hegemony(events, directory)
+    except Exception:
+        logging.exception("Could not prefetch the hegemony of %s"
+                          % ', '.join(event['title'] for event in events))
+        return 0, 0
+
+
+def plan_streams(events, directory, histo_handler=None):
+    """ Events that still need as_paths and pfxes_of_hijacker, clustered
+    by overlapping stream intervals ([start-8h, end]): each cluster is
+    read by one collect_events (see collect_stream).
+    :return: list of clusters (list of events), ordered by time
+    """
+    if histo_handler is None:
+        histo_handler = HistoBGPStream()
+    windows = []
+    for event in events:
+        event, store = load_event(event, directory, names=[])
+        # the ones with a section already collected are left to collector()
+        if 'as_paths' in store or 'pfxes_of_hijacker' in store:
+            continue
+        start, end = histo_handler.get_event_interval(event['start_time'], get_end_time(event))
+        windows.append((start, end, event))
+    windows.sort(key=lambda window: window[:2])
+
+    clusters = []
+    cluster_end = None
+    for start, end, event in windows:
+        if clusters and start <= cluster_end:
+            clusters[-1].append(event)
+            cluster_end = max(cluster_end, end)
+        else:
+            clusters.append([event])
+            cluster_end = end
+    logging.info("Planned %s streams for %s events" % (len(clusters), len(windows)))
+    return clusters
+
+
+def get_stream_interval(events, histo_handler):
+    """ :return: (start, end) timestamps of the stream of a cluster of events
+    """
+    intervals = [histo_handler.get_event_interval(event['start_time'], get_end_time(event))
+                 for event in events]
+    return min(start for start, end in intervals), max(end for start, end in intervals)
+
+
+def estimate_stream_cost(event, histo_handler):
+    """ Hours of stream to read, more for short prefixes whose
+    less specifics filter lets more through.
+    """
+    start, end = histo_handler.get_event_interval(event['start_time'], get_end_time(event))
+    try:
+        length = int(event['hijack_prefix'].split('/')[1])
+    except (IndexError, ValueError):
+        length = 24
+    return (end - start) / 3600.0 * 2 ** ((24 - min(length, 24)) / 8.0)
+
+
+def estimate_hegemony_cost(event, store, histo_handler):
+    """ MB of as_paths to look up, or the stream cost
+    if they are not collected yet (paths grow with the window).
+    """
+    if 'as_paths' in store:
+        schema, offset, length = store.index['as_paths']
+        return length / 1e6
+    return estimate_stream_cost(event, histo_handler)
+
+
+def plan_jobs(events, clusters, directory, histo_handler):
+    """ Stream Jobs (one per cluster) releasing a Job prefetching the
+    hegemony of their events, which releases the hegemony Jobs of the events,
+    and hegemony Jobs for the other events missing a stage.
+    :return: (stream jobs, hegemony jobs)
+    """
+    clustered = set(event['title'] for cluster in clusters for event in cluster)
+    stream_jobs = []
+    for cluster in clusters:
+        followups = []
+        for event in cluster:
+            event, store = load_event(event, directory, names=[])
+            followups.append(Job(event['title'], estimate_hegemony_cost(event, store, histo_handler),
+                                 (event, directory)))
+        name = ', '.join(event['title'] for event in cluster)
+        # as heavy as the jobs waiting for it
+        prefetch = Job('prefetch ' + name, sum(job.cost for job in followups), (cluster, directory),
+                       followups, function=prefetch_cluster_hegemony)
+        stream_jobs.append(Job(name,
+                               sum(estimate_stream_cost(event, histo_handler) for event in cluster),
+                               (cluster, directory), [prefetch]))
+    hegemony_jobs = []
+    for event in events:
+        event, store = load_event(event, directory, names=[])
+        if event['title'] in clustered:
+            continue
+        if all(name in store for name in ('as_paths', 'pfxes_of_hijacker',
+                                          'global_paths', 'local_paths')):
+            continue
+        hegemony_jobs.append(Job(event['title'], estimate_hegemony_cost(event, store, histo_handler),
+                                 (event, directory)))
+    return stream_jobs, hegemony_jobs
+
+
+def get_checkpoint(titles, directory, stage=None):
+    """ Checkpoint of the stream of the events (see checkpoints.py)
+    :param stage: None for collect_events, 'as_paths' or 'pfxes_of_hijacker'
+    """
+    name = titles[0].lower().replace(" ", "_")
+    if len(titles) > 1:
+        name += '+%s' % hashlib.sha1('\n'.join(titles)).hexdigest()[:8]
+    if stage is not None:
+        name += '.' + stage
+    return Checkpoint(os.path.join(directory, CHECKPOINT_DIRECTORY, name + CHECKPOINT_EXTENSION),
+                      CHECKPOINT_SECONDS)
+
+
+def collect_stream(events, directory, histo_handler=None, lease=None):
+    """ Collect (1) AS paths and (2) prefixes announced by hijackers
+    of a cluster of events from one stream, and store them.
+    :param lease: leases.Lease the stage is claimed with, if any
+    :return: (titles, number of records decoded,
+              number of records the streams of each event alone would have decoded)
+    """
+    if histo_handler is None:
+        histo_handler = HistoBGPStream(cache=ElemCache(ELEM_CACHE_DIRECTORY))
+    histo_handler.checkpoint = get_checkpoint([event['title'] for event in events], directory)
+    with metrics.Stage('stream', ', '.join(event['title'] for event in events)):
+        results = histo_handler.collect_events([(event['hijack_prefix'], get_suspected_ases(event),
+                                                 event['start_time'], get_end_time(event))
+                                                for event in events])
+    for event, (paths, all_prefixes) in zip(events, results):
+        store = EventStore(directory, event['title'].lower().replace(" ", "_"))
+        store_section(store, 'as_paths', paths, lease)
+        store_section(store, 'pfxes_of_hijacker', all_prefixes, lease)
+    return [event['title'] for event in events], histo_handler.records_read, \
+        sum(histo_handler.records_alone)
+
+
+def store_section(store, name, obj, lease=None):
+    """ Append a section, atomically and only while we hold the lease
+    if the stage was claimed with one (see leases.py).
+    """
+    if lease is None:
+        store.append(name, obj)
+    else:
+        lease.check()
+        store.append(name, obj, atomic=True)
+
+
+def collector(event, directory, lease=None):
+    """ Collect
+    :param lease: leases.Lease the stages are claimed with, if any
+    :return:
+    """
+    logging.info("Starting.. event: %s" % event['title'])
+    print event['title'] + '.pickle'
+
+    event, store = load_event(event, directory)
     collect = Collect(event, directory)
     # (1) Collect all AS paths
     if not 'as_paths' in event:
         event = collect.collect_bgp_stream()
         # Store for record.
-        title = event['title'].lower().replace(" ", "_")
-        with open(os.path.join(directory, title + '.pickle'), "w") as f:
-            pickle.dump(event, f)
+        store_section(store, 'as_paths', event['as_paths'], lease)
 
     # (2) Collect all prefix announced by a hijacker
     if not 'pfxes_of_hijacker' in event:
         event = collect.collect_prefixes()
-        title = event['title'].lower().replace(" ", "_")
-        with open(os.path.join(directory, title + '.pickle'), "w") as f:
-            pickle.dump(event, f)
+        store_section(store, 'pfxes_of_hijacker', event['pfxes_of_hijacker'], lease)
 
     # (3) Collect hegemony score for the event
     if not 'global_paths' in event or not 'local_paths' in event:
         event = collect.collect_hege_paths()
-        title = event['title'].lower().replace(" ", "_")
-        with open(os.path.join(directory, title + '.pickle'), "w") as f:
-            pickle.dump(event, f)
-
+        store_section(store, 'global_paths', event['global_paths'], lease)
+        store_section(store, 'local_paths', event['local_paths'], lease)
 
     return event['title']
 
 def run_collector(args):
     return collector(*args)
 
-def main():
+
+def get_event_tasks(event, directory):
+    """ Stages of an event as leases.Task, for run_distributed
+    """
+    title = event['title'].lower().replace(" ", "_")
+
+    def has(*names):
+        store = EventStore(directory, title)
+        return all(name in store for name in names)
+
+    return [Task(title + '.stream',
+                 lambda: has('as_paths', 'pfxes_of_hijacker'),
+                 lambda: True,
+                 lambda lease: collect_stream([event], directory, lease=lease)),
+            Task(title + '.hegemony',
+                 lambda: has('global_paths', 'local_paths'),
+                 lambda: has('as_paths', 'pfxes_of_hijacker'),
+                 lambda lease: collector(event, directory, lease=lease))]
+
+
+def ihr_bucket():
+    """ The IHR request rate of a host, shared by the processes forked once it
+    is made: the ones querying at once take their requests from this one budget,
+    however many they are.
+    """
+    return TokenBucket(IHR_MAX_RATE, max(1, int(IHR_MAX_RATE)), shared=True)
+
+
+def run_distributed(events, directory, lease_directory, ttl=DEFAULT_TTL, bucket=None):
+    """ Worker of any host: claim stages of events through leases in
+    lease_directory (shared by all hosts) and collect them, until every
+    event is collected. Abandoned leases of crashed workers are taken over.
+    :param bucket: ihr_bucket of the workers of this host, its own if None
+    :return: names of the stages collected here
+    """
+    configure_shared_client(bucket=bucket if bucket is not None else ihr_bucket())
+    histo_handler = HistoBGPStream()
+    loaded = []
+    for event in events:
+        event, store = load_event(event, directory, names=[])
+        loaded.append((estimate_stream_cost(event, histo_handler), event))
+    # heaviest first
+    loaded.sort(key=lambda cost_event: -cost_event[0])
+    tasks = []
+    for cost, event in loaded:
+        tasks.extend(get_event_tasks(event, directory))
+    ran = run_claimed(tasks, lease_directory, ttl=ttl)
+    logging.info("Collected %s stages here: %s" % (len(ran), ', '.join(ran)))
+    return ran
+
+def update_index(directory):
+    """ Index the events that changed, in one pass after collecting them.
+    The index is not needed to collect, a failure is only logged.
+    :return: titles indexed
+    """
+    try:
+        titles = EventIndex(os.path.join(directory, INDEX_FILE)).update(directory)
+    except Exception:
+        logging.exception("Could not update the index of %s" % directory)
+        return []
+    logging.info("Indexed %s events" % len(titles))
+    return titles
+
+
+def main(distributed=False, profile=False):
     logging.info("** Start collecting")
 
     # real events
@@ -247,25 +613,112 @@ def main():
 
     directory = 'collections'
     events = get_events(directory)
+    metrics.configure(os.path.join(directory, METRICS_FILE),
+                      os.path.join(directory, PROFILE_DIRECTORY) if profile else None)
+    # hosts of a distributed run share collections/ over NFS, where WAL is not safe
+    if distributed:
+        configure_shared_cache(cache_path(directory, per_host=True), journal_mode='DELETE')
+    else:
+        configure_shared_cache(cache_path(directory))
+
+    # every process querying IHR, this one, the pool workers and the distributed
+    # workers, takes its requests from the same rate
+    bucket = ihr_bucket()
+    configure_shared_client(bucket=bucket)
 
     stime = time.time()
-    count = 0
-    with closing(Pool(processes=10)) as pool:
-        for title in pool.imap_unordered(run_collector,
-                                         ((event, directory) for event in events),
-                                         chunksize=3):
-            count += 1
-            logging.info("Finished collecting event .. %s, (%s/%s)" % (title, count, len(events)))
-        pool.terminate()
+    if distributed:
+        # hosts share collections/ and claim stages of events through leases
+        workers = [Process(target=run_distributed,
+                           args=(events, directory, os.path.join(directory, LEASE_DIRECTORY),
+                                 DEFAULT_TTL, bucket))
+                   for i in range(HEGEMONY_PROCESSES)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # every host would write the index over NFS, it is updated once all are done
+        logging.info("Run python eventindex.py update once all hosts are done")
+        minutes = (time.time() - stime) / 60
+        logging.info("(time taken: %s minutes)" % (minutes))
+        print "(time taken: %s minutes)" % (minutes)
+        return
+
+    processes = STREAM_PROCESSES + HEGEMONY_PROCESSES
+    # overlapping events share a stream
+    histo_handler = HistoBGPStream()
+    clusters = plan_streams(events, directory, histo_handler)
+    long_clusters = []
+    short_clusters = []
+    for cluster in clusters:
+        start, end = get_stream_interval(cluster, histo_handler)
+        if end - start > LONG_STREAM_SECONDS:
+            long_clusters.append(cluster)
+        else:
+            short_clusters.append(cluster)
+    counts = {'events': 0, 'records': 0, 'records_unclustered': 0, 'collected': 0}
+
+    def count_stream(titles, records_read, records_alone):
+        counts['events'] += len(titles)
+        counts['records'] += records_read
+        counts['records_unclustered'] += records_alone
+        logging.info("Finished collecting streams .. %s, %s records, (%s events)"
+                     % (', '.join(titles), records_read, counts['events']))
+
+    # the heaviest: pool workers cannot start processes, long streams are sharded from here
+    for cluster in long_clusters:
+        count_stream(*collect_stream(cluster, directory,
+                                     HistoBGPStream(processes=processes,
+                                                    cache=ElemCache(ELEM_CACHE_DIRECTORY))))
+
+    # hegemony shared by events is read once, pool workers find it in the cache.
+    # Here for the events with as_paths, the others once their cluster is streamed
+    counts['requested'], counts['unique'] = prefetch_hegemony(events, directory)
+
+    stream_jobs, hegemony_jobs = plan_jobs(events, short_clusters, directory, histo_handler)
+
+    def finished(stage, job, result):
+        if stage == 'stream':
+            count_stream(*result)
+        elif job.function is prefetch_cluster_hegemony:
+            counts['requested'] += result[0]
+            counts['unique'] += result[1]
+        else:
+            counts['collected'] += 1
+            logging.info("Finished collecting event .. %s, (%s/%s)"
+                         % (result, counts['collected'], len(events)))
+
+    # IHR throttles bursts, the workers of both pools share the request rate
+    scheduler = Scheduler(STREAM_PROCESSES, HEGEMONY_PROCESSES, configure_shared_client,
+                          (IHR_MAX_RATE, DEFAULT_CONCURRENCY, bucket))
+    stats = scheduler.run(collect_stream, collector, stream_jobs, hegemony_jobs, finished)
+
+    print "hegemony keys: %s requested, %s unique" % (counts['requested'], counts['unique'])
+    if counts['events']:
+        print "streams: %s for %s events, records decoded per event: %.0f (%.0f with a stream per event)" \
+            % (len(clusters), counts['events'], float(counts['records']) / counts['events'],
+               float(counts['records_unclustered']) / counts['events'])
+    for stage in ('stream', 'hegemony'):
+        print "%s stage: %s jobs (%s failed), %s processes, utilization %.0f%%" \
+            % (stage, stats[stage]['jobs'], stats[stage]['errors'], stats[stage]['processes'],
+               100 * stats[stage]['utilization'])
+
+    update_index(directory)
 
     minutes = (time.time() - stime) / 60
     logging.info("(time taken: %s minutes)" % (minutes))
     print "(time taken: %s minutes)" % (minutes)
 
 if __name__ == "__main__":
+    # python collector.py --distributed, on each host
+    # python collector.py --profile, to profile each stage
+    distributed = '--distributed' in sys.argv
+    profile = '--profile' in sys.argv
     log_filename = '/nfs/london/data1/shicho/log/log_' \
-                   + os.path.basename(__file__).split('.')[0] + '.log'
+                   + os.path.basename(__file__).split('.')[0]
+    if distributed:
+        log_filename += '_' + socket.gethostname()
     logging.basicConfig(format="%(levelname)s %(asctime)s: %(message)s",
-                        filename=log_filename,
+                        filename=log_filename + '.log',
                         level=logging.INFO)
-    main()
\ No newline at end of file
+    main(distributed, profile)
\ No newline at end of file
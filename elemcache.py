@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+""" Local cache of the elem streams read from BGPStream
+
+layout:  <directory>/<filter key>/<start>_<end>_<collectors>.seg
+         filter key = sha1 of the filters, collector filters aside
+A segment holds every elem of the stream between start and end (inclusive)
+for the filters, and for all collectors or the ones in its name.
+segment = MAGIC + <H format version> + pickle of its columns
+Elems are kept in stream order; the times are the time index, and rows
+per collector the collector index. HistoBGPStream(cache=ElemCache(..))
+replays what is covered and reads (and records) the rest from the stream.
+"""
+import os
+import sys
+import glob
+import pickle
+import socket
+import struct
+import hashlib
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from aspaths import RECORD_TYPES, RECORD_TYPE_CODES
+from sinks import Elem
+
+MAGIC = 'BGPELEMS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sH')
+EXTENSION = '.seg'
+ALL_COLLECTORS = 'all'
+
+
+def split_filters(filters):
+    """ :param filters: filter strings given to HistoBGPStream.set_filter
+    :return: (other terms sorted, collectors or None)
+    """
+    terms = []
+    collectors = set()
+    for string in filters:
+        for term in string.split(' and '):
+            term = ' '.join(term.split())
+            if term.startswith('collector '):
+                collectors.add(term.split(' ', 1)[1])
+            elif term:
+                terms.append(term)
+    return sorted(terms), (sorted(collectors) if collectors else None)
+
+
+class ElemSegment(object):
+    """ Elems of [start, end] in columns, strings interned
+    """
+    COLUMNS = (('times', 'I'), ('types', 'B'), ('collector_ids', 'H'), ('peer_ids', 'I'),
+               ('prefix_ids', 'I'), ('path_ids', 'I'), ('record_numbers', 'I'))
+
+    def __init__(self, start, end, collectors=None):
+        self.start = start
+        self.end = end
+        # collectors it was recorded for, None for all
+        self.collectors = collectors
+        self.strings = {'collector': [], 'peer': [], 'prefix': [], 'path': []}
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self.records = 0
+        # {collector: sorted times of the records decoded}, None in
+        # segments recorded before they were kept
+        self.record_times = dict()
+        self.ordered = True
+        self._ids = None
+        self._collector_rows = None
+
+    def _intern(self, kind, value):
+        ids = self._ids[kind]
+        i = ids.get(value)
+        if i is None:
+            i = len(self.strings[kind])
+            ids[value] = i
+            self.strings[kind].append(value)
+        return i
+
+    def append(self, elem, record_number):
+        """ :param record_number: of the record of the elem in the stream, from 1
+        """
+        if self._ids is None:
+            self._ids = dict((kind, dict((v, i) for i, v in enumerate(values)))
+                             for kind, values in self.strings.items())
+        if self.times and elem.time < self.times[-1]:
+            self.ordered = False
+        self.times.append(elem.time)
+        self.types.append(RECORD_TYPE_CODES[elem.record_type])
+        self.collector_ids.append(self._intern('collector', elem.collector))
+        self.peer_ids.append(self._intern('peer', elem.peer))
+        self.prefix_ids.append(self._intern('prefix', elem.prefix))
+        self.path_ids.append(self._intern('path', elem.as_path))
+        self.record_numbers.append(record_number)
+
+    def collector_rows(self, collector):
+        """ Rows of a collector (the collector index)
+        """
+        if self._collector_rows is None:
+            self._collector_rows = dict()
+            for row, collector_id in enumerate(self.collector_ids):
+                rows = self._collector_rows.get(collector_id)
+                if rows is None:
+                    rows = self._collector_rows[collector_id] = array('I')
+                rows.append(row)
+        if collector not in self.strings['collector']:
+            return array('I')
+        return self._collector_rows.get(self.strings['collector'].index(collector), array('I'))
+
+    def select(self, start_time, end_time, collectors=None):
+        """ :return: rows of [start_time, end_time] for the collectors
+                     (default all), in stream order
+        """
+        if self.ordered:
+            rows = xrange(bisect_left(self.times, start_time),
+                          bisect_right(self.times, end_time))
+        else:
+            rows = [row for row, t in enumerate(self.times) if start_time <= t <= end_time]
+        if collectors is None:
+            return rows
+        if not rows:
+            return []
+        first, last = rows[0], rows[-1]
+        selected = []
+        for collector in collectors:
+            collector_rows = self.collector_rows(collector)
+            selected.extend(row for row in collector_rows[bisect_left(collector_rows, first):
+                                                          bisect_right(collector_rows, last)]
+                            if start_time <= self.times[row] <= end_time)
+        selected.sort()
+        return selected
+
+    def records_between(self, start_time, end_time, collectors=None):
+        """ :return: {(collector, time): records decoded} of [start_time,
+                     end_time] for the collectors (default all); without
+                     record_times, the records with an elem
+        """
+        found = dict()
+        if self.record_times is None:
+            numbers = set()
+            for row in self.select(start_time, end_time, collectors):
+                if self.record_numbers[row] not in numbers:
+                    numbers.add(self.record_numbers[row])
+                    key = (self.strings['collector'][self.collector_ids[row]], self.times[row])
+                    found[key] = found.get(key, 0) + 1
+            return found
+        for collector, times in self.record_times.items():
+            if collectors is not None and collector not in collectors:
+                continue
+            for record_time in times[bisect_left(times, start_time):
+                                     bisect_right(times, end_time)]:
+                found[(collector, record_time)] = found.get((collector, record_time), 0) + 1
+        return found
+
+    def set_record_times(self, record_times):
+        """ :param record_times: {(collector, time): records decoded}
+        """
+        self.record_times = dict()
+        for (collector, record_time), records in sorted(record_times.items()):
+            self.record_times.setdefault(collector, array('I')).extend([record_time] * records)
+
+    def elem(self, row):
+        return Elem(self.strings['collector'][self.collector_ids[row]],
+                    self.strings['peer'][self.peer_ids[row]],
+                    self.strings['prefix'][self.prefix_ids[row]],
+                    self.times[row], RECORD_TYPES[self.types[row]],
+                    self.strings['path'][self.path_ids[row]])
+
+    def __getstate__(self):
+        state = {'start': self.start, 'end': self.end, 'collectors': self.collectors,
+                 'strings': self.strings, 'records': self.records, 'ordered': self.ordered}
+        for name, typecode in self.COLUMNS:
+            arr = getattr(self, name)
+            state[name] = (arr.typecode, arr.tostring())
+        if self.record_times is not None:
+            state['record_times'] = dict((collector, times.tostring())
+                                         for collector, times in self.record_times.items())
+        return state
+
+    def __setstate__(self, state):
+        self.record_times = None
+        if 'record_times' in state:
+            self.record_times = dict((collector, array('I', times))
+                                     for collector, times in state.pop('record_times').items())
+        for name, value in state.items():
+            if isinstance(value, tuple):
+                arr = array(value[0])
+                arr.fromstring(value[1])
+                value = arr
+            setattr(self, name, value)
+        self._ids = None
+        self._collector_rows = None
+
+
+class ElemCache():
+    def __init__(self, directory):
+        self.directory = directory
+        self._segments = dict()
+        self.counters = {'replayed': 0, 'recorded': 0}
+
+    def key_directory(self, terms):
+        key = hashlib.sha1('\n'.join(terms)).hexdigest()[:16]
+        return os.path.join(self.directory, key)
+
+    def segment_files(self, terms, collectors=None):
+        """ Segments usable for the filters and collectors
+        :return: list of (start, end, path), by start
+        """
+        found = []
+        for path in glob.glob(os.path.join(self.key_directory(terms), '*' + EXTENSION)):
+            try:
+                start, end, tag = os.path.basename(path)[:-len(EXTENSION)].split('_', 2)
+                start, end = int(start), int(end)
+            except ValueError:
+                continue
+            if tag != ALL_COLLECTORS and \
+                    (collectors is None or not set(collectors) <= set(tag.split('+'))):
+                continue
+            found.append((start, end, path))
+        found.sort()
+        return found
+
+    def plan(self, filters, start_time, end_time):
+        """ Split [start_time, end_time] in pieces a segment covers
+        and pieces to read from the stream.
+        :return: list of (start, end, segment path or None), in time order
+        """
+        terms, collectors = split_filters(filters)
+        segments = self.segment_files(terms, collectors)
+        pieces = []
+        current = start_time
+        while current <= end_time:
+            covering = [(end, path) for start, end, path in segments if start <= current <= end]
+            if covering:
+                end, path = max(covering)
+                pieces.append((current, min(end, end_time), path))
+            else:
+                later = [start for start, end, path in segments if start > current]
+                end = min(later + [end_time + 1]) - 1
+                pieces.append((current, end, None))
+            current = pieces[-1][1] + 1
+        return pieces
+
+    def load(self, path):
+        segment = self._segments.get(path)
+        if segment is None:
+            with open(path, 'rb') as f:
+                magic, version = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC or version != FORMAT_VERSION:
+                    raise ValueError("Not a segment of format %s: %s" % (FORMAT_VERSION, path))
+                segment = pickle.load(f)
+            self._segments[path] = segment
+        return segment
+
+    def save(self, filters, segment):
+        """ Write a segment atomically (tmp + rename)
+        :return: path
+        """
+        terms, collectors = split_filters(filters)
+        directory = self.key_directory(terms)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+            with open(os.path.join(directory, 'filters'), 'w') as f:
+                f.write('\n'.join(terms) + '\n')
+        tag = ALL_COLLECTORS if collectors is None else '+'.join(collectors)
+        path = os.path.join(directory, '%s_%s_%s%s' % (segment.start, segment.end, tag, EXTENSION))
+        tmp_path = '%s.%s.%s.tmp' % (path, socket.gethostname(), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+            pickle.dump(segment, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+        self._segments[path] = segment
+        self.counters['recorded'] += len(segment.times)
+        logging.info("Recorded %s elems of [%s, %s] to %s"
+                     % (len(segment.times), segment.start, segment.end, path))
+        return path
+
+    def iter_segment(self, filters, path, start_time, end_time):
+        """ Elems of a segment in [start_time, end_time]
+        :return: generator of (elem, record number from 1)
+        """
+        terms, collectors = split_filters(filters)
+        segment = self.load(path)
+        rows = segment.select(start_time, end_time, collectors)
+        if not len(rows):
+            return
+        first_record = segment.record_numbers[rows[0]] - 1
+        for row in rows:
+            self.counters['replayed'] += 1
+            yield segment.elem(row), segment.record_numbers[row] - first_record
+
+
+    def record_times(self, filters, path, start_time, end_time):
+        """ Records decoded in [start_time, end_time] by the stream a
+        segment was recorded from, see ElemSegment.records_between
+        """
+        terms, collectors = split_filters(filters)
+        return self.load(path).records_between(start_time, end_time, collectors)
+
+
+def main(directory):
+    """ Print the segments of a cache
+    """
+    for key_directory in sorted(glob.glob(os.path.join(directory, '*'))):
+        filters = ''
+        if os.path.exists(os.path.join(key_directory, 'filters')):
+            with open(os.path.join(key_directory, 'filters')) as f:
+                filters = ' and '.join(line for line in f.read().split('\n') if line)
+        print "%s: %s" % (os.path.basename(key_directory), filters or '(no filter)')
+        for path in sorted(glob.glob(os.path.join(key_directory, '*' + EXTENSION))):
+            print "    %s %.1f KB" % (os.path.basename(path), os.path.getsize(path) / 1024.0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else 'elem_cache')
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+""" Inverted index of the AS paths of all events (collections/index.sqlite)
+
+Paths and prefixes are interned once for all events. For every
+(event, prefix, path) of event['as_paths'] the index keeps the times of the
+first and last rows announcing it and the number of time lines (collector,
+peer) it was on. ASNs (origins flagged) point to the paths they are on, so
+"which events saw AS x on-path" or "which events share this path" are a
+few index lookups instead of unpickling every event.
+
+Each event is indexed with the size and mtime of its file, update()
+indexes again only the events whose file changed. collector.py updates the
+index once it has collected all events, a single writer: the index uses a
+rollback journal, as collections/ may be on NFS where WAL is not safe.
+
+python eventindex.py update [--processes N]
+python eventindex.py asn 197426 [--origin]
+python eventindex.py prefix 1.2.3.0/24 [--more-specifics]
+python eventindex.py path '3356 174 197426' [--subpath]
+(--directory collections, --index <directory>/index.sqlite)
+"""
+import os
+import sys
+import time
+import pickle
+import sqlite3
+import logging
+import argparse
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+from aspaths import ASPaths, RECORD_TYPE_CODES, path_to_asns
+from eventstore import EventStore, get_titles, EXTENSION
+from prefixes import PrefixTrie
+
+INDEX_FILE = 'index.sqlite'
+WITHDRAWAL = RECORD_TYPE_CODES['withdrawal']
+
+# an (event, prefix, path) of the index
+Occurrence = namedtuple('Occurrence', ['title', 'prefix', 'path', 'first_time', 'last_time',
+                                       'timelines'])
+
+SCHEMA = ["CREATE TABLE IF NOT EXISTS events ("
+          "event_id INTEGER PRIMARY KEY, title TEXT UNIQUE, fingerprint TEXT)",
+          "CREATE TABLE IF NOT EXISTS prefixes ("
+          "prefix_id INTEGER PRIMARY KEY, prefix TEXT UNIQUE)",
+          "CREATE TABLE IF NOT EXISTS paths (path_id INTEGER PRIMARY KEY, path TEXT UNIQUE)",
+          "CREATE TABLE IF NOT EXISTS path_asns (asn INTEGER, path_id INTEGER, origin INTEGER, "
+          "PRIMARY KEY (asn, path_id))",
+          "CREATE TABLE IF NOT EXISTS occurrences ("
+          "event_id INTEGER, prefix_id INTEGER, path_id INTEGER, "
+          "first_time INTEGER, last_time INTEGER, timelines INTEGER, "
+          "PRIMARY KEY (event_id, prefix_id, path_id))",
+          "CREATE INDEX IF NOT EXISTS occurrences_path ON occurrences (path_id)",
+          "CREATE INDEX IF NOT EXISTS occurrences_prefix ON occurrences (prefix_id)"]
+
+SELECT_OCCURRENCES = "SELECT e.title, p.prefix, a.path, o.first_time, o.last_time, o.timelines " \
+                     "FROM occurrences o JOIN events e ON e.event_id = o.event_id " \
+                     "JOIN prefixes p ON p.prefix_id = o.prefix_id " \
+                     "JOIN paths a ON a.path_id = o.path_id "
+ORDER = " ORDER BY e.title, p.prefix, o.first_time"
+
+
+def fingerprint(directory, title):
+    """ :return: name, size and mtime of the file of an event, None if it has none
+    """
+    for name in (title + EXTENSION, title + '.pickle'):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            return '%s:%s:%s' % (name, stat.st_size, int(stat.st_mtime))
+    return None
+
+
+def read_as_paths(directory, title):
+    """ as_paths of an event, without migrating it (see collector.load_event)
+    :return: ASPaths, None if it was not collected yet
+    """
+    store = EventStore(directory, title)
+    if store.exists():
+        if 'as_paths' not in store:
+            return None
+        return store.load('as_paths')
+    with open(os.path.join(directory, title + '.pickle'), 'rb') as f:
+        event = pickle.load(f)
+    if 'as_paths' not in event:
+        return None
+    return ASPaths.from_nested(event['as_paths'])
+
+
+def occurrences(as_paths):
+    """ :return: {(prefix, path): [first time, last time, time lines]}
+    """
+    times, types, path_ids, paths = as_paths.times, as_paths.types, as_paths.path_ids, \
+        as_paths.paths
+    found = dict()
+    for collector, peer, prefix, start, stop in as_paths.iter_groups():
+        seen = set()
+        for i in range(start, stop):
+            if types[i] == WITHDRAWAL or not paths[path_ids[i]]:
+                continue
+            key = (prefix, paths[path_ids[i]])
+            occurrence = found.get(key)
+            if occurrence is None:
+                found[key] = [times[i], times[i], 1]
+                seen.add(key)
+                continue
+            occurrence[0] = min(occurrence[0], times[i])
+            occurrence[1] = max(occurrence[1], times[i])
+            if key not in seen:
+                seen.add(key)
+                occurrence[2] += 1
+    return found
+
+
+def _read_occurrences(args):
+    directory, title = args
+    as_paths = read_as_paths(directory, title)
+    return title, fingerprint(directory, title), \
+        occurrences(as_paths) if as_paths is not None else None
+
+
+class EventIndex():
+    def __init__(self, path):
+        """ :param path: SQLite file
+        """
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._ids = {'paths': dict(), 'prefixes': dict()}
+        self._trie = None
+
+    def _connection(self):
+        # sqlite connections must not cross a fork, open one per process
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=DELETE")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+            self._ids = {'paths': dict(), 'prefixes': dict()}
+        return self._conn
+
+    def _intern(self, table, column, value):
+        """ :return: id of value in table, added if it is new
+        """
+        ids = self._ids[table]
+        if value not in ids:
+            conn = self._connection()
+            conn.execute("INSERT OR IGNORE INTO %s (%s) VALUES (?)" % (table, column), (value,))
+            ids[value] = conn.execute("SELECT %s_id FROM %s WHERE %s = ?" % (column, table, column),
+                                      (value,)).fetchone()[0]
+            if table == 'paths':
+                origins = set(path_to_asns(value.rsplit(' ', 1)[-1]))
+                conn.executemany("INSERT OR IGNORE INTO path_asns VALUES (?, ?, ?)",
+                                 [(asn, ids[value], int(asn in origins))
+                                  for asn in set(path_to_asns(value))])
+        return ids[value]
+
+    def fingerprints(self):
+        """ :return: {title: fingerprint} of the events indexed
+        """
+        return dict(self._connection().execute("SELECT title, fingerprint FROM events"))
+
+    def remove_event(self, title, commit=True):
+        conn = self._connection()
+        row = conn.execute("SELECT event_id FROM events WHERE title = ?", (title,)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM occurrences WHERE event_id = ?", row)
+            conn.execute("DELETE FROM events WHERE event_id = ?", row)
+        if commit:
+            conn.commit()
+        self._trie = None
+
+    def add_event(self, title, found, fingerprint=None):
+        """ Index an event, replacing what was indexed for it
+        :param found: occurrences() of its as_paths
+        """
+        conn = self._connection()
+        try:
+            self.remove_event(title, commit=False)
+            event_id = conn.execute("INSERT INTO events (title, fingerprint) VALUES (?, ?)",
+                                    (title, fingerprint)).lastrowid
+            conn.executemany("INSERT INTO occurrences VALUES (?, ?, ?, ?, ?, ?)",
+                             [(event_id, self._intern('prefixes', 'prefix', prefix),
+                               self._intern('paths', 'path', path), first_time, last_time,
+                               timelines)
+                              for (prefix, path), (first_time, last_time, timelines)
+                              in found.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # ids of the rows rolled back
+            self._ids = {'paths': dict(), 'prefixes': dict()}
+            raise
+
+    def index_event(self, directory, title, as_paths=None):
+        """ Index an event again if its file changed since it was indexed
+        :param as_paths: its ASPaths if we have them, read from its file otherwise
+        :return: True if it was indexed
+        """
+        current = fingerprint(directory, title)
+        if current is not None and self.fingerprints().get(title) == current:
+            return False
+        if as_paths is None:
+            as_paths = read_as_paths(directory, title)
+            if as_paths is None:
+                return False
+        self.add_event(title, occurrences(as_paths), current)
+        return True
+
+    def update(self, directory, processes=None):
+        """ Index the events of a directory whose file changed, and forget
+        the ones that are gone
+        :return: titles indexed
+        """
+        titles = get_titles(directory)
+        indexed = self.fingerprints()
+        for title in set(indexed) - set(titles):
+            self.remove_event(title)
+        changed = [title for title in titles
+                   if fingerprint(directory, title) != indexed.get(title)]
+        jobs = [(directory, title) for title in changed]
+        pool = None
+        if processes == 1 or len(jobs) < 2:
+            results = map(_read_occurrences, jobs)
+        else:
+            pool = Pool(processes or cpu_count())
+            results = pool.imap_unordered(_read_occurrences, jobs)
+        done = []
+        for title, current, found in results:
+            if found is not None:
+                self.add_event(title, found, current)
+                done.append(title)
+        if pool is not None:
+            pool.close()
+            pool.join()
+        return done
+
+    def _select(self, where, values):
+        return [Occurrence(*row) for row in
+                self._connection().execute(SELECT_OCCURRENCES + where + ORDER, values)]
+
+    def by_asn(self, asn, origin=False):
+        """ :return: Occurrence of the paths asn is on, or the origin of
+        """
+        return self._select("WHERE o.path_id IN (SELECT path_id FROM path_asns WHERE asn = ?%s)"
+                            % (' AND origin = 1' if origin else ''), (int(asn),))
+
+    def by_prefix(self, prefix, more_specifics=False):
+        """ :return: Occurrence of the paths to prefix, and to its more
+                     specifics if more_specifics
+        """
+        prefixes = [prefix]
+        if more_specifics:
+            if self._trie is None:
+                self._trie = PrefixTrie((value, None) for value, in
+                                        self._connection().execute("SELECT prefix FROM prefixes"))
+            prefixes = [value for value, unused in self._trie.covered(prefix)]
+        if not prefixes:
+            return []
+        return self._select("WHERE p.prefix IN (%s)" % ', '.join('?' * len(prefixes)), prefixes)
+
+    def by_path(self, path, subpath=False):
+        """ :param path: as-path string
+        :param subpath: also the paths with these hops in a row
+        :return: Occurrence of the path
+        """
+        if not subpath:
+            return self._select("WHERE a.path = ?", (path,))
+        asns = set(path_to_asns(path))
+        if not asns:
+            return []
+        where = "WHERE o.path_id IN (%s)" % ' INTERSECT '.join(
+            ["SELECT path_id FROM path_asns WHERE asn = ?"] * len(asns))
+        hops = ' %s ' % path
+        return [occurrence for occurrence in self._select(where, list(asns))
+                if hops in ' %s ' % occurrence.path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--directory', default='collections')
+    parser.add_argument('--index', help='default <directory>/%s' % INDEX_FILE)
+    subparsers = parser.add_subparsers(dest='command')
+    p = subparsers.add_parser('update', help='index the events that changed')
+    p.add_argument('--processes', type=int, default=None)
+    p = subparsers.add_parser('asn', help='events with paths through an AS')
+    p.add_argument('asn')
+    p.add_argument('--origin', action='store_true', help='only as the origin')
+    p = subparsers.add_parser('prefix', help='events with paths to a prefix')
+    p.add_argument('prefix')
+    p.add_argument('--more-specifics', action='store_true')
+    p = subparsers.add_parser('path', help='events with an AS path')
+    p.add_argument('path')
+    p.add_argument('--subpath', action='store_true', help='or a path with these hops in a row')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    index = EventIndex(args.index or os.path.join(args.directory, INDEX_FILE))
+    stime = time.time()
+    if args.command == 'update':
+        titles = index.update(args.directory, args.processes)
+        logging.info("%s events indexed in %.1fs" % (len(titles), time.time() - stime))
+        return 0
+    if args.command == 'asn':
+        found = index.by_asn(args.asn, args.origin)
+    elif args.command == 'prefix':
+        found = index.by_prefix(args.prefix, args.more_specifics)
+    else:
+        found = index.by_path(args.path, args.subpath)
+    seconds = time.time() - stime
+    for occurrence in found:
+        print "%s\t%s\t%s\t%s\t%s\t%s" % occurrence
+    logging.info("%s paths of %s events in %.1fms" % (
+        len(found), len(set(occurrence.title for occurrence in found)), seconds * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+""" Sectioned, append-only event files (collections/<title>.event)
+
+layout:  header  = MAGIC + <H format version>
+         section = <32s name><H schema version><Q payload length> + payload
+Each section payload is a pickle. A stage appends its own section and
+never rewrites the others; when a section is appended again the last
+one wins. Readers memory-map the file and unpickle only what they ask for.
+"""
+import os
+import sys
+import glob
+import errno
+import mmap
+import pickle
+import socket
+import struct
+import logging
+from aspaths import ASPaths
+
+MAGIC = 'BGPEVENT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sH')
+SECTION_HEADER = struct.Struct('<32sHQ')
+# Bump the version of a section whenever what we pickle in it changes.
+SECTION_VERSIONS = {'metadata': 1,
+                    'as_paths': 1,
+                    'pfxes_of_hijacker': 1,
+                    'global_paths': 1,
+                    'local_paths': 1}
+EXTENSION = '.event'
+
+
+class EventStore():
+    def __init__(self, directory, title):
+        self.title = title
+        self.path = os.path.join(directory, title + EXTENSION)
+        self._index = None
+        self._end = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _read_index(self):
+        """ Scan section headers, skipping payloads.
+        :return: {name: (schema version, payload offset, payload length)}
+        """
+        index = dict()
+        self._end = HEADER.size
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                magic, version = HEADER.unpack_from(mm, 0)
+                if magic != MAGIC:
+                    raise ValueError("%s is not an event file" % self.path)
+                if version != FORMAT_VERSION:
+                    raise ValueError("%s has format version %s, expected %s"
+                                     % (self.path, version, FORMAT_VERSION))
+                offset = HEADER.size
+                while offset + SECTION_HEADER.size <= len(mm):
+                    name, schema, length = SECTION_HEADER.unpack_from(mm, offset)
+                    offset += SECTION_HEADER.size
+                    if offset + length > len(mm):
+                        # interrupted while appending, ignore the partial section
+                        logging.warning("[%s] Truncated section %s"
+                                        % (self.title, name.rstrip('\0')))
+                        break
+                    index[name.rstrip('\0')] = (schema, offset, length)
+                    offset += length
+                    self._end = offset
+            finally:
+                mm.close()
+        return index
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._read_index() if self.exists() else dict()
+        return self._index
+
+    def sections(self):
+        return self.index.keys()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def load(self, name):
+        """ Unpickle a single section.
+        """
+        schema, offset, length = self.index[name]
+        if schema != SECTION_VERSIONS[name]:
+            raise ValueError("[%s] section %s has schema version %s, expected %s"
+                             % (self.title, name, schema, SECTION_VERSIONS[name]))
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return pickle.loads(mm[offset:offset + length])
+            finally:
+                mm.close()
+
+    def load_event(self, names=None):
+        """ Event dict with metadata and the requested (default: all) sections.
+        """
+        event = self.load('metadata')
+        for name in (names if names is not None else self.sections()):
+            if name != 'metadata' and name in self.index:
+                event[name] = self.load(name)
+        return event
+
+    def _write_section(self, f, name, obj):
+        payload = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        f.write(SECTION_HEADER.pack(name, SECTION_VERSIONS[name], len(payload)))
+        f.write(payload)
+
+    def append(self, name, obj, atomic=False):
+        """ Append (or replace) one section without touching the others.
+        :param atomic: write a copy with the new section and rename it over
+                       the file, so that readers on other hosts see the old
+                       file or the new one, never a partial section
+        """
+        if name not in SECTION_VERSIONS:
+            raise ValueError("unknown section: %s" % name)
+        if atomic:
+            self._append_copy(name, obj)
+            return
+        if not self.exists():
+            with open(self.path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+        self._read_index()
+        with open(self.path, 'r+b') as f:
+            # drop a partial section left by an interrupted append
+            f.seek(self._end)
+            f.truncate()
+            self._write_section(f, name, obj)
+            f.flush()
+            os.fsync(f.fileno())
+        self._index = None
+
+    def _tmp_path(self):
+        # hosts sharing the directory write their own copy
+        return '%s.%s.%s.tmp' % (self.path, socket.gethostname(), os.getpid())
+
+    def _append_copy(self, name, obj):
+        tmp_path = self._tmp_path()
+        with open(tmp_path, 'wb') as f:
+            if self.exists():
+                self._read_index()
+                with open(self.path, 'rb') as old:
+                    remaining = self._end
+                    while remaining > 0:
+                        chunk = old.read(min(remaining, 1 << 20))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        remaining -= len(chunk)
+            else:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+            self._write_section(f, name, obj)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+        self._index = None
+
+    def write_event(self, event, replace=True):
+        """ Write a whole event to a new file, replacing any old one.
+        :param replace: False to leave an existing file alone, e.g. one that
+                        another host created and appended sections to meanwhile
+        :return: whether the file was written
+        """
+        tmp_path = self._tmp_path()
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+            metadata = dict((k, v) for k, v in event.items() if k not in SECTION_VERSIONS)
+            self._write_section(f, 'metadata', metadata)
+            for name in SECTION_VERSIONS:
+                if name != 'metadata' and name in event:
+                    self._write_section(f, name, event[name])
+            f.flush()
+            os.fsync(f.fileno())
+        self._index = None
+        if replace:
+            os.rename(tmp_path, self.path)
+            return True
+        # link fails if the file exists, also over NFS, where rename would replace it
+        try:
+            os.link(tmp_path, self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        finally:
+            os.unlink(tmp_path)
+        return True
+
+    def compact(self):
+        """ Drop sections that have been replaced by a later append.
+        """
+        self.write_event(self.load_event())
+
+
+def get_titles(directory):
+    """ Titles of events in a directory, from event files and old pickles.
+    """
+    titles = set()
+    for fname in os.listdir(directory):
+        for extension in (EXTENSION, '.pickle'):
+            if fname.endswith(extension):
+                titles.add(fname[:-len(extension)])
+    return sorted(titles)
+
+
+def migrate_pickle(fpath, directory=None, overwrite=False):
+    """ Convert one collections/<title>.pickle to an event file.
+    :param overwrite: replace the event file if there is one, losing the
+                      sections appended to it (not while collecting)
+    :return: EventStore, None if the event file exists
+    """
+    if directory is None:
+        directory = os.path.dirname(fpath)
+    with open(fpath, 'r') as f:
+        event = pickle.load(f)
+    if 'as_paths' in event:
+        event['as_paths'] = ASPaths.from_nested(event['as_paths'])
+    title = os.path.basename(fpath).split('.pickle')[0]
+    store = EventStore(directory, title)
+    if not store.write_event(event, replace=overwrite):
+        return None
+    return store
+
+
+def migrate_pickles(directory, overwrite=False):
+    """ Convert every pickle in a directory that has no event file yet.
+    """
+    count = 0
+    for fpath in sorted(glob.glob(os.path.join(directory, '*.pickle'))):
+        title = os.path.basename(fpath).split('.pickle')[0]
+        if EventStore(directory, title).exists() and not overwrite:
+            continue
+        if migrate_pickle(fpath, directory, overwrite) is None:
+            continue
+        count += 1
+        logging.info("Migrated %s" % fpath)
+    return count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s %(asctime)s: %(message)s",
+                        level=logging.INFO)
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'collections'
+    print "migrated %s pickles" % migrate_pickles(directory)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+""" Features of the classifier, in 11 of the 24 columns of
+datasets/results_news_updated_2.csv, from what collector.py stored per event
+(as_paths and pfxes_of_hijacker).
+
+Only the columns that agree with the results file on the recorded events
+are extracted (tests/test_features.py checks them). The durations and the
+hegemony columns of that file are not: the definitions they were computed
+with are not known.
+
+The rows of as_paths are read as NumPy arrays (the ASPaths columns), what
+depends on a path only is computed once per distinct path and spread to
+the rows with path_ids. MOAS and sub-MOAS prefixes are looked up in the
+origin intervals of the prefixes (origins.py). Events are extracted in a
+Pool.
+
+python features.py [collections] [-o features.csv] [--processes N]
+"""
+import os
+import sys
+import csv
+import pickle
+import logging
+import argparse
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from aspaths import ASPaths, RECORD_TYPE_CODES
+from eventstore import EventStore, get_titles
+from prefixes import parse_prefix
+from origins import origin_intervals
+
+# in the order of the results file
+COLUMNS = ['category', 'title', 'hj_as', 'hj_pfx', 'vt_as', 'vt_pfx', 'propagation', 'is_moas',
+           'is_submoas', 'diff_cider', 'edit_distance']
+SECTIONS = ['as_paths', 'pfxes_of_hijacker']
+WITHDRAWAL = RECORD_TYPE_CODES['withdrawal']
+
+
+def read_event(directory, title):
+    """ Read an event without migrating it (see collector.load_event)
+    """
+    store = EventStore(directory, title)
+    if store.exists():
+        event = store.load_event(SECTIONS)
+    else:
+        with open(os.path.join(directory, title + '.pickle'), 'rb') as f:
+            event = pickle.load(f)
+    for key in ('hijack_as', 'victim_as'):
+        event[key] = str(event.get(key, ''))
+    event['as_paths'] = ASPaths.from_nested(event['as_paths'])
+    return event
+
+
+def edit_distance(a, b):
+    """ Levenshtein distance of two strings, with the swap of two adjacent
+    characters as one edit (optimal string alignment)
+    """
+    before, previous = None, range(len(b) + 1)
+    for i, ca in enumerate(a):
+        current = [i + 1]
+        for j, cb in enumerate(b):
+            current.append(min(previous[j + 1] + 1, current[j] + 1, previous[j] + (ca != cb)))
+            if i and j and ca == b[j - 1] and a[i - 1] == cb:
+                current[-1] = min(current[-1], before[j - 1] + 1)
+        before, previous = previous, current
+    return previous[-1]
+
+
+def _segment_sums(values, offsets):
+    """ sums of values[offsets[i]:offsets[i + 1]], empty segments too
+    """
+    sums = np.zeros(len(values) + 1)
+    np.cumsum(values, out=sums[1:])
+    return sums[offsets[1:]] - sums[offsets[:-1]]
+
+
+def _array(values):
+    """ :return: NumPy view of an array.array
+    """
+    return np.frombuffer(values, dtype=np.dtype(values.typecode))
+
+
+class EventRows():
+    """ The rows of an ASPaths as NumPy arrays, with whether each distinct
+    path crosses a hijacker.
+    """
+    def __init__(self, as_paths, hijackers):
+        """ :param hijackers: ASNs (str) of the hijackers
+        """
+        self.path_ids = _array(as_paths.path_ids)
+        self.announced = _array(as_paths.types) != WITHDRAWAL
+        starts = _array(as_paths.group_starts).astype(np.intp)
+        collector_ids = _array(as_paths.collector_ids).astype(np.int64)
+        peer_ids = _array(as_paths.peer_ids)
+        self.peers = collector_ids * max(len(as_paths.peers), 1) + peer_ids
+        lengths = np.diff(np.append(starts, len(self.path_ids)))
+        self.group = np.repeat(np.arange(len(starts)), lengths)
+
+        # per distinct path
+        hijacker_asns = [int(asn) for asn in hijackers if asn.isdigit()]
+        offsets = _array(as_paths.path_offsets).astype(np.intp)
+        self.path_has_hijacker = _segment_sums(np.in1d(_array(as_paths.path_asns), hijacker_asns),
+                                               offsets) > 0
+
+    def propagation(self):
+        """ share of the peers that announced a path through a hijacker
+        """
+        rows = self.announced & self.path_has_hijacker[self.path_ids]
+        hijacked = np.unique(self.peers[np.unique(self.group[rows])])
+        return len(hijacked) / float(max(len(np.unique(self.peers)), 1))
+
+
+def extract(event):
+    """ Features of an event
+    :return: {column: value}, '' for what does not apply
+    """
+    hijackers = [asn for asn in event['hijack_as'].split(', ') if asn]
+    hijacker_set = set(hijackers)
+    victim = event['victim_as']
+    pfx = event['hijack_prefix']
+    # typo events name the prefix of the victim original_prefix
+    row = {'category': event.get('category', ''), 'title': event['title'],
+           'hj_as': hijackers, 'hj_pfx': pfx, 'vt_as': victim,
+           'vt_pfx': event.get('prefix', event.get('original_prefix', ''))}
+
+    row['propagation'] = EventRows(event['as_paths'], hijacker_set).propagation()
+    origins = origin_intervals(event['as_paths'])
+    row['is_moas'] = int(bool(hijacker_set & set(origins.get(pfx, {}))) and
+                         len(origins.get(pfx, {})) > 1)
+    length = parse_prefix(pfx)[2]
+    overlapping = [prefix for prefix, of_prefix in origins.overlapping(pfx)
+                   if hijacker_set & set(of_prefix)]
+    row['is_submoas'] = int(bool(overlapping))
+    row['diff_cider'] = sorted((parse_prefix(prefix)[2] - length for prefix in overlapping),
+                               reverse=True) or ''
+
+    # the ASNs and the other prefixes of the hijackers
+    distances = [edit_distance(asn, victim) for asn in hijackers]
+    for asn in hijackers:
+        distances.extend(edit_distance(pfx.split('/')[0], prefix.split('/')[0])
+                         for prefix in event['pfxes_of_hijacker'].get(asn, []) if prefix != pfx)
+    row['edit_distance'] = min(distances) if distances else ''
+    return row
+
+
+def format_row(row):
+    """ CSV fields of extract(), floats at full precision
+    """
+    return [repr(row[column]) if isinstance(row[column], float) else str(row[column])
+            for column in COLUMNS]
+
+
+def _extract_title(args):
+    directory, title = args
+    try:
+        return title, extract(read_event(directory, title))
+    except Exception:
+        logging.exception("[%s] feature extraction failed" % title)
+        return title, None
+
+
+def extract_all(directory, titles=None, processes=None):
+    """ :return: [(title, row or None)] in the order of titles
+    """
+    if titles is None:
+        titles = get_titles(directory)
+    jobs = [(directory, title) for title in titles]
+    if processes == 1:
+        return map(_extract_title, jobs)
+    pool = Pool(processes=processes or cpu_count())
+    try:
+        return pool.map(_extract_title, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_csv(rows, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(format_row(row))
+    os.rename(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default='collections')
+    parser.add_argument('-o', '--output', default='features.csv')
+    parser.add_argument('--processes', type=int, default=cpu_count())
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results = extract_all(args.directory, processes=args.processes)
+    rows = [row for title, row in results if row is not None]
+    write_csv(rows, args.output)
+    logging.info("%s events, %s skipped, written to %s"
+                 % (len(rows), len(results) - len(rows), args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+""" Two tier cache of IHR hegemony results.
+Hegemony of a past timebin never changes, so entries never expire.
+ - tier 1: bounded LRU dict in this process
+ - tier 2: SQLite file shared by all processes (pool workers, other runs)
+   of a host. WAL journaling needs memory shared by the processes of one
+   host, a file on NFS (collections/ of a distributed run) is one per host
+   and uses a rollback journal.
+Keys are (type, asn, af, timebin), values are {asn(int): hege} as
+returned by GetHegemony.get_hegemony.
+"""
+import os
+import pickle
+import socket
+import sqlite3
+import logging
+from datetime import datetime
+from collections import OrderedDict
+import metrics
+
+DEFAULT_CACHE_PATH = 'hegemony_cache.sqlite'
+CACHE_FILE = 'hegemony_cache%s.sqlite'
+DEFAULT_MEMORY_SIZE = 100000
+
+
+def make_key(type, asn, af, timebin):
+    """ Normalize a hegemony key, asn/af as strings, timebin as
+    '%Y-%m-%dT%H:%M' the same way we query IHR.
+    """
+    asn = str(asn)
+    if '{' in asn:
+        asn = asn[1:-1]
+    if isinstance(timebin, datetime):
+        timebin = datetime.strftime(timebin, '%Y-%m-%dT%H:%M')
+    return (type, asn, str(af), timebin)
+
+
+def cache_path(directory, per_host=False):
+    """ :param per_host: a file per host, for a directory shared over NFS
+    :return: path of the cache file in a directory (collections/)
+    """
+    return os.path.join(directory, CACHE_FILE % ('.' + socket.gethostname() if per_host else ''))
+
+
+class HegemonyCache():
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_size=DEFAULT_MEMORY_SIZE,
+                 journal_mode='WAL'):
+        """ :param path: SQLite file, None for memory only
+        :param memory_size: max entries of the in-process LRU
+        :param journal_mode: 'WAL' on a local disk, 'DELETE' on NFS
+        """
+        self.path = path
+        self.journal_mode = journal_mode
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # sqlite connections must not cross a fork, open one per process
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=%s" % self.journal_mode)
+            conn.execute("CREATE TABLE IF NOT EXISTS hegemony ("
+                         "type TEXT, asn TEXT, af TEXT, timebin TEXT, results BLOB, "
+                         "PRIMARY KEY (type, asn, af, timebin))")
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _remember(self, key, results):
+        self.memory[key] = results
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get(self, type, asn, af, timebin):
+        """ :return: {asn: hege} or None
+        """
+        key = make_key(type, asn, af, timebin)
+        if key in self.memory:
+            results = self.memory.pop(key)
+            self.memory[key] = results
+            self.counters['memory_hits'] += 1
+            metrics.inc('hegemony_cache_lookups_total', result='memory_hit')
+            return results
+        if self.path is not None:
+            row = self._connection().execute(
+                "SELECT results FROM hegemony WHERE type=? AND asn=? AND af=? AND timebin=?",
+                key).fetchone()
+            if row is not None:
+                results = pickle.loads(str(row[0]))
+                self._remember(key, results)
+                self.counters['disk_hits'] += 1
+                metrics.inc('hegemony_cache_lookups_total', result='disk_hit')
+                return results
+        self.counters['misses'] += 1
+        metrics.inc('hegemony_cache_lookups_total', result='miss')
+        return None
+
+    def get_many(self, keys):
+        """ :param keys: iterable of (type, asn, af, timebin)
+        :return: {key: results} of the keys we have
+        """
+        found = dict()
+        for key in keys:
+            results = self.get(*key)
+            if results is not None:
+                found[make_key(*key)] = results
+        return found
+
+    def put(self, type, asn, af, timebin, results):
+        self.put_many([((type, asn, af, timebin), results)])
+
+    def put_many(self, items):
+        """ :param items: iterable of ((type, asn, af, timebin), results)
+        """
+        rows = []
+        for key, results in items:
+            key = make_key(*key)
+            self._remember(key, results)
+            rows.append(key + (sqlite3.Binary(pickle.dumps(results, pickle.HIGHEST_PROTOCOL)),))
+        self.counters['stores'] += len(rows)
+        if self.path is not None and rows:
+            conn = self._connection()
+            conn.executemany("INSERT OR IGNORE INTO hegemony VALUES (?, ?, ?, ?, ?)", rows)
+            conn.commit()
+
+    def hit_rate(self):
+        hits = self.counters['memory_hits'] + self.counters['disk_hits']
+        total = hits + self.counters['misses']
+        return float(hits) / total if total else 0.0
+
+    def log_stats(self, title=''):
+        logging.info("[%s] hegemony cache: %s, hit rate %.3f"
+                     % (title, self.counters, self.hit_rate()))
+
+
+_shared_cache = None
+
+
+def configure_shared_cache(path=DEFAULT_CACHE_PATH, journal_mode='WAL'):
+    """ Replace the shared cache, before the workers are forked.
+    """
+    global _shared_cache
+    _shared_cache = HegemonyCache(path, journal_mode=journal_mode)
+    return _shared_cache
+
+
+def get_shared_cache():
+    """ The cache shared by every GetHegemony of this process.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = HegemonyCache()
+    return _shared_cache
@@ -1,17 +1,37 @@
 # get hegemony score of local and global
 # ihr.iijlab.net/ihr/api/hegemony/?originasn=0&asn=2497&af=4&timebin__gte=2017-11-20T00:00&timebin__lte=2017-11-21T23:59
 import logging
-import requests
 from pymongo import MongoClient
 from dateutil.parser import parse
 from datetime import datetime, timedelta
+from hegecache import get_shared_cache
+from ihr import get_shared_client
+from pathnorm import NormalizedPath
+import metrics
+
+IHR_HEGEMONY_URL = "https://ihr.iijlab.net/ihr/api/hegemony/?"
 
 
 class GetHegemony():
-    def __init__(self, title, local_cache=False):
-        self.base_url = "https://ihr.iijlab.net/ihr/api/hegemony/?"
-        self.hegemony = {'global': dict(), 'local': dict()}
+    def __init__(self, title, local_cache=False, cache=None, base_url=IHR_HEGEMONY_URL,
+                 client=None):
+        """
+        :param title: event title, for logging
+        :param local_cache: also use the MongoDB cache (needs a local mongod)
+        :param cache: HegemonyCache, default is the one shared by this process
+        :param base_url: IHR hegemony API
+        :param client: IHRClient, default is the one shared by this process
+        """
+        self.base_url = base_url
+        self.cache = cache if cache is not None else get_shared_cache()
+        self.client = client if client is not None else get_shared_client()
         self.hours_ago_before_the_event = 2
+        # local hegemony is read +-2 hours around the hegemony time
+        self.local_window_hours = 2
+        # origin ASes per local hegemony query
+        self.origins_per_query = 20
+        # ASes per global hegemony query, keeps urls short
+        self.asns_per_query = 100
         self.local_cache = local_cache
         self.title = title
         self.origin_ases = set()
@@ -67,7 +87,7 @@ class GetHegemony():
         :return:
         """
         if '{' in asn:
-            asn = asn[-1,1]
+            asn = asn[1:-1]
         # when local_cache is True, check whether we have local store
         if self.local_cache:
             rsp = self.check_hege_in_mongodb(asn, dt_time, af, type)
@@ -82,16 +102,14 @@ class GetHegemony():
             query_url = self.base_url + local_api % (asn, af, query_time)
         if query_url == '':
             raise ValueError('query url is required, but missed')
-        rsp = requests.get(query_url)
-        rsp = rsp.json()
+        rsp = self.client.get_all(query_url)
 
         if 'results' in rsp and len(rsp['results']) == 0:
             gte_time = datetime.strftime(dt_time - timedelta(minutes=10), '%Y-%m-%dT%H:%M')
             lte_time = datetime.strftime(dt_time + timedelta(minutes=10), '%Y-%m-%dT%H:%M')
             updated = '&timebin__gte=%s&timebin__lte=%s&format' % (gte_time, lte_time)
             query_url = query_url.split('&timebin')[0] + updated + query_url.split('&format')[1]
-            rsp = requests.get(query_url)
-            rsp = rsp.json()
+            rsp = self.client.get_all(query_url)
 
         if ('results' in rsp) and (len(rsp['results']) != 0):
             # Store rsp of the new query
@@ -113,24 +131,20 @@ class GetHegemony():
         :param type: str 'global' or ' local'
         :return:
         """
-        if (asn in self.hegemony[type]) and (af in self.hegemony[type][asn]) \
-                and (dt_time in self.hegemony[type][asn][af]):
-            return self.hegemony[type][asn][af][dt_time]
+        hegemony = self.cache.get(type, asn, af, dt_time)
+        if hegemony is not None:
+            return hegemony
 
         results = self.query_to_get_hegemony(asn, dt_time, af, type)
-        if asn not in self.hegemony[type]:
-            self.hegemony[type][asn] = dict()
-        if af not in self.hegemony[type][asn]:
-            self.hegemony[type][asn][af] = dict()
-        if dt_time not in self.hegemony[type][asn][af]:
-            self.hegemony[type][asn][af][dt_time] = dict()
+        hegemony = dict()
         if results:
             for this in results:
-                self.hegemony[type][asn][af][dt_time][this['asn']] = this['hege']
-            return self.hegemony[type][asn][af][dt_time]
+                hegemony[this['asn']] = this['hege']
+            self.cache.put(type, asn, af, dt_time, hegemony)
         else:
-            self.hegemony[type][asn][af][dt_time][int(asn)] = 0
-            return self.hegemony[type][asn][af][dt_time]
+            # Not cached, IHR may just not have answered this time
+            hegemony[int(asn)] = 0
+        return hegemony
 
     def get_local_hege_path(self, path, pfx, start_time, origin_as):
         """ Given as-path, return local hegemony path
@@ -193,45 +207,84 @@ class GetHegemony():
         hege_path = " ".join(str(x) for x in hege_path)
         return hege_path
 
+    def get_global_hegemony(self, ases, dt_time, af):
+        """ Global hegemony of many ASes, from the cache when we have it,
+        otherwise from IHR in chunks of self.asns_per_query ASes. The ASes
+        IHR answered nothing for are cached as {} and not queried again.
+        :param ases: iterable of AS strings, AS-sets '{a,b}' or 'a,b' are split
+        :param dt_time: hegemony time (datetime)
+        :param af: '4' or '6'
+        :return: {asn(str): hege} of the ASes IHR knows
+        """
+        asns = set()
+        for asn in ases:
+            asns.update(a for a in asn.strip('{}').split(',') if a.isdigit())
+        hegemony = dict()
+        missing = []
+        for asn in sorted(asns):
+            cached = self.cache.get('global', asn, af, dt_time)
+            if cached is None:
+                missing.append(asn)
+            elif int(asn) in cached:
+                hegemony[asn] = cached[int(asn)]
+        metrics.inc('hegemony_ases_total', len(asns) - len(missing), kind='global', source='cache')
+        metrics.inc('hegemony_ases_total', len(missing), kind='global', source='ihr')
+        if len(missing) == 0:
+            return hegemony
+
+        logging.info("[%s] reading %s ASes from IIJ (%s cached)"
+                     % (self.title, len(missing), len(asns) - len(missing)))
+        query_time = datetime.strftime(dt_time, '%Y-%m-%dT%H:%M')
+        chunks = [missing[i:i + self.asns_per_query]
+                  for i in range(0, len(missing), self.asns_per_query)]
+        urls = [self.base_url + "originasn=0&af=%s&timebin=%s&format=json&asn=%s"
+                % (af, query_time, ','.join(chunk)) for chunk in chunks]
+        responses = self.client.get_many(urls)
+
+        # chunks without any result: try +-10 minutes
+        gte_time = datetime.strftime(dt_time - timedelta(minutes=10), '%Y-%m-%dT%H:%M')
+        lte_time = datetime.strftime(dt_time + timedelta(minutes=10), '%Y-%m-%dT%H:%M')
+        retry = [i for i, rsp in enumerate(responses)
+                 if 'results' in rsp and len(rsp['results']) == 0]
+        urls = [self.base_url + "originasn=0&af=%s&timebin__gte=%s&timebin__lte=%s"
+                "&format=json&asn=%s" % (af, gte_time, lte_time, ','.join(chunks[i]))
+                for i in retry]
+        for i, rsp in zip(retry, self.client.get_many(urls)):
+            responses[i] = rsp
+
+        found = dict()
+        # ASes of the chunks IHR answered, the others may be there next time
+        answered = []
+        for chunk, rsp in zip(chunks, responses):
+            if 'results' in rsp:
+                answered.extend(chunk)
+            for result in rsp.get('results', []):
+                found[str(result['asn'])] = result['hege']
+        if len(found) == 0:
+            logging.info("[%s] no global hegemony for %s ASes at %s"
+                         % (self.title, len(missing), query_time))
+        self.cache.put_many([(('global', asn, af, dt_time), {int(asn): hege})
+                             for asn, hege in found.items()] +
+                            [(('global', asn, af, dt_time), dict())
+                             for asn in answered if asn not in found])
+        hegemony.update(found)
+        return hegemony
+
     def get_batch_global_hege_path(self, unique_ases, unique_paths, pfx, start_time, hj_as=[]):
         """
+        :param unique_ases: set of ASes on the paths
+        :param unique_paths: as-path strings or NormalizedPath
         :return:
         """
         dt_time = self.get_hege_time(start_time)
-        query_time = datetime.strftime(dt_time, '%Y-%m-%dT%H:%M')
         af = self.check_ip_version(pfx)
 
         unique_ases = unique_ases | set(hj_as)
-        logging.info("reading %s ASes from IIJ" %(len(unique_ases)))
-
-        url = "https://ihr.iijlab.net/ihr/api/hegemony/?" \
-              "originasn=0&af=%s&timebin=%s&format=json&asn=%s" \
-              % (af, query_time, ','.join(unique_ases))
-        rsp = requests.get(url)
-        rsp = rsp.json()
-
-        if 'results' in rsp and len(rsp['results']) == 0:
-            gte_time = dt_time - timedelta(minutes=10)
-            gte_time = datetime.strftime(gte_time, '%Y-%m-%dT%H:%M')
-            lte_time = dt_time + timedelta(minutes=10)
-            lte_time = datetime.strftime(lte_time, '%Y-%m-%dT%H:%M')
-            url = 'https://ihr.iijlab.net/ihr/api/hegemony/?' \
-                 'originasn=0&af=%s&timebin__gte=%s&timebin__lte=%s&format=json&asn=%s'\
-                  % (af, gte_time, lte_time, ','.join(unique_ases))
-            rsp = requests.get(url)
-            rsp = rsp.json()
-
-        hegemony = dict()
-        if 'results' in rsp and len(rsp['results']) != 0:
-            for result in rsp['results']:
-                hegemony[str(result['asn'])] = result['hege']
-        else:
-            assert("no hegemony results")
+        hegemony = self.get_global_hegemony(unique_ases, dt_time, af)
 
         hege_paths = []
         for path in unique_paths:
-            path = path.split(' ')
-            new_path = [v for i, v in enumerate(path) if i == 0 or v != path[i - 1]]
+            new_path = self.get_hops(path)
             hege_paths.append((new_path, [hegemony[asn] if asn in hegemony else 0 for asn in new_path]))
 
         global_hj_as = dict()
@@ -241,45 +294,116 @@ class GetHegemony():
 
         return hege_paths, global_hj_as
 
+    def prefetch_local_hegemony(self, origin_ases, start_time, af):
+        """ Read local hegemony of many origin ASes at once.
+        One window query (+-self.local_window_hours) per self.origins_per_query
+        origins gives both the hegemony at the hegemony time and how it
+        changed around it. Both go to the cache, so the following
+        get_batch_local_hege_path calls do not query IHR. They are cached
+        as {} for the origins IHR answered nothing for.
+        :param origin_ases: iterable of origin AS strings
+        :param start_time: event start time
+        :param af: '4' or '6'
+        """
+        self.prefetch_local_hegemony_at(origin_ases, self.get_hege_time(start_time), af)
+
+    def prefetch_local_hegemony_at(self, origin_ases, dt_time, af):
+        """ prefetch_local_hegemony for a hegemony time (see get_hege_time)
+        """
+        origins = set()
+        for origin_as in origin_ases:
+            if '{' in origin_as:
+                origin_as = origin_as[1:-1]
+            origins.add(origin_as)
+        origins = sorted(origin_as for origin_as in origins
+                         if self.cache.get('local_window', origin_as, af, dt_time) is None)
+        metrics.inc('hegemony_ases_total', len(origins), kind='local', source='ihr')
+        if len(origins) == 0:
+            return
+
+        gte_time = datetime.strftime(dt_time - timedelta(hours=self.local_window_hours),
+                                     '%Y-%m-%dT%H:%M')
+        lte_time = datetime.strftime(dt_time + timedelta(hours=self.local_window_hours),
+                                     '%Y-%m-%dT%H:%M')
+        chunks = [origins[i:i + self.origins_per_query]
+                  for i in range(0, len(origins), self.origins_per_query)]
+        urls = [self.base_url + "originasn=%s&af=%s&timebin__gte=%s&timebin__lte=%s&format=json"
+                % (','.join(chunk), af, gte_time, lte_time) for chunk in chunks]
+        logging.info("[%s] reading local hegemony of %s origin ASes in %s queries"
+                     % (self.title, len(origins), len(urls)))
+
+        windows = dict()
+        # origins of the queries IHR answered, the others may be there next time
+        answered = []
+        for chunk, rsp in zip(chunks, self.client.get_many(urls)):
+            if 'results' in rsp:
+                answered.extend(chunk)
+            for re in rsp.get('results', []):
+                window = windows.setdefault(str(re['originasn']), dict())
+                if not re['timebin'] in window:
+                    window[re['timebin']] = dict()
+                window[re['timebin']][re['asn']] = re['hege']
+
+        for origin_as in answered:
+            # the window covers the +-10 minutes get_hegemony falls back to
+            window = windows.get(origin_as, dict())
+            self.cache.put('local_window', origin_as, af, dt_time, window)
+            self.cache.put('local', origin_as, af, dt_time, self.hegemony_at(window, dt_time))
+
+    def hegemony_at(self, window, dt_time):
+        """ Hegemony at dt_time from {timebin: {asn: hege}}, or within
+        +-10 minutes like query_to_get_hegemony falls back to.
+        """
+        query_time = datetime.strftime(dt_time, '%Y-%m-%dT%H:%M')
+        for timebin in window:
+            if timebin[:16] == query_time:
+                return window[timebin]
+        gte_time = datetime.strftime(dt_time - timedelta(minutes=10), '%Y-%m-%dT%H:%M')
+        lte_time = datetime.strftime(dt_time + timedelta(minutes=10), '%Y-%m-%dT%H:%M')
+        hegemony = dict()
+        for timebin in sorted(window):
+            if gte_time <= timebin[:16] <= lte_time:
+                hegemony.update(window[timebin])
+        return hegemony
+
     def get_batch_local_hege_path(self, paths, pfx, start_time, origin_as):
         if '{' in origin_as:
             origin_as = origin_as[1:-1]
         dt_time = self.get_hege_time(start_time)
         af = self.check_ip_version(pfx)
 
+        # want to check whether local hegemony changed over time
+        self.prefetch_local_hegemony([origin_as], start_time, af)
+        local_hege = self.cache.get('local_window', origin_as, af, dt_time)
+        if not local_hege:
+            local_hege = dict()
+            print 'no local hegemony: %s, %s, %s' % (origin_as, af, dt_time)
+
         rsp = self.get_hegemony(origin_as, dt_time, af, 'local')
 
         hege_paths = []
         for path in paths:
-            path = path.split(' ')
-            new_path = [v for i, v in enumerate(path) if i == 0 or v != path[i - 1]]
+            new_path = self.get_hops(path)
             hege_path = []
             for asn in new_path:
-                if rsp and (int(asn) in rsp):
+                # AS-sets have no hegemony
+                if rsp and asn.isdigit() and (int(asn) in rsp):
                     hege_path.append(rsp[int(asn)])
                 else:
                     hege_path.append(0)
             hege_paths.append((new_path, hege_path))
 
-        # want to check whether local hegemony changed over time
-        gte_time = datetime.strftime(dt_time - timedelta(hours=2), '%Y-%m-%dT%H:%M')
-        lte_time = datetime.strftime(dt_time + timedelta(hours=2), '%Y-%m-%dT%H:%M')
-        query_url = "https://ihr.iijlab.net/ihr/api/hegemony/?" \
-                    "originasn=%s&af=%s&timebin__gte=%s" \
-                    "&timebin__lte=%s&format=json" % (origin_as, af, gte_time, lte_time)
-        rsp = requests.get(query_url)
-        rsp = rsp.json()
-        local_hege = dict()
-        for re in rsp['results']:
-            if not re['timebin'] in local_hege:
-                local_hege[re['timebin']] = dict()
-            local_hege[re['timebin']][re['asn']] = re['hege']
-
-        if len(rsp['results']) == 0:
-            print 'no local hegemony: %s' %query_url
-
         return hege_paths, local_hege
 
+    def get_hops(self, path):
+        """ as-path as a list with prepending collapsed
+        :param path: as-path string or NormalizedPath
+        """
+        if isinstance(path, NormalizedPath):
+            return list(path.hops)
+        path = path.split(' ')
+        return [v for i, v in enumerate(path) if i == 0 or v != path[i - 1]]
+
     def get_hege_time(self, timestring):
         """ new time for querying hegemony
         :param timestring:
@@ -1,20 +1,96 @@
 #!/usr/bin/env python
 import time
 import logging
-from itertools import groupby
+from array import array
+from itertools import groupby, izip
+from multiprocessing import Pool
 from dateutil.parser import parse
 from collections import defaultdict
 from datetime import timedelta, datetime
 from _pybgpstream import BGPStream, BGPRecord
+from sinks import Elem, TimelineSink, PrefixOriginSink, CoveringPathsSink, HijackerPrefixesSink
+from elemcache import ElemSegment, split_filters
+import metrics
+
+
+# intervals longer than this are read in shards when processes > 1
+DEFAULT_SHARD_SECONDS = 6 * 3600
+
+
+def new_bgpstream():
+    return BGPStream(), BGPRecord()
+
+
+# stream source of the shard workers, set by the pool initializer
+_shard_source = None
+
+
+def _init_shard_worker(source):
+    global _shard_source
+    _shard_source = source
+
+
+def _read_shard(args):
+    """ Elems of one shard, read in a pool worker
+    :param args: (filters, start_time, end_time, collector or None)
+    :return: (elems as tuples, record number of each elem, origin_ases, records read,
+              record_times)
+    """
+    filters, start_time, end_time, collector = args
+    stream, record = (_shard_source or new_bgpstream)()
+    handler = HistoBGPStream(stream, record)
+    for string in filters:
+        handler.set_filter(string)
+    if collector is not None:
+        handler.set_filter('collector %s' % collector)
+    elems = []
+    record_numbers = array('I')
+    for elem in handler.iter_elems(start_time, end_time):
+        elems.append(tuple(elem))
+        record_numbers.append(handler.records_read)
+    return elems, record_numbers, handler.origin_ases, handler.records_read, \
+        dict(handler.record_times)
 
 
 class HistoBGPStream():
-    def __init__(self):
+    def __init__(self, stream=None, record=None, processes=1,
+                 shard_seconds=DEFAULT_SHARD_SECONDS, collectors=None, source=None,
+                 cache=None, checkpoint=None):
+        """
+        :param stream, record: BGPStream and BGPRecord to use
+                               (or stand-ins, e.g. standins.FakeBGPStream)
+        :param processes: read long intervals in shards with this many processes
+        :param shard_seconds: length of a time shard
+        :param collectors: also shard by these collectors
+        :param source: function returning a new (stream, record) for a shard
+                       or a time range missing in the cache, default new_bgpstream;
+                       also the stream to use if stream is not given
+        :param cache: elemcache.ElemCache to replay from and record to
+        :param checkpoint: checkpoints.Checkpoint to resume the stream of
+                           get_bgpstream / collect_events from after a crash
+        """
         # Create a new bgpstream instance
         # and a reusable bgprecord instances
-        self.stream = BGPStream()
-        self.rec = BGPRecord()
+        if stream is None and source is not None:
+            stream, record = source()
+        self.stream = stream if stream is not None else BGPStream()
+        self.rec = record if record is not None else BGPRecord()
+        self.processes = processes
+        self.shard_seconds = shard_seconds
+        self.collectors = collectors
+        self.source = source
+        self.cache = cache
+        self.checkpoint = checkpoint
+        # filter strings given to set_filter, for shards
+        self.filters = []
         self.origin_ases = set()
+        # records decoded from the stream
+        self.records_read = 0
+        # records decoded per (collector, record time)
+        self.record_times = defaultdict(int)
+        # per event of the last collect_events, the records the streams of
+        # that event alone would have decoded
+        self.records_alone = []
         self.bgp_lens = defaultdict(lambda: defaultdict(lambda: None))
 
     def set_filter(self, string):
@@ -26,6 +102,7 @@ class HistoBGPStream():
         :return:
         """
         logging.info("Set filter: %s" % string)
+        self.filters.append(string)
         self.stream.parse_filter_string(string)
 
     def convert_dt_to_timestamp(self, dt):
@@ -38,13 +115,10 @@ class HistoBGPStream():
         assert datetime.utcfromtimestamp(timestamp) == dt
         return int(timestamp)
 
-    def get_paths(self, start_time, end_time=None):
-        """ Return all paths for each peer for each collector
-        for the given time interval.
-        :param start_time: datimetime/date_string
-        :param end_time: datimetime/date_string/None
-        :return: paths(dict)[collector][peer-address][record-type]
-                                           = (AS-path,time,prefix)
+    def get_paths_interval(self, start_time, end_time=None):
+        """ From 8 hours before start_time until end_time
+        (or 2 hours after start_time)
+        :return: (start timestamp, end timestamp)
         """
         # If end_time is None, set as one hour duration.
         if isinstance(start_time, str):
@@ -62,23 +136,61 @@ class HistoBGPStream():
             start_time = self.convert_dt_to_timestamp(start_time)
         if not isinstance(end_time, int):
             end_time = self.convert_dt_to_timestamp(end_time)
+        return start_time, end_time
 
+    def get_prefixes_interval(self, start_time):
+        """ From 8 hours to 1 hour before start_time
+        :return: (start timestamp, end timestamp)
+        """
+        if isinstance(start_time, str):
+            start_time = parse(start_time)
+        start_collect_time = start_time - timedelta(hours=8)
+        end_collect_time = start_time - timedelta(hours=1)
+
+        # If start_time or end_time is not timestamp, convert them.
+        if not isinstance(start_collect_time, int):
+            start_collect_time = self.convert_dt_to_timestamp(start_collect_time)
+        if not isinstance(end_collect_time, int):
+            end_collect_time = self.convert_dt_to_timestamp(end_collect_time)
+        return start_collect_time, end_collect_time
+
+    def get_hijackers(self, ases):
+        """ :param ases: 'asn' or 'asn, asn'
+        :return: list of ASNs
+        """
+        hijackers = [ases]
+        if ',' in ases:
+            hijackers = ases.split(', ')
+        return hijackers
+
+    def get_paths(self, start_time, end_time=None):
+        """ Return all paths for each peer for each collector
+        for the given time interval.
+        :param start_time: datimetime/date_string
+        :param end_time: datimetime/date_string/None
+        :return: paths(dict)[collector][peer-address][record-type]
+                                           = (AS-path,time,prefix)
+        """
+        start_time, end_time = self.get_paths_interval(start_time, end_time)
         paths = self.get_bgpstream(start_time, end_time)
         return paths
 
-    def get_bgpstream(self, start_time, end_time=None):
-        """ Read all rib + updates according to filters.
-        You have to set filters with self.set_filter function
-        before run this if you need to set some filters.
-        If the time for collecting paths is too long,
-        we will optimize it later. Let's record the time taken.
+    def iter_elems(self, start_time, end_time=None):
+        """ Read rib + updates according to filters, like get_bgpstream,
+        but yield each elem as it is parsed instead of collecting them.
         :param start_time:(timestamp)
         :param end_time:(timestamp)
-        :return: paths(dict)[collector][peer-address][record-type]
-                                           = (AS-path,time,prefix)
+        :return: generator of sinks.Elem
         """
-        logging.info("Collecting.. histo BGPStream [%s, %s]" % (start_time, end_time))
-        time_taken = time.time()
+        if self.cache is not None and end_time is not None:
+            for elem in self.iter_cached(start_time, end_time):
+                yield elem
+            return
+        if self.processes > 1 and end_time is not None and \
+                (end_time - start_time > self.shard_seconds or self.collectors):
+            for elem in self.iter_shards(start_time, end_time):
+                yield elem
+            return
 
         # Time intervals: mandatory
         self.stream.add_interval_filter(start_time, end_time)
@@ -89,12 +201,14 @@ class HistoBGPStream():
         # Get next record
         # (record is rib/updates from a single peer of a collector)
         # (each record might have many elems. an elem per a prefix)
-        paths = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: list())))
         while (self.stream.get_next_record(self.rec)):
+            self.records_read += 1
+            self.record_times[(self.rec.collector, self.rec.time)] += 1
             elem = self.rec.get_next_elem()
             while (elem):
                 if ('prefix' not in elem.fields) or (elem.type == 'S'):
                     logging.debug("No prefix: %s, %s" % (elem.fields, elem.type))
+                    elem = self.rec.get_next_elem()
                     continue
                 # 0.0.0.0/0 is default, means "everything else", thus ignore!
                 if elem.fields['prefix'] == '0.0.0.0/0':
@@ -117,61 +231,190 @@ class HistoBGPStream():
                 if elem.type == 'W':
                     record_type = 'withdrawal'
 
-                if len(paths[self.rec.collector][elem.peer_address][elem.fields['prefix']]) != 0:
-                    # Traverse paths in reverse order to find the right time line.
-                    length = len(paths[self.rec.collector][elem.peer_address][elem.fields['prefix']])
-                    for index in reversed(range(length)):
-                        p_time, p_type, p_as_path =\
-                            paths[self.rec.collector][elem.peer_address][elem.fields['prefix']][index]
-                        # If the current time is the last timestamp from announcements until now,
-                        # just append it at the end and break. Don't need to finish the travel.
-                        if self.rec.time >= p_time:
-                            if p_as_path != as_path:
-                                # if this is in the middle of the list, we have to check index+1 paths
-                                # whether there are identical, if they are identical,
-                                # delete index+1 and add this one.
-                                if (index + 1 != length):
-                                    f_time, f_type, f_as_path = \
-                                    paths[self.rec.collector][elem.peer_address][elem.fields['prefix']][index+1]
-                                    if as_path == f_as_path:
-                                        logging.info("Delete the same routing info.")
-                                        logging.debug("*** prefix: %s\n"
-                                                      "prev: %s, %s, %s\n"
-                                                      "new: %s, %s, %s\n"
-                                                      "next: %s, %s, %s" % (elem.fields['prefix'],
-                                                                          p_time, p_type, p_as_path,
-                                                                          self.rec.time, record_type, as_path,
-                                                                          f_time, f_type, f_as_path))
-                                        del paths[self.rec.collector][elem.peer_address][elem.fields['prefix']][index+1]
-                                paths[self.rec.collector][elem.peer_address][elem.fields['prefix']]\
-                                    .insert(index+1, (self.rec.time, record_type, as_path))
-                                if (index + 1 != length):
-                                    if as_path == f_as_path:
-                                        logging.debug("updated: %s"
-                                              % paths[self.rec.collector][elem.peer_address][elem.fields['prefix']])
-                            break
-                        # Otherwise, just pass!
-                        else:
-                            logging.info("The routing info arrives later than the latest one.")
-                            if (index == 0) and (record_type != 'withdrawal'):
-                                logging.debug("*** prefix: %s\n"
-                                              "new_path: %s, %s, %s\n"
-                                              "cur_path: %s, %s, %s\n" % (elem.fields['prefix'],
-                                                                         self.rec.time, record_type, as_path,
-                                                                         p_time, p_type, p_as_path))
-                                if as_path == p_as_path:
-                                    del paths[self.rec.collector][elem.peer_address][elem.fields['prefix']][index]
-                                paths[self.rec.collector][elem.peer_address][elem.fields['prefix']] \
-                                    .insert(index, (self.rec.time, record_type, as_path))
-                                logging.debug("updated: %s"
-                                              % paths[self.rec.collector][elem.peer_address][elem.fields['prefix']])
-
-                else:
-                    paths[self.rec.collector][elem.peer_address][elem.fields['prefix']].append\
-                        ((self.rec.time, record_type, as_path))
+                yield Elem(self.rec.collector, elem.peer_address, elem.fields['prefix'],
+                           self.rec.time, record_type, as_path)
 
                 elem = self.rec.get_next_elem()
 
+    def iter_cached(self, start_time, end_time):
+        """ iter_elems replayed from self.cache where it covers the interval,
+        the time ranges it does not cover are read from new streams
+        and recorded to it.
+        """
+        terms, collectors = split_filters(self.filters)
+        for piece_start, piece_end, path in self.cache.plan(self.filters, start_time, end_time):
+            records_read = self.records_read
+            metrics.inc('elem_cache_pieces_total', result='miss' if path is None else 'hit')
+            if path is not None:
+                for elem, record_number in self.cache.iter_segment(self.filters, path,
+                                                                   piece_start, piece_end):
+                    self.records_read = records_read + record_number
+                    if elem.as_path:
+                        self.origin_ases.add(elem.as_path.split(" ")[-1])
+                    yield elem
+                self.add_record_times(self.cache.record_times(self.filters, path,
+                                                              piece_start, piece_end))
+                continue
+
+            logging.info("Not in the cache: [%s, %s]" % (piece_start, piece_end))
+            stream, record = (self.source or new_bgpstream)()
+            live = HistoBGPStream(stream, record, self.processes, self.shard_seconds,
+                                  self.collectors, self.source)
+            for string in self.filters:
+                live.set_filter(string)
+            segment = ElemSegment(piece_start, piece_end, collectors)
+            for elem in live.iter_elems(piece_start, piece_end):
+                segment.append(elem, live.records_read)
+                self.records_read = records_read + live.records_read
+                yield elem
+            self.origin_ases |= live.origin_ases
+            self.records_read = records_read + live.records_read
+            self.add_record_times(live.record_times)
+            segment.records = live.records_read
+            segment.set_record_times(live.record_times)
+            self.cache.save(self.filters, segment)
+
+    def plan_shards(self, start_time, end_time):
+        """ Split [start_time, end_time] in time shards of self.shard_seconds,
+        each of them per collector if self.collectors is set.
+        :return: list of (start_time, end_time, collector or None), in the
+                 order their elems are replayed
+        """
+        shards = []
+        shard_start = start_time
+        while shard_start <= end_time:
+            shard_end = min(shard_start + self.shard_seconds - 1, end_time)
+            for collector in (self.collectors or [None]):
+                shards.append((shard_start, shard_end, collector))
+            shard_start = shard_end + 1
+        return shards
+
+    def iter_shards(self, start_time, end_time):
+        """ iter_elems with the shards of the interval read by a pool of
+        self.processes. Elems are replayed shard after shard: BGPStream hands
+        out records ordered by time, so this is the order of a single stream
+        for every (collector, peer, prefix), and time lines built from it are
+        identical.
+        """
+        shards = self.plan_shards(start_time, end_time)
+        logging.info("Reading [%s, %s] in %s shards with %s processes"
+                     % (start_time, end_time, len(shards), self.processes))
+        pool = Pool(processes=min(self.processes, len(shards)),
+                    initializer=_init_shard_worker, initargs=(self.source,))
+        try:
+            records_read = self.records_read
+            for elems, record_numbers, origin_ases, shard_records, record_times in \
+                    pool.imap(_read_shard, [(self.filters, shard_start, shard_end, collector)
+                                            for shard_start, shard_end, collector in shards]):
+                self.origin_ases |= origin_ases
+                for elem, record_number in izip(elems, record_numbers):
+                    self.records_read = records_read + record_number
+                    yield Elem._make(elem)
+                records_read += shard_records
+                self.records_read = records_read
+                self.add_record_times(record_times)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def add_record_times(self, record_times):
+        for key, records in record_times.items():
+            self.record_times[key] += records
+
+    def records_between(self, start_time, end_time):
+        """ :return: records decoded with a time in [start_time, end_time]
+        """
+        return sum(records for (collector, record_time), records in self.record_times.items()
+                   if start_time <= record_time <= end_time)
+
+    def consume(self, start_time, end_time, sinks, checkpoint=None, keep=False):
+        """ Feed every elem of the stream to each sink.
+        With a checkpoint, the sinks are saved to it regularly and a run that
+        crashed is resumed from it: the records consumed already are skipped,
+        so the sinks end up as after a single run.
+        :param sinks: objects with add(elem), see sinks.py; they must pickle
+                      to be checkpointed
+        :param checkpoint: checkpoints.Checkpoint, default self.checkpoint
+        :param keep: leave the final state in the checkpoint instead of
+                     removing it, a consume run again returns it at once;
+                     the caller removes the checkpoint
+        :return: number of elems read
+        """
+        if checkpoint is None:
+            checkpoint = self.checkpoint
+        key = (start_time, end_time, tuple(self.filters),
+               tuple(sink.__class__.__name__ for sink in sinks))
+        count = 0
+        # the first resume_records records of resume_time were consumed
+        resume_time, resume_records = None, 0
+        if checkpoint is not None:
+            state = checkpoint.load(key)
+            if state is not None:
+                for sink, saved in zip(sinks, state['sinks']):
+                    sink.__dict__.update(saved.__dict__)
+                self.origin_ases |= state['origin_ases']
+                count = state['count']
+                if state.get('done'):
+                    logging.info("[%s, %s] consumed already, from %s"
+                                 % (start_time, end_time, checkpoint.path))
+                    return count
+                resume_time, resume_records = state['time'], state['records']
+                logging.info("Resuming [%s, %s] from %s (%s records of it done) with %s"
+                             % (start_time, end_time, resume_time, resume_records,
+                                checkpoint.path))
+                start_time = resume_time
+
+        # records of record_time seen so far
+        record_time, records = None, 0
+        records_read = records_start = self.records_read
+        count_start = count
+        skip = False
+        for elem in self.iter_elems(start_time, end_time):
+            if self.records_read != records_read:
+                # first elem of a record, the records before it are consumed
+                records_read = self.records_read
+                if elem.time != record_time:
+                    record_time, records = elem.time, 0
+                skip = record_time == resume_time and records < resume_records
+                if checkpoint is not None and not skip and checkpoint.due():
+                    checkpoint.save(key, {'sinks': sinks, 'origin_ases': self.origin_ases,
+                                          'count': count, 'time': record_time,
+                                          'records': records})
+                records += 1
+            if skip:
+                continue
+            for sink in sinks:
+                sink.add(elem)
+            count += 1
+        if checkpoint is not None and keep:
+            checkpoint.save(key, {'sinks': sinks, 'origin_ases': self.origin_ases,
+                                  'count': count, 'done': True})
+        elif checkpoint is not None:
+            checkpoint.remove()
+        metrics.inc('bgpstream_records_total', self.records_read - records_start)
+        metrics.inc('bgpstream_elems_total', count - count_start)
+        return count
+
+    def get_bgpstream(self, start_time, end_time=None):
+        """ Read all rib + updates according to filters.
+        You have to set filters with self.set_filter function
+        before run this if you need to set some filters.
+        If the time for collecting paths is too long,
+        we will optimize it later. Let's record the time taken.
+        :param start_time:(timestamp)
+        :param end_time:(timestamp)
+        :return: paths(ASPaths), iterates like
+                 paths[collector][peer-address][prefix] = [(time,record-type,AS-path)]
+        """
+        logging.info("Collecting.. histo BGPStream [%s, %s]" % (start_time, end_time))
+        time_taken = time.time()
+
+        # Timeline keeps the entries ordered by time and drops
+        # the ones identical to their predecessor.
+        sink = TimelineSink()
+        self.consume(start_time, end_time, [sink])
+        paths = sink.result()
+
         time_taken = time.time() - time_taken
         logging.info("Time taken for gathering histo bgpstream is %s" %time_taken)
         return paths
@@ -184,13 +427,9 @@ class HistoBGPStream():
         :return:
         """
         logging.info("Start getting all prefixes for a given as: %s" % ases)
-        all_prefixes = dict()
         # set a filter to get all paths ending with the given ASes
         filter_string = ''
-        hijackers = [ases]
-        if ',' in ases:
-            hijackers = ases.split(', ')
-        for hijacker in hijackers:
+        for hijacker in self.get_hijackers(ases):
             if filter_string != '':
                 filter_string += ' and '
             filter_string += "path %s$" % hijacker
@@ -198,32 +437,104 @@ class HistoBGPStream():
         self.set_filter(filter_string)
 
         # Get all prefixes 8 hours before the start_time
-        if isinstance(start_time, str):
-            start_time = parse(start_time)
-        start_collect_time = start_time - timedelta(hours=8)
-        end_collect_time = start_time - timedelta(hours=1)
-
-        # If start_time or end_time is not timestamp, convert them.
-        if not isinstance(start_collect_time, int):
-            start_collect_time = self.convert_dt_to_timestamp(start_collect_time)
-        if not isinstance(end_collect_time, int):
-            end_collect_time = self.convert_dt_to_timestamp(end_collect_time)
+        start_collect_time, end_collect_time = self.get_prefixes_interval(start_time)
 
-        # Get all historical paths between start_collect_time and end_collect_time
-        paths = self.get_bgpstream(start_collect_time, end_collect_time)
-        for collector in paths.keys():
-            for peer in paths[collector].keys():
-                for pfx in paths[collector][peer].keys():
-                    for t, r_type, path in paths[collector][peer][pfx]:
-                        origin_asn = path.split(' ')[-1]
-                        if origin_asn not in all_prefixes:
-                            all_prefixes[origin_asn] = list()
-                        all_prefixes[origin_asn].append(pfx)
-
-        for asn in all_prefixes.keys():
-            all_prefixes[asn] = list(set(all_prefixes[asn]))
+        # Get all historical paths between start_collect_time and end_collect_time,
+        # only the origin -> prefixes of the announcements are kept
+        logging.info("Collecting.. histo BGPStream [%s, %s]" % (start_collect_time, end_collect_time))
+        sink = PrefixOriginSink()
+        self.consume(start_collect_time, end_collect_time, [sink])
+        all_prefixes = sink.result()
         return all_prefixes
 
+    def get_event_interval(self, start_time, end_time=None):
+        """ Interval that collect_events reads for one event
+        :return: (start timestamp, end timestamp)
+        """
+        paths_interval = self.get_paths_interval(start_time, end_time)
+        prefixes_interval = self.get_prefixes_interval(start_time)
+        return min(paths_interval[0], prefixes_interval[0]), \
+            max(paths_interval[1], prefixes_interval[1])
+
+    def collect_events(self, events):
+        """ What get_paths with filter 'prefix less <prefix>' and
+        get_all_prefixes_given_as(ases, start_time) return for each event,
+        in two passes over the union of their intervals: one stream filtered
+        by the prefixes of all of them, one by all their hijackers. BGPStream ORs the terms of a kind
+        but ANDs different kinds, so the two filters cannot share a stream.
+        The sinks keep what each event would have read alone (see
+        sinks.CoveringPathsSink and HijackerPrefixesSink). The first pass
+        reads self.stream, the second a new stream of self.source (default
+        new_bgpstream); do not set filters before. With self.checkpoint,
+        each pass has a checkpoint of its own, kept until both are done.
+        Sets self.records_alone: BGPStream decodes every record of the
+        interval and collectors and filters their elems, so a stream of one
+        event decodes the records of the shared one in its own intervals.
+        :param events: list of (prefix, ases, start_time, end_time)
+        :return: list of (paths, all_prefixes), in the order of events
+        """
+        paths_sinks, prefixes_sinks = [], []
+        prefixes, hijackers = [], []
+        for prefix, ases, start_time, end_time in events:
+            paths_sinks.append(CoveringPathsSink(prefix,
+                                                 self.get_paths_interval(start_time, end_time)))
+            prefixes_sinks.append(HijackerPrefixesSink(self.get_hijackers(ases),
+                                                       self.get_prefixes_interval(start_time)))
+            if prefix not in prefixes:
+                prefixes.append(prefix)
+            hijackers.extend(asn for asn in self.get_hijackers(ases) if asn not in hijackers)
+
+        time_taken = time.time()
+        count = 0
+        checkpoints = []
+        self.records_alone = [0] * len(events)
+        # BGPStream matches an elem if any term of a kind does and all the
+        # kinds do (see FILTERING in BGPStream), 'prefix less P and prefix
+        # less Q' is P or Q, 'path A$ and path B$' is A or B. The sinks keep
+        # the elems of each event, not the stream.
+        for stage, sinks, terms in (
+                ('as_paths', paths_sinks, ['prefix less %s' % prefix for prefix in prefixes]),
+                ('pfxes_of_hijacker', prefixes_sinks, ['path %s$' % asn for asn in hijackers])):
+            start = min(sink.interval[0] for sink in sinks)
+            end = max(sink.interval[1] for sink in sinks)
+            logging.info("Collecting.. histo BGPStream [%s, %s] for the %s of %s events"
+                         % (start, end, stage, len(events)))
+            handler = self if stage == 'as_paths' else self.new_pass()
+            handler.record_times = defaultdict(int)
+            handler.set_filter(' and '.join(terms))
+            checkpoint = self.stage_checkpoint(stage)
+            if checkpoint is not None:
+                checkpoints.append(checkpoint)
+            count += handler.consume(start, end, sinks, checkpoint, keep=True)
+            for i, sink in enumerate(sinks):
+                self.records_alone[i] += handler.records_between(*sink.interval)
+            if handler is not self:
+                self.records_read += handler.records_read
+                self.origin_ases |= handler.origin_ases
+        for checkpoint in checkpoints:
+            checkpoint.remove()
+        time_taken = time.time() - time_taken
+        logging.info("Time taken for gathering histo bgpstream is %s (%s records, %s elems)"
+                     % (time_taken, self.records_read, count))
+        return [(paths_sink.result(), prefixes_sink.result())
+                for paths_sink, prefixes_sink in zip(paths_sinks, prefixes_sinks)]
+
+    def new_pass(self):
+        """ :return: HistoBGPStream with the same settings over a new stream
+                     of self.source, without filters
+        """
+        stream, record = (self.source or new_bgpstream)()
+        return HistoBGPStream(stream, record, self.processes, self.shard_seconds,
+                              self.collectors, self.source, self.cache)
+
+    def stage_checkpoint(self, stage):
+        """ :return: the checkpoint of one pass of collect_events, next to
+                     self.checkpoint, None without one
+        """
+        if self.checkpoint is None:
+            return None
+        return self.checkpoint.stage(stage)
+
     def store_real_events_to_mongodb(self):
         """ Read from excel files and store to mongodb
         """
@@ -0,0 +1,192 @@
+""" HTTP client for the IHR API
+One keep-alive session per process, 'next' pagination is followed,
+and batches of urls are fetched with bounded concurrency.
+Requests are rate limited with a token bucket, time out, and are
+retried with exponential backoff when IHR throttles (429) or fails (5xx).
+"""
+import time
+import random
+import logging
+import threading
+import multiprocessing
+import requests
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
+import metrics
+
+DEFAULT_CONCURRENCY = 4
+# requests per second, and how many may go at once after a quiet period
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 10
+# seconds to connect/read a response
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 5
+# first retry after ~DEFAULT_BACKOFF seconds, then doubling
+DEFAULT_BACKOFF = 1.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class TokenBucket():
+    def __init__(self, rate, burst, shared=False):
+        """ :param rate: tokens per second, None for no limit
+        :param burst: bucket size
+        :param shared: also by the processes forked once it is made (e.g. given
+            to a Pool initializer), which then take their tokens from it
+        """
+        self.rate = rate
+        self.burst = burst
+        # [tokens, time of the last refill]
+        if shared:
+            self.state = multiprocessing.RawArray('d', [float(burst), time.time()])
+            self.lock = multiprocessing.Lock()
+        else:
+            self.state = [float(burst), time.time()]
+            self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available and take it.
+        :return: seconds waited
+        """
+        if self.rate is None:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                tokens = min(self.burst, self.state[0] + (now - self.state[1]) * self.rate)
+                self.state[1] = now
+                if tokens >= 1:
+                    self.state[0] = tokens - 1
+                    return waited
+                self.state[0] = tokens
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class IHRClient():
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 bucket=None):
+        """
+        :param concurrency: max requests in flight (get_many)
+        :param rate: max requests per second, None for no limit
+        :param burst: max requests at once after a quiet period
+        :param timeout: seconds per request
+        :param retries: retries on 429/5xx/connection errors before giving up
+        :param backoff: seconds before the first retry, doubled every retry
+        :param bucket: TokenBucket to take the rate from instead of rate and burst
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = bucket if bucket is not None else TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'bytes': 0, 'retries': 0, 'throttled': 0,
+                         'rate_limited_seconds': 0.0}
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def _retry_delay(self, attempt, rsp=None):
+        if rsp is not None and rsp.headers.get('Retry-After', '').isdigit():
+            return float(rsp.headers['Retry-After'])
+        delay = self.backoff * (2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
+
+    def get_json(self, url):
+        """ A single page
+        """
+        attempt = 0
+        while True:
+            self._count('rate_limited_seconds', self.bucket.acquire())
+            rsp = None
+            try:
+                stime = time.time()
+                rsp = self.session.get(url, timeout=self.timeout)
+                self._count('requests')
+                self._count('bytes', len(rsp.content))
+                metrics.observe('ihr_request_seconds', time.time() - stime)
+                metrics.inc('ihr_requests_total', status=rsp.status_code)
+                metrics.inc('ihr_response_bytes_total', len(rsp.content))
+                if rsp.status_code not in RETRY_STATUS:
+                    try:
+                        # IHR explains bad queries in a json 'details'
+                        return rsp.json()
+                    except ValueError:
+                        rsp.raise_for_status()
+                        raise
+                if rsp.status_code == 429:
+                    self._count('throttled')
+                if attempt >= self.retries:
+                    rsp.raise_for_status()
+                logging.info("IHR answered %s, retrying: %s" % (rsp.status_code, url))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                logging.info("IHR request failed (%s), retrying: %s" % (e, url))
+            self._count('retries')
+            metrics.inc('ihr_retries_total')
+            time.sleep(self._retry_delay(attempt, rsp))
+            attempt += 1
+
+    def get_all(self, url):
+        """ Follow 'next' links and return the first response
+        with the results of every page.
+        """
+        rsp = self.get_json(url)
+        if 'results' not in rsp:
+            return rsp
+        results = list(rsp['results'])
+        page = rsp
+        while page.get('next'):
+            page = self.get_json(page['next'])
+            results.extend(page.get('results', []))
+        if page is not rsp:
+            logging.debug("Read %s results from %s" % (len(results), url))
+        rsp['results'] = results
+        rsp['next'] = None
+        return rsp
+
+    def get_many(self, urls):
+        """ get_all() for every url, at most self.concurrency at a time.
+        :return: responses in the order of urls
+        """
+        if len(urls) <= 1 or self.concurrency <= 1:
+            return [self.get_all(url) for url in urls]
+        pool = ThreadPool(min(self.concurrency, len(urls)))
+        try:
+            return pool.map(self.get_all, urls, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+
+_shared_client = None
+
+
+def configure_shared_client(rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY, bucket=None):
+    """ Replace the shared client, e.g. as a Pool initializer so that
+    workers split the request rate we allow ourselves against IHR.
+    :param bucket: a shared TokenBucket, of all the processes given it
+        (rate is then ignored)
+    """
+    global _shared_client
+    _shared_client = IHRClient(concurrency=concurrency, rate=rate, burst=max(1, int(rate)),
+                               bucket=bucket)
+    return _shared_client
+
+
+def get_shared_client():
+    """ The client (and its connection pool) shared in this process.
+    """
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = IHRClient()
+    return _shared_client
@@ -0,0 +1,242 @@
+""" Leases on a shared filesystem (NFS), to claim work across hosts
+
+<directory>/<name>.lease holds the token of its owner and its mtime is the
+last heartbeat. A lease without heartbeat for longer than the ttl is
+abandoned (its owner crashed) and can be taken over. Leases are created
+with link(2), which is atomic on NFS too. <directory>/<name>.failed has a
+line per failed run of a task, it is given up after MAX_FAILURES.
+"""
+import os
+import time
+import errno
+import random
+import socket
+import logging
+import threading
+from collections import namedtuple
+
+# seconds without heartbeat before a lease is abandoned,
+# keep it well above the clock skew between hosts
+DEFAULT_TTL = 300
+EXTENSION = '.lease'
+FAILED_EXTENSION = '.failed'
+# failed runs of a task, over all workers, before it is given up
+MAX_FAILURES = 3
+
+# done() and ready() tell if a task is done or can start,
+# run(lease) does it and calls lease.check() before storing anything
+Task = namedtuple('Task', ['name', 'done', 'ready', 'run'])
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def default_owner():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+class Lease():
+    def __init__(self, directory, name, owner=None, ttl=DEFAULT_TTL):
+        self.path = os.path.join(directory, name + EXTENSION)
+        self.name = name
+        self.ttl = ttl
+        # a new token per Lease, the same owner may claim a name again
+        self.token = '%s:%08x' % (owner or default_owner(), random.getrandbits(32))
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _unique_path(self, suffix):
+        return '%s.%s.%s' % (self.path, self.token.replace(':', '_').replace('/', '_'), suffix)
+
+    def age(self):
+        """ :return: seconds since the last heartbeat, None if there is no lease
+        """
+        try:
+            return time.time() - os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def acquire(self):
+        """ :return: True if we hold the lease now
+        """
+        tmp_path = self._unique_path('tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(self.token + '\n')
+        try:
+            for attempt in range(2):
+                try:
+                    os.link(tmp_path, self.path)
+                    return True
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    # NFS may lose the reply of a link that was done
+                    if os.stat(tmp_path).st_nlink == 2:
+                        return True
+                if attempt or not self._break_abandoned():
+                    return False
+            return False
+        finally:
+            os.unlink(tmp_path)
+
+    def _break_abandoned(self):
+        """ Move an abandoned lease out of the way.
+        :return: True if the name may be free now
+        """
+        age = self.age()
+        if age is None:
+            return True
+        if age <= self.ttl:
+            return False
+        stale_path = self._unique_path('stale')
+        try:
+            os.rename(self.path, stale_path)
+        except OSError:
+            # somebody else moved it
+            return True
+        try:
+            # it may have had a heartbeat since we looked, then put it back
+            if time.time() - os.stat(stale_path).st_mtime <= self.ttl:
+                try:
+                    os.link(stale_path, self.path)
+                except OSError:
+                    pass
+                return False
+        finally:
+            os.unlink(stale_path)
+        logging.info("Taking over abandoned lease %s (%.0fs without heartbeat)"
+                     % (self.path, age))
+        return True
+
+    def held(self):
+        if self.lost:
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                return f.read().strip() == self.token
+        except IOError:
+            return False
+
+    def heartbeat(self):
+        """ :return: False if the lease was lost
+        """
+        if not self.held():
+            self.lost = True
+            return False
+        try:
+            os.utime(self.path, None)
+        except OSError:
+            self.lost = True
+        return not self.lost
+
+    def check(self):
+        """ Call before storing results.
+        """
+        if not self.heartbeat():
+            raise LeaseLost("Lost lease %s" % self.path)
+
+    def _keep_alive(self):
+        while not self._stop.wait(self.ttl / 3.0):
+            if not self.heartbeat():
+                logging.warning("Lost lease %s" % self.path)
+                return
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.held():
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._keep_alive)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+        return False
+
+
+def record_failure(directory, name, owner, error):
+    """ Add a failed run of a task to <directory>/<name>.failed
+    """
+    with open(os.path.join(directory, name + FAILED_EXTENSION), 'a') as f:
+        f.write('%s %.0f %s\n' % (owner or default_owner(), time.time(),
+                                  repr(error).replace('\n', ' ')))
+
+
+def count_failures(directory, name):
+    """ :return: failed runs of a task, over all workers
+    """
+    try:
+        with open(os.path.join(directory, name + FAILED_EXTENSION), 'r') as f:
+            return sum(1 for line in f if line.strip())
+    except IOError:
+        return 0
+
+
+def run_claimed(tasks, directory, owner=None, ttl=DEFAULT_TTL, poll=None,
+                max_failures=MAX_FAILURES):
+    """ Run the tasks nobody has done or holds a lease for, in order,
+    until all of them are done (here or by other workers), or given up.
+    A task that raises is recorded as failed, its lease released, and it is
+    run again (here or elsewhere) until it failed max_failures times.
+    :param tasks: list of Task
+    :param poll: seconds to wait when every pending task is held elsewhere
+    :return: names of the tasks run here
+    """
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    if poll is None:
+        poll = ttl / 10.0
+    ran = []
+    while True:
+        pending = [task for task in tasks if not task.done() and
+                   count_failures(directory, task.name) < max_failures]
+        if not pending:
+            return ran
+        progressed = False
+        waiting = False
+        for task in pending:
+            if not task.ready():
+                continue
+            waiting = True
+            lease = Lease(directory, task.name, owner, ttl)
+            if not lease.acquire():
+                continue
+            try:
+                with lease:
+                    # done by someone else since we looked
+                    if task.done():
+                        continue
+                    task.run(lease)
+                    ran.append(task.name)
+                    progressed = True
+            except LeaseLost as e:
+                logging.warning("[%s] %s" % (task.name, e))
+            except Exception as e:
+                # the lease is released on the way out of the with
+                logging.exception("[%s] failed" % task.name)
+                record_failure(directory, task.name, owner, e)
+                progressed = True
+        if progressed:
+            continue
+        # none is ready, or runs elsewhere: they wait on tasks that were given up
+        if not waiting:
+            logging.warning("Giving up %s, they wait on failed tasks"
+                            % ', '.join(task.name for task in pending))
+            return ran
+        time.sleep(poll)
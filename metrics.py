@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+""" Metrics of the collection pipeline
+
+Counters are kept per process, by name and labels, in the Prometheus way:
+'ihr_requests_total' or 'hegemony_cache_lookups_total{result="miss"}'.
+A histogram is a set of counters (name_bucket{le=..}, name_sum, name_count).
+
+    with metrics.Stage('as_paths', title):
+        ...
+
+times a stage and, once configured with a file, appends a JSON line with
+its wall time and the counters it moved to it. Stages should not nest,
+or the counters of the inner ones are summed twice. Each process appends
+to a file of its own next to it (<file>.<host>.<pid>): appends of several
+hosts to one file over NFS are not atomic. read_lines merges them.
+The stages can be profiled (cProfile, and tracemalloc where it is installed).
+
+python metrics.py metrics.jsonl [--prometheus metrics.prom] sums the lines
+of every process per stage and prints them, or writes them as a Prometheus
+text file.
+"""
+import os
+import sys
+import time
+import json
+import glob
+import socket
+import logging
+import argparse
+import threading
+from collections import defaultdict
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# counters a stage line also gives per second of the stage
+RATE_COUNTERS = {'bgpstream_records_total': 'records',
+                 'bgpstream_elems_total': 'elems'}
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_config = {'path': None, 'profile_directory': None, 'profile_stages': None}
+# the stage being profiled, cProfile does not nest
+_profiling = []
+
+
+def configure(path=None, profile_directory=None, profile_stages=None):
+    """ :param path: file to append the stage lines to, None for none
+    :param profile_directory: write profiles of the stages there, None for none
+    :param profile_stages: names of the stages to profile, None for all
+    """
+    _config['path'] = path
+    _config['profile_directory'] = profile_directory
+    _config['profile_stages'] = profile_stages
+
+
+def key(name, labels=None):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (label, labels[label])
+                                      for label in sorted(labels)))
+
+
+def split_key(string):
+    """ :return: (name, labels string without braces)
+    """
+    if '{' not in string:
+        return string, ''
+    name, labels = string.split('{', 1)
+    return name, labels[:-1]
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[key(name, labels)] += value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """ Add value to the histogram name
+    """
+    with _lock:
+        for le in buckets:
+            if value <= le:
+                _counters[key(name + '_bucket', dict(labels, le=le))] += 1
+        _counters[key(name + '_bucket', dict(labels, le='+Inf'))] += 1
+        _counters[key(name + '_sum', labels)] += value
+        _counters[key(name + '_count', labels)] += 1
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+
+
+def write_line(line, path=None):
+    path = path or _config['path']
+    if path is None:
+        return
+    with open(process_path(path), 'a') as f:
+        f.write(json.dumps(line, sort_keys=True) + '\n')
+
+
+def process_path(path):
+    """ :return: the file of this process for the lines of path
+    """
+    return '%s.%s.%s' % (path, socket.gethostname(), os.getpid())
+
+
+class Stage():
+    """ Time a stage of the pipeline, see the module doc.
+    seconds is the wall time once it is done.
+    """
+    def __init__(self, name, event=None):
+        self.name = name
+        self.event = event
+        self.seconds = None
+        self._profile = None
+        self._tracing = False
+
+    def _profiled(self):
+        stages = _config['profile_stages']
+        return _config['profile_directory'] is not None and not _profiling and \
+            (stages is None or self.name in stages)
+
+    def __enter__(self):
+        self._before = snapshot()
+        if self._profiled():
+            import cProfile
+            _profiling.append(self)
+            self._profile = cProfile.Profile()
+            if tracemalloc is not None and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            self._profile.enable()
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.seconds = time.time() - self._start
+        line = {'time': time.time(), 'host': socket.gethostname(), 'pid': os.getpid(),
+                'stage': self.name, 'event': self.event, 'seconds': self.seconds,
+                'failed': exc_type is not None}
+        if self._profile is not None:
+            self._profile.disable()
+            _profiling.remove(self)
+            line['profile'] = self._dump_profile()
+            if self._tracing:
+                line['memory_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        if resource is not None:
+            line['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        after = snapshot()
+        counters = dict((name, value - self._before.get(name, 0))
+                        for name, value in after.items()
+                        if value != self._before.get(name, 0))
+        line['counters'] = counters
+        line['per_second'] = dict((short, counters.get(name, 0) / max(self.seconds, 1e-9))
+                                  for name, short in RATE_COUNTERS.items() if name in counters)
+        try:
+            write_line(line)
+        except IOError as e:
+            logging.warning("Could not write metrics of %s: %s" % (self.name, e))
+        return False
+
+    def _dump_profile(self):
+        directory = _config['profile_directory']
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        name = '%s.%s.%s' % (self.name, str(self.event or '').lower().replace(' ', '_')[:60],
+                             os.getpid())
+        path = os.path.join(directory, name + '.prof')
+        self._profile.dump_stats(path)
+        if self._tracing:
+            with open(os.path.join(directory, name + '.memory.txt'), 'w') as f:
+                for statistic in tracemalloc.take_snapshot().statistics('lineno')[:30]:
+                    f.write('%s\n' % statistic)
+        return path
+
+
+def read_lines(path):
+    """ Lines of path and of the files of every process next to it
+    (see process_path), the last line a crashed process left cut is skipped
+    """
+    paths = sorted(glob.glob(path + '.*'))
+    if os.path.exists(path):
+        paths.insert(0, path)
+    for file_path in paths:
+        with open(file_path, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    logging.warning("Skipping a cut line of %s" % file_path)
+                    continue
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def aggregate(lines):
+    """ :return: ({stage: {'runs', 'failed', 'seconds', counter: value}},
+                  {counter: value} of every stage)
+    """
+    stages = defaultdict(lambda: defaultdict(float))
+    totals = defaultdict(float)
+    for line in lines:
+        summary = stages[line['stage']]
+        summary['runs'] += 1
+        summary['failed'] += 1 if line.get('failed') else 0
+        summary['seconds'] += line['seconds']
+        for name, value in line['counters'].items():
+            summary[name] += value
+            totals[name] += value
+    return stages, totals
+
+
+def to_prometheus(stages, totals):
+    """ Prometheus text format of aggregate()
+    """
+    out = ['# TYPE collector_stage_seconds_total counter',
+           '# TYPE collector_stage_runs_total counter',
+           '# TYPE collector_stage_failures_total counter']
+    for name in sorted(stages):
+        out.append('collector_stage_seconds_total{stage="%s"} %s' % (name, stages[name]['seconds']))
+        out.append('collector_stage_runs_total{stage="%s"} %s' % (name, stages[name]['runs']))
+        out.append('collector_stage_failures_total{stage="%s"} %s' % (name, stages[name]['failed']))
+    # stages do not nest, the counters of each line are summed
+    typed = set()
+    histograms = set(split_key(string)[0][:-len('_bucket')] for string in totals
+                     if split_key(string)[0].endswith('_bucket'))
+    for string in sorted(totals):
+        name, labels = split_key(string)
+        family = name
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in histograms:
+                family = name[:-len(suffix)]
+        if family not in typed:
+            typed.add(family)
+            out.append('# TYPE %s %s' % (family, 'histogram' if family in histograms else 'counter'))
+        out.append('%s %s' % (string, totals[string]))
+    return '\n'.join(out) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', default='metrics.jsonl')
+    parser.add_argument('--prometheus', help='write a Prometheus text file')
+    args = parser.parse_args()
+
+    stages, totals = aggregate(read_lines(args.path))
+    if args.prometheus:
+        tmp_path = args.prometheus + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(to_prometheus(stages, totals))
+        os.rename(tmp_path, args.prometheus)
+        return 0
+    for name in sorted(stages, key=lambda name: -stages[name]['seconds']):
+        summary = stages[name]
+        print "%-20s %5d runs %3d failed %10.1fs" % (name, summary['runs'], summary['failed'],
+                                                     summary['seconds'])
+        for counter, short in sorted(RATE_COUNTERS.items()):
+            if summary.get(counter):
+                print "%20s %d %s, %.0f/s" % ('', summary[counter], short,
+                                              summary[counter] / max(summary['seconds'], 1e-9))
+    for string in sorted(totals):
+        print "%s %s" % (string, totals[string])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+""" Origins of the prefixes of an event over time, in a PrefixTrie
+
+The value of a prefix is {origin: [(start, end), ..]}, the merged
+intervals in which at least one peer had a path from that origin to the
+prefix. A path lasts until the next row of its time line, the last one
+until the end of the event. features.py finds MOAS (several origins of a
+prefix) and sub-MOAS (a hijacker origin of a less or more specific)
+prefixes in it without comparing every pair of prefixes.
+
+prefix_origins indexes an {asn: prefixes} map. No stage reads AS2PFX, so
+no trie of it is built.
+"""
+from aspaths import RECORD_TYPE_CODES
+from prefixes import PrefixTrie
+
+WITHDRAWAL = RECORD_TYPE_CODES['withdrawal']
+
+
+def merge_intervals(intervals):
+    """ :return: sorted union of [(start, end)], touching intervals joined
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def origin_intervals(as_paths, end=None):
+    """ :param as_paths: ASPaths of an event
+    :param end: time the last path of each time line lasts until,
+                default the time of the last row
+    :return: PrefixTrie of {origin: merged intervals}
+    """
+    times, types, path_ids = as_paths.times, as_paths.types, as_paths.path_ids
+    if end is None:
+        end = max(times) if len(times) else 0
+    origins = [path.rsplit(' ', 1)[-1] for path in as_paths.paths]
+    intervals = dict()
+    for collector, peer, prefix, start, stop in as_paths.iter_groups():
+        of_prefix = intervals.setdefault(prefix, dict())
+        for i in range(start, stop):
+            origin = origins[path_ids[i]]
+            if types[i] == WITHDRAWAL or not origin:
+                continue
+            until = times[i + 1] if i + 1 < stop else max(end, times[i])
+            of_prefix.setdefault(origin, []).append((times[i], until))
+    return PrefixTrie((prefix, dict((origin, merge_intervals(spans))
+                                    for origin, spans in of_prefix.items()))
+                      for prefix, of_prefix in intervals.items())
+
+
+def prefix_origins(prefixes_of):
+    """ :param prefixes_of: {asn: [prefix, ..]}, like AS2PFX or
+                            event['pfxes_of_hijacker']
+    :return: PrefixTrie of the set of ASNs of each prefix
+    """
+    trie = PrefixTrie()
+    for asn, prefixes in prefixes_of.items():
+        for prefix in prefixes:
+            trie.setdefault(prefix, set()).add(asn)
+    return trie
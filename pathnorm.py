@@ -0,0 +1,92 @@
+""" Tokenize each distinct as-path once and group paths the way the
+hegemony stage needs them.
+"""
+from aspaths import ASPaths, RECORD_TYPE_CODES
+
+
+class NormalizedPath(object):
+    """ An as-path string split once:
+    hops   - tokens with prepending collapsed, AS-sets kept as '{a,b}'
+    asns   - every ASN on the path as a string, AS-sets expanded
+    origin - last token, as the path has it
+    """
+    __slots__ = ('path', 'hops', 'asns', 'origin')
+
+    def __init__(self, path):
+        tokens = path.split(' ')
+        self.path = path
+        self.origin = tokens[-1]
+        unique = frozenset(tokens)
+        if len(unique) == len(tokens):
+            self.hops = tuple(tokens)
+        else:
+            self.hops = tuple(v for i, v in enumerate(tokens) if i == 0 or v != tokens[i - 1])
+        if '{' not in path and all(token.isdigit() for token in unique):
+            self.asns = unique
+        else:
+            asns = set()
+            for token in unique:
+                asns.update(asn for asn in token.strip('{}').split(',') if asn.isdigit())
+            self.asns = frozenset(asns)
+
+
+class PathNormalizer():
+    def __init__(self):
+        self.cache = dict()
+
+    def normalize(self, path):
+        normalized = self.cache.get(path)
+        if normalized is None:
+            normalized = NormalizedPath(path)
+            self.cache[path] = normalized
+        return normalized
+
+
+class PathGroups():
+    """ Announced paths of an event, per prefix:
+    unique_ases[prefix]             = set of ASNs on any path
+    unique_paths[prefix]            = list of NormalizedPath
+    paths_by_origin[prefix][origin] = list of NormalizedPath
+    """
+    def __init__(self):
+        self.unique_ases = dict()
+        self.unique_paths = dict()
+        self.paths_by_origin = dict()
+
+
+def group_paths(as_paths, normalizer=None):
+    """ One pass over event['as_paths'] (withdrawals are skipped),
+    each distinct path is normalized once.
+    :param as_paths: ASPaths (or the old nested dict)
+    :return: PathGroups
+    """
+    as_paths = ASPaths.from_nested(as_paths)
+    if normalizer is None:
+        normalizer = PathNormalizer()
+    withdrawal = RECORD_TYPE_CODES['withdrawal']
+    types, path_ids = as_paths.types, as_paths.path_ids
+
+    path_ids_per_prefix = dict()
+    for collector, peer, prefix, start, stop in as_paths.iter_groups():
+        if withdrawal in types[start:stop]:
+            ids = set(path_ids[i] for i in range(start, stop) if types[i] != withdrawal)
+        else:
+            ids = set(path_ids[start:stop])
+        if ids:
+            if prefix in path_ids_per_prefix:
+                path_ids_per_prefix[prefix] |= ids
+            else:
+                path_ids_per_prefix[prefix] = ids
+
+    groups = PathGroups()
+    for prefix, ids in path_ids_per_prefix.items():
+        paths = [normalizer.normalize(as_paths.paths[i]) for i in sorted(ids)]
+        unique_ases = set()
+        by_origin = dict()
+        for path in paths:
+            unique_ases |= path.asns
+            by_origin.setdefault(path.origin, []).append(path)
+        groups.unique_ases[prefix] = unique_ases
+        groups.unique_paths[prefix] = paths
+        groups.paths_by_origin[prefix] = by_origin
+    return groups
@@ -0,0 +1,198 @@
+""" IP prefixes as integers, without the ipaddress module (python 2)
+"""
+import socket
+import struct
+
+
+def parse_prefix(prefix):
+    """ :param prefix: '10.0.0.0/8' or '2001:db8::/32'
+    :return: (bits of the address family, network as int, length)
+    """
+    address, length = prefix.split('/')
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    packed = socket.inet_pton(family, address)
+    value = 0
+    for word in struct.unpack('!%dI' % (len(packed) // 4), packed):
+        value = (value << 32) | word
+    return len(packed) * 8, value, int(length)
+
+
+def covers(outer, inner):
+    """ True if prefix inner is outer or more specific than it
+    """
+    bits, network, length = parse_prefix(outer)
+    inner_bits, inner_network, inner_length = parse_prefix(inner)
+    if bits != inner_bits or inner_length < length:
+        return False
+    return (network >> (bits - length)) == (inner_network >> (bits - length))
+
+
+def _mask(network, bits, length):
+    return network & ~((1 << (bits - length)) - 1)
+
+
+def _common_length(a, b, bits, limit):
+    """ :return: number of leading bits a and b share, up to limit
+    """
+    return limit - ((a ^ b) >> (bits - limit)).bit_length()
+
+
+class _Node(object):
+    __slots__ = ('network', 'length', 'children', 'prefix', 'value')
+
+    def __init__(self, network, length):
+        self.network = network
+        self.length = length
+        self.children = [None, None]
+        # None for the nodes that only join two branches
+        self.prefix = None
+        self.value = None
+
+
+class PrefixTrie(object):
+    """ Path compressed binary (radix) trie of IPv4 and IPv6 prefixes,
+    with a value per prefix. A node is either a prefix or where two
+    branches part, so lookups take at most a node per prefix length.
+    """
+    def __init__(self, items=()):
+        # per address family bits
+        self._roots = dict()
+        self._size = 0
+        for prefix, value in items:
+            self[prefix] = value
+
+    def __len__(self):
+        return self._size
+
+    def _node(self, prefix, create=False):
+        """ :return: node of the prefix, a new one if create, else None
+                     if it is not in the trie
+        """
+        bits, network, length = parse_prefix(prefix)
+        network = _mask(network, bits, length)
+        node = self._roots.get(bits)
+        if node is None:
+            if not create:
+                return None
+            node = self._roots[bits] = _Node(0, 0)
+        while node.length < length:
+            side = (network >> (bits - 1 - node.length)) & 1
+            child = node.children[side]
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[side] = _Node(network, length)
+                return child
+            limit = child.length if child.length < length else length
+            different = (child.network ^ network) >> (bits - limit)
+            if not different and child.length <= length:
+                node = child
+                continue
+            if not create:
+                return None
+            # a node where the branch of child and the prefix part
+            common = limit - different.bit_length()
+            fork = node.children[side] = _Node(_mask(network, bits, common), common)
+            fork.children[(child.network >> (bits - 1 - common)) & 1] = child
+            if common == length:
+                return fork
+            node = fork.children[(network >> (bits - 1 - common)) & 1] = _Node(network, length)
+            return node
+        return node
+
+    def __setitem__(self, prefix, value):
+        node = self._node(prefix, create=True)
+        if node.prefix is None:
+            node.prefix = prefix
+            self._size += 1
+        node.value = value
+
+    def __getitem__(self, prefix):
+        node = self._node(prefix)
+        if node is None or node.prefix is None:
+            raise KeyError(prefix)
+        return node.value
+
+    def __contains__(self, prefix):
+        node = self._node(prefix)
+        return node is not None and node.prefix is not None
+
+    def get(self, prefix, default=None):
+        node = self._node(prefix)
+        if node is None or node.prefix is None:
+            return default
+        return node.value
+
+    def setdefault(self, prefix, default=None):
+        node = self._node(prefix, create=True)
+        if node.prefix is None:
+            node.prefix = prefix
+            node.value = default
+            self._size += 1
+        return node.value
+
+    def covering(self, prefix):
+        """ (prefix, value) of the prefix and its less specifics in the
+        trie, least specific first
+        """
+        bits, network, length = parse_prefix(prefix)
+        node = self._roots.get(bits)
+        while node is not None and node.length <= length and \
+                _common_length(node.network, network, bits, node.length) == node.length:
+            if node.prefix is not None:
+                yield node.prefix, node.value
+            if node.length == length:
+                return
+            node = node.children[(network >> (bits - 1 - node.length)) & 1]
+
+    def longest_match(self, prefix):
+        """ :return: (prefix, value) of the most specific prefix in the trie
+                     covering prefix, None if there is none
+        """
+        match = None
+        for match in self.covering(prefix):
+            pass
+        return match
+
+    def covered(self, prefix):
+        """ (prefix, value) of the prefix and its more specifics in the trie
+        """
+        bits, network, length = parse_prefix(prefix)
+        node = self._roots.get(bits)
+        while node is not None and node.length < length:
+            if _common_length(node.network, network, bits, node.length) != node.length:
+                return
+            node = node.children[(network >> (bits - 1 - node.length)) & 1]
+        if node is None or _common_length(node.network, network, bits, length) != length:
+            return
+        for item in self._iter_nodes(node):
+            yield item
+
+    def overlapping(self, prefix):
+        """ (prefix, value) of the less and more specifics of prefix in the
+        trie, without prefix itself
+        """
+        for item in self.covering(prefix):
+            if item[0] != prefix:
+                yield item
+        for item in self.covered(prefix):
+            if item[0] != prefix:
+                yield item
+
+    def _iter_nodes(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.prefix is not None:
+                yield node.prefix, node.value
+            for child in reversed(node.children):
+                if child is not None:
+                    stack.append(child)
+
+    def iteritems(self):
+        for bits in sorted(self._roots):
+            for item in self._iter_nodes(self._roots[bits]):
+                yield item
+
+    def items(self):
+        return list(self.iteritems())
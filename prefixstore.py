@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+""" ASN -> prefixes map in a file, read without loading it (asn2pfx.store)
+
+layout:  header = MAGIC + <H format version><H string keys>
+                  <I ASNs><I prefixes><I prefix bytes>
+         <I> ASNs, sorted
+         <I> end of the prefixes of each ASN, in the prefix bytes
+         prefix bytes, the prefixes of each ASN joined by newlines
+Readers memory-map the file read-only, so processes share its pages, and
+find an ASN by a binary search in a copy of the sorted ASNs.
+
+python prefixstore.py [asn2pfx.pickle] [-o asn2pfx.store] converts the pickle.
+"""
+import os
+import sys
+import mmap
+import pickle
+import socket
+import struct
+import logging
+import argparse
+from array import array
+from bisect import bisect_left
+
+MAGIC = 'ASN2PFX\0'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHHIII')
+UINT = struct.Struct('<I')
+
+
+def write_store(prefixes_of, path):
+    """ Write atomically (tmp + rename)
+    :param prefixes_of: {asn: [prefix, ..]}, ASNs as int or str
+    """
+    asns = dict()
+    for asn in prefixes_of:
+        try:
+            asns[int(asn)] = asn
+        except ValueError:
+            logging.warning("Not storing the prefixes of %s, not an ASN" % asn)
+    string_keys = any(isinstance(asn, basestring) for asn in asns.values())
+    ends = array('I')
+    chunks = []
+    size = 0
+    n_prefixes = 0
+    for asn in sorted(asns):
+        prefixes = prefixes_of[asns[asn]]
+        chunk = '\n'.join(prefixes)
+        chunks.append(chunk)
+        size += len(chunk)
+        n_prefixes += len(prefixes)
+        ends.append(size)
+    sorted_asns = array('I', sorted(asns))
+    for values in (sorted_asns, ends):
+        if sys.byteorder != 'little':
+            values.byteswap()
+
+    tmp_path = '%s.%s.%s.tmp' % (path, socket.gethostname(), os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, int(string_keys), len(sorted_asns),
+                            n_prefixes, size))
+        f.write(sorted_asns.tostring())
+        f.write(ends.tostring())
+        for chunk in chunks:
+            f.write(chunk)
+    os.rename(tmp_path, path)
+
+
+def convert(pickle_path, path):
+    """ Store the {asn: [prefix, ..]} of a pickle (asn2pfx.pickle)
+    """
+    with open(pickle_path, 'rb') as f:
+        write_store(pickle.load(f), path)
+
+
+class PrefixStore(object):
+    """ Read-only {asn: [prefix, ..]} of a file written by write_store.
+    ASNs are looked up as int or str, and iterated as they were stored.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, string_keys, n_asns, self.n_prefixes, size = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a prefix store" % path)
+        if version != FORMAT_VERSION:
+            raise ValueError("%s has format version %s, expected %s"
+                             % (path, version, FORMAT_VERSION))
+        self.string_keys = bool(string_keys)
+        # the index is small and searched at every lookup, it is copied
+        self._asns = array('I')
+        self._asns.fromstring(self._mm[HEADER.size:HEADER.size + 4 * n_asns])
+        if sys.byteorder != 'little':
+            self._asns.byteswap()
+        self._ends = HEADER.size + 4 * n_asns
+        self._prefixes = HEADER.size + 8 * n_asns
+
+    def close(self):
+        self._mm.close()
+
+    def _find(self, asn):
+        """ :return: index of asn, -1 if it is not stored
+        """
+        try:
+            asn = int(asn)
+        except ValueError:
+            return -1
+        i = bisect_left(self._asns, asn)
+        if i < len(self._asns) and self._asns[i] == asn:
+            return i
+        return -1
+
+    def _end(self, i):
+        return UINT.unpack_from(self._mm, self._ends + 4 * i)[0]
+
+    def _prefixes_at(self, i):
+        start = self._end(i - 1) if i else 0
+        chunk = self._mm[self._prefixes + start:self._prefixes + self._end(i)]
+        return chunk.split('\n') if chunk else []
+
+    def __len__(self):
+        return len(self._asns)
+
+    def __contains__(self, asn):
+        return self._find(asn) >= 0
+
+    def __getitem__(self, asn):
+        i = self._find(asn)
+        if i < 0:
+            raise KeyError(asn)
+        return self._prefixes_at(i)
+
+    def get(self, asn, default=None):
+        i = self._find(asn)
+        if i < 0:
+            return default
+        return self._prefixes_at(i)
+
+    def iterkeys(self):
+        key = str if self.string_keys else int
+        for i in range(len(self._asns)):
+            yield key(self._asns[i])
+
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def iteritems(self):
+        for i, asn in enumerate(self.iterkeys()):
+            yield asn, self._prefixes_at(i)
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class LazyPrefixStore(object):
+    """ A PrefixStore opened the first time it is used, converted from
+    pickle_path first if the store does not exist.
+    """
+    def __init__(self, path, pickle_path=None):
+        self.path = path
+        self.pickle_path = pickle_path
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            if not os.path.exists(self.path) and self.pickle_path is not None \
+                    and os.path.exists(self.pickle_path):
+                logging.info("Converting %s to %s" % (self.pickle_path, self.path))
+                convert(self.pickle_path, self.path)
+            self._store = PrefixStore(self.path)
+        return self._store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, asn):
+        return asn in self.store
+
+    def __getitem__(self, asn):
+        return self.store[asn]
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def get(self, asn, default=None):
+        return self.store.get(asn, default)
+
+    def keys(self):
+        return self.store.keys()
+
+    def iteritems(self):
+        return self.store.iteritems()
+
+    def items(self):
+        return self.store.items()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pickle_path', nargs='?', default='asn2pfx.pickle')
+    parser.add_argument('-o', '--output', default='asn2pfx.store')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    convert(args.pickle_path, args.output)
+    store = PrefixStore(args.output)
+    logging.info("%s ASNs, %s prefixes in %s" % (len(store), store.n_prefixes, args.output))
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+""" What the peers had in their RIB at any time, from the time lines of an
+ASPaths (event['as_paths'])
+
+The path of a (collector, peer, prefix) at time t is the one of the last
+row of its time line at or before t, found by a binary search in the
+times of the time line; None before its first row and after a withdrawal.
+The rows of all time lines are also put in time order once, so that the
+changes between consecutive windows are read in O(changes) instead of
+building the RIB of every window again.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from aspaths import RECORD_TYPE_CODES, path_to_asns
+
+WITHDRAWAL = RECORD_TYPE_CODES['withdrawal']
+
+
+class RibHistory(object):
+    def __init__(self, as_paths):
+        """ :param as_paths: ASPaths
+        """
+        self.as_paths = as_paths
+        # (collector, peer, prefix) of each time line
+        self.keys = []
+        self._bounds = []
+        for collector, peer, prefix, start, stop in as_paths.iter_groups():
+            self.keys.append((collector, peer, prefix))
+            self._bounds.append((start, stop))
+        self._groups = dict((key, i) for i, key in enumerate(self.keys))
+        # rows of every time line in time order, and the time line of each
+        # row, built when first needed
+        self._order = None
+        self._row_groups = None
+
+    def _path(self, row):
+        """ :return: path of a row, None for a withdrawal
+        """
+        if row is None or self.as_paths.types[row] == WITHDRAWAL:
+            return None
+        return self.as_paths.paths[self.as_paths.path_ids[row]]
+
+    def _row_at(self, group, t):
+        """ :return: last row of a time line at or before t, None if there is none
+        """
+        start, stop = self._bounds[group]
+        row = bisect_right(self.as_paths.times, t, start, stop) - 1
+        return row if row >= start else None
+
+    def path(self, key, t):
+        """ :param key: (collector, peer, prefix)
+        :return: its path at t, None if it had none
+        """
+        group = self._groups.get(key)
+        if group is None:
+            return None
+        return self._path(self._row_at(group, t))
+
+    def snapshot(self, t):
+        """ :return: {(collector, peer, prefix): path} of the time lines that
+                     had a path at t
+        """
+        snapshot = dict()
+        for group, key in enumerate(self.keys):
+            path = self._path(self._row_at(group, t))
+            if path is not None:
+                snapshot[key] = path
+        return snapshot
+
+    def diff(self, t1, t2):
+        """ :return: {(collector, peer, prefix): (path at t1, path at t2)} of
+                     the time lines whose path is not the same, None for no path
+        """
+        diff = dict()
+        for group, key in enumerate(self.keys):
+            before = self._path(self._row_at(group, t1))
+            after = self._path(self._row_at(group, t2))
+            if before != after:
+                diff[key] = (before, after)
+        return diff
+
+    def _sort_rows(self):
+        if self._order is not None:
+            return
+        times = self.as_paths.times
+        self._row_groups = []
+        for group, (start, stop) in enumerate(self._bounds):
+            self._row_groups.extend([group] * (stop - start))
+        # sorted is stable, rows of the same time stay in time line order
+        self._order = sorted(range(len(times)), key=times.__getitem__)
+
+    def _change(self, row):
+        """ :return: (time, key, old path, new path) of a row, None if it
+                     did not change the path of its time line
+        """
+        group = self._row_groups[row]
+        old = self._path(row - 1) if row > self._bounds[group][0] else None
+        new = self._path(row)
+        if old == new:
+            return None
+        return self.as_paths.times[row], self.keys[group], old, new
+
+    def changes(self, start=None, end=None):
+        """ (time, (collector, peer, prefix), old path, new path) of every
+        change with start < time <= end, in time order
+        """
+        self._sort_rows()
+        times = self.as_paths.times
+        for row in self._order:
+            if start is not None and times[row] <= start:
+                continue
+            if end is not None and times[row] > end:
+                break
+            change = self._change(row)
+            if change is not None:
+                yield change
+
+    def windows(self, start, end, step):
+        """ (t, changes) for t = start, start + step, .. up to end: the
+        changes (see changes()) since the previous t, the first time all of
+        them up to start. Applied in order they give snapshot(t).
+        """
+        self._sort_rows()
+        order, times = self._order, self.as_paths.times
+        i = 0
+        t = start
+        while t <= end:
+            changes = []
+            while i < len(order) and times[order[i]] <= t:
+                change = self._change(order[i])
+                if change is not None:
+                    changes.append(change)
+                i += 1
+            yield t, changes
+            t += step
+
+
+def propagation_over_time(history, asns, start, end, step):
+    """ :param history: RibHistory
+    :param asns: ASNs (str or int), e.g. the hijackers
+    :return: [(t, share of the peers that had a path through one of asns at t)]
+             for the windows of history.windows(start, end, step)
+    """
+    asns = set(int(asn) for asn in asns if str(asn).isdigit())
+    through = dict()
+    peers = set(key[:2] for key in history.keys)
+    counts = defaultdict(int)
+    reached = 0
+    shares = []
+    for t, changes in history.windows(start, end, step):
+        for time, key, old, new in changes:
+            for path, delta in ((old, -1), (new, 1)):
+                if path is None:
+                    continue
+                if path not in through:
+                    through[path] = not asns.isdisjoint(path_to_asns(path))
+                if through[path]:
+                    peer = key[:2]
+                    counts[peer] += delta
+                    if counts[peer] == 0:
+                        reached -= 1
+                    elif counts[peer] == 1 and delta == 1:
+                        reached += 1
+        shares.append((t, reached / float(max(len(peers), 1))))
+    return shares
@@ -0,0 +1,178 @@
+""" Two executors connected by a queue: a pool for the stream stage
+(CPU bound) and a pool for the hegemony stage (network bound).
+Jobs are dispatched heaviest first, one at a time, and a finished job
+releases the hegemony jobs that wait for it. A job whose worker dies
+(killed, or crashed in the bgpstream C extension) fails instead of being
+waited for: the pool starts a new worker, but never completes that job.
+"""
+import os
+import time
+import heapq
+import logging
+import traceback
+from itertools import count
+from Queue import Queue, Empty
+from multiprocessing import Pool
+from multiprocessing.queues import SimpleQueue
+
+STAGES = ('stream', 'hegemony')
+# seconds between two checks of the workers running jobs
+POLL_SECONDS = 5.0
+
+# (token, pid) of the jobs started, set by the pool initializer
+_started = None
+
+
+class Job():
+    def __init__(self, name, cost, args, followups=None, function=None):
+        """
+        :param name: for the logs
+        :param cost: estimated cost, only compared within a stage
+        :param args: arguments of the stage function
+        :param followups: hegemony Jobs that can start once this Job is done
+        :param function: run instead of the stage function
+        """
+        self.name = name
+        self.cost = cost
+        self.args = args
+        self.followups = followups or []
+        self.function = function
+
+
+def _init_worker(started, initializer, initargs):
+    global _started
+    _started = started
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_timed(function_args, token=None):
+    """ :param token: reported with the pid of the worker, see Scheduler.run
+    :return: (result, start, end, error) """
+    function, args = function_args
+    if token is not None and _started is not None:
+        _started.put((token, os.getpid()))
+    start = time.time()
+    try:
+        return function(*args), start, time.time(), None
+    except Exception:
+        return None, start, time.time(), traceback.format_exc()
+
+
+class Scheduler():
+    def __init__(self, stream_processes, hegemony_processes,
+                 initializer=None, initargs=(), poll_seconds=POLL_SECONDS):
+        """ :param initializer: called with initargs in each worker of both pools
+        """
+        self.processes = {'stream': stream_processes, 'hegemony': hegemony_processes}
+        self.initializer = initializer
+        self.initargs = initargs
+        self.poll_seconds = poll_seconds
+
+    def run(self, stream_function, hegemony_function, stream_jobs, hegemony_jobs,
+            callback=None):
+        """ Run stream_function(*job.args) for stream_jobs and
+        hegemony_function(*job.args) for hegemony_jobs and the followups.
+        :param callback: called with (stage, job, result) when a job is done
+        :return: stats {stage: {'processes', 'jobs', 'errors', 'busy', 'utilization'},
+                        'makespan': seconds}
+        """
+        functions = {'stream': stream_function, 'hegemony': hegemony_function}
+        stats = dict((stage, {'processes': self.processes[stage], 'jobs': 0, 'errors': 0,
+                              'busy': 0.0, 'utilization': 0.0}) for stage in STAGES)
+        done = Queue()
+        # written at once, a worker killed right after its put is not lost
+        started = SimpleQueue()
+        pools = dict((stage, Pool(processes=self.processes[stage], initializer=_init_worker,
+                                  initargs=(started, self.initializer, self.initargs)))
+                     for stage in STAGES)
+        in_flight = dict((stage, 0) for stage in STAGES)
+        ready = []
+        # {token: (stage, job)} submitted and not done, {token: pid} started
+        running = dict()
+        pids = dict()
+        tokens = count()
+        failed = set()
+
+        def submit(stage, job):
+            in_flight[stage] += 1
+            token = next(tokens)
+            running[token] = (stage, job)
+            pools[stage].apply_async(_run_timed,
+                                     ((job.function or functions[stage], job.args), token),
+                                     callback=lambda result: done.put((stage, job, token, result)))
+
+        def lost():
+            """ :return: [(stage, job, token)] started by a worker that is gone
+            """
+            while not started.empty():
+                token, pid = started.get()
+                if token in running:
+                    pids[token] = pid
+            # the pools replace the workers that exited
+            alive = dict((stage, set(process.pid for process in pools[stage]._pool
+                                     if process.exitcode is None)) for stage in STAGES)
+            return [(stage, job, token) for token, (stage, job) in running.items()
+                    if token in pids and pids[token] not in alive[stage]]
+
+        order = count()
+
+        def push(job):
+            heapq.heappush(ready, (-job.cost, next(order), job))
+
+        stime = time.time()
+        try:
+            # the pool hands out in submission order, one job at a time
+            for job in sorted(stream_jobs, key=lambda job: -job.cost):
+                submit('stream', job)
+            for job in hegemony_jobs:
+                push(job)
+            while True:
+                # keep the heaviest ready hegemony jobs back until a worker is free
+                while ready and in_flight['hegemony'] < self.processes['hegemony']:
+                    submit('hegemony', heapq.heappop(ready)[-1])
+                if not in_flight['stream'] and not in_flight['hegemony']:
+                    break
+                try:
+                    stage, job, token, (result, start, end, error) = \
+                        done.get(timeout=self.poll_seconds)
+                except Empty:
+                    now = time.time()
+                    for stage, job, token in lost():
+                        failed.add(stage)
+                        done.put((stage, job, token, (None, now, now, "its worker (pid %s) died"
+                                                      % pids[token])))
+                    continue
+                if token not in running:
+                    # failed already, its worker died once it was done
+                    continue
+                del running[token]
+                pids.pop(token, None)
+                in_flight[stage] -= 1
+                stats[stage]['jobs'] += 1
+                stats[stage]['busy'] += end - start
+                if error is not None:
+                    stats[stage]['errors'] += 1
+                    logging.error("[%s] %s stage failed:\n%s" % (job.name, stage, error))
+                    continue
+                for followup in job.followups:
+                    push(followup)
+                if callback is not None:
+                    callback(stage, job, result)
+        except BaseException:
+            for pool in pools.values():
+                pool.terminate()
+            raise
+        for stage, pool in pools.items():
+            if stage in failed:
+                # join would wait for the results of the jobs lost
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+        stats['makespan'] = time.time() - stime
+        for stage in STAGES:
+            stats[stage]['utilization'] = stats[stage]['busy'] / \
+                max(stats['makespan'] * self.processes[stage], 1e-9)
+        return stats
@@ -0,0 +1,137 @@
+""" Consumers of the elem stream of HistoBGPStream.iter_elems
+Each sink has add(elem) and result(), so a stream can feed several
+of them while it is being read.
+"""
+import re
+from collections import namedtuple, defaultdict
+from timeline import Timeline
+from aspaths import ASPaths
+from prefixes import covers
+import metrics
+
+# record_type is 'rib', 'updates' or 'withdrawal', as_path is '' for withdrawals
+Elem = namedtuple('Elem', ['collector', 'peer', 'prefix', 'time', 'record_type', 'as_path'])
+
+
+class TimelineSink():
+    """ Time lines per (collector, peer, prefix), as event['as_paths']
+    """
+    def __init__(self):
+        self.timelines = defaultdict(Timeline)
+        self.inserts = 0
+        # inserts older than the end of their time line
+        self.repairs = 0
+
+    def add(self, elem):
+        timeline = self.timelines[(elem.collector, elem.peer, elem.prefix)]
+        if timeline.times and elem.time < timeline.times[-1]:
+            self.repairs += 1
+        self.inserts += 1
+        timeline.insert(elem.time, elem.record_type, elem.as_path)
+
+    def result(self):
+        metrics.inc('timeline_inserts_total', self.inserts)
+        metrics.inc('timeline_repairs_total', self.repairs)
+        return ASPaths.from_timelines(self.timelines)
+
+
+class PrefixOriginSink():
+    """ Prefixes announced per origin AS, as event['pfxes_of_hijacker']
+    """
+    def __init__(self):
+        self.prefixes = dict()
+
+    def add(self, elem):
+        if elem.record_type == 'withdrawal':
+            return
+        origin_asn = elem.as_path.split(' ')[-1]
+        if origin_asn not in self.prefixes:
+            self.prefixes[origin_asn] = set()
+        self.prefixes[origin_asn].add(elem.prefix)
+
+    def result(self):
+        return dict((asn, list(prefixes)) for asn, prefixes in self.prefixes.items())
+
+
+class IntervalSink():
+    """ Elems of a stream shared by several events that one of them would
+    have read alone: within interval, and accepted by match(elem).
+    """
+    def __init__(self, interval):
+        self.interval = interval
+
+    def add(self, elem):
+        if self.interval[0] <= elem.time <= self.interval[1] and self.match(elem):
+            self.sink.add(elem)
+
+    def result(self):
+        return self.sink.result()
+
+
+class CoveringPathsSink(IntervalSink):
+    """ as_paths of an event from a stream filtered by the prefixes of
+    several events: the elems 'prefix less <prefix>' selects
+    """
+    def __init__(self, prefix, interval):
+        IntervalSink.__init__(self, interval)
+        self.prefix = prefix
+        self.sink = TimelineSink()
+        # elem prefix -> covers self.prefix
+        self.less_specific = dict()
+
+    def match(self, elem):
+        matched = self.less_specific.get(elem.prefix)
+        if matched is None:
+            matched = covers(elem.prefix, self.prefix)
+            self.less_specific[elem.prefix] = matched
+        return matched
+
+
+class HijackerPrefixesSink(IntervalSink):
+    """ pfxes_of_hijacker of an event from a stream filtered by the
+    hijackers of several events: the elems 'path <asn>$' selects for
+    any of its ases
+    """
+    def __init__(self, ases, interval):
+        IntervalSink.__init__(self, interval)
+        self.path_filters = [re.compile('%s$' % asn) for asn in ases]
+        self.sink = PrefixOriginSink()
+
+    def match(self, elem):
+        if not elem.as_path:
+            return False
+        for path_filter in self.path_filters:
+            if path_filter.search(elem.as_path):
+                return True
+        return False
+
+
+class ElemWriterSink():
+    """ Write elems to a file, one per line:
+    collector<TAB>peer<TAB>prefix<TAB>time<TAB>record_type<TAB>as_path
+    """
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.f = open(fpath, 'w')
+        self.count = 0
+
+    def add(self, elem):
+        self.f.write('%s\t%s\t%s\t%d\t%s\t%s\n' % elem)
+        self.count += 1
+
+    def result(self):
+        if not self.f.closed:
+            self.f.close()
+        return self.count
+
+
+def read_elems(fpath):
+    """ Elems written by ElemWriterSink
+    """
+    with open(fpath, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 6:
+                continue
+            collector, peer, prefix, timestamp, record_type, as_path = fields
+            yield Elem(collector, peer, prefix, int(timestamp), record_type, as_path)
@@ -0,0 +1,464 @@
+""" Local stand-ins for the services the collector talks to,
+for benchmarks, tests and offline runs, and the synthetic data they serve.
+"""
+import re
+import json
+import time
+import random
+import threading
+from bisect import bisect_left, bisect_right
+from collections import deque
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from prefixes import covers
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeIHR():
+    """ Serves /ihr/api/hegemony/ like IHR does (results, count, next)
+    from a table {(originasn, af, timebin): {asn: hege}}, where originasn
+    is 0 for global hegemony and timebin is '%Y-%m-%dT%H:%M'.
+    Counts requests and bytes sent.
+    It can also throttle like IHR (429 above max_rate requests per
+    second) and fail a share (error_rate) of the requests with a 503.
+    """
+    def __init__(self, table, page_size=1000, delay=0.0, max_rate=None, error_rate=0.0):
+        self.table = table
+        self.page_size = page_size
+        self.delay = delay
+        self.max_rate = max_rate
+        self.error_rate = error_rate
+        self.requests = 0
+        self.bytes_sent = 0
+        self.rejected = 0
+        self.recent = deque()
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        """ :return: base url to give to GetHegemony
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body, status = fake.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.base_url()
+
+    def base_url(self):
+        return "http://127.0.0.1:%s/ihr/api/hegemony/?" % self.server.server_address[1]
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.rejected = 0
+
+    def select(self, params):
+        """ All results matching the query parameters, in a stable order.
+        """
+        def values(name):
+            if name not in params:
+                return None
+            return set(v for value in params[name] for v in value.split(',') if v != '')
+
+        origins = values('originasn')
+        ases = values('asn')
+        afs = values('af')
+        timebin = params.get('timebin', [None])[0]
+        gte = params.get('timebin__gte', [None])[0]
+        lte = params.get('timebin__lte', [None])[0]
+        results = []
+        for (originasn, af, t), hegemony in sorted(self.table.items()):
+            if origins is not None and str(originasn) not in origins:
+                continue
+            if afs is not None and str(af) not in afs:
+                continue
+            if timebin is not None and t != timebin:
+                continue
+            if gte is not None and t < gte:
+                continue
+            if lte is not None and t > lte:
+                continue
+            for asn, hege in sorted(hegemony.items()):
+                if ases is not None and str(asn) not in ases:
+                    continue
+                results.append({'timebin': t + ':00Z', 'originasn': originasn,
+                                'asn': asn, 'af': af, 'hege': hege})
+        return results
+
+    def _reject(self):
+        """ :return: status code if this request is throttled or fails
+        """
+        with self.lock:
+            now = time.time()
+            if self.max_rate is not None:
+                while self.recent and self.recent[0] < now - 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.max_rate:
+                    self.rejected += 1
+                    return 429
+                self.recent.append(now)
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.rejected += 1
+                return 503
+        return None
+
+    def respond(self, path):
+        if self.delay:
+            time.sleep(self.delay)
+        status = self._reject()
+        if status is not None:
+            return json.dumps({'detail': 'Request was throttled.'}), status
+        url = urlparse(path)
+        params = parse_qs(url.query)
+        results = self.select(params)
+        page = int(params.get('page', ['1'])[0])
+        start = (page - 1) * self.page_size
+        rsp = {'count': len(results), 'previous': None, 'next': None,
+               'results': results[start:start + self.page_size]}
+        if start + self.page_size < len(results):
+            query = '&'.join('%s=%s' % (k, ','.join(v)) for k, v in sorted(params.items())
+                             if k != 'page')
+            rsp['next'] = 'http://127.0.0.1:%s%s?%s&page=%s' % \
+                (self.server.server_address[1], url.path, query, page + 1)
+        body = json.dumps(rsp)
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += len(body)
+        return body, 200
+
+
+class FakeBGPElem():
+    def __init__(self, type, peer_address, fields, peer_asn=0):
+        self.type = type
+        self.peer_address = peer_address
+        self.peer_asn = peer_asn
+        self.fields = fields
+
+
+class FakeBGPRecord():
+    """ Stand-in for _pybgpstream.BGPRecord, filled by FakeBGPStream
+    """
+    def __init__(self):
+        self.project = 'fake'
+        self.collector = None
+        self.type = None
+        self.time = None
+        self.status = 'valid'
+        self.elems = []
+        self.next_elem = 0
+
+    def get_next_elem(self):
+        if self.next_elem >= len(self.elems):
+            return None
+        elem = self.elems[self.next_elem]
+        self.next_elem += 1
+        return elem
+
+
+class FakeBGPStream():
+    """ Stand-in for _pybgpstream.BGPStream replaying canned records
+    [(collector, record_type, time, [FakeBGPElem])], record_type being
+    'rib' or 'update', in the order given.
+    Understands the filters we use: 'prefix more|less|exact|any <prefix>',
+    'path <regex>', 'collector <name>' and 'type ribs|updates', joined by
+    'and'. As in BGPStream, terms of the same kind match if any of them
+    does and different kinds must all match.
+    Counts the records and elems it decoded, and can take some time to
+    decode each record (decode_delay seconds).
+    With times (the record times, if they are in order) it skips to the
+    interval, as BGPStream only opens the dumps of the interval.
+    """
+    def __init__(self, records, decode_delay=0.0, times=None):
+        self.records = records
+        self.decode_delay = decode_delay
+        self.times = times
+        self.owed_delay = 0.0
+        self.end = len(records)
+        self.filters = dict()
+        self.intervals = []
+        self.started = False
+        self.position = 0
+        self.records_read = 0
+        self.elems_read = 0
+
+    def parse_filter_string(self, string):
+        for term in string.split(' and '):
+            words = term.split()
+            if not words:
+                continue
+            kind, value = words[0], words[1:]
+            if kind == 'prefix' and len(value) == 1:
+                value = ['any'] + value
+            self.filters.setdefault(kind, []).append(tuple(value))
+
+    def add_interval_filter(self, start_time, end_time):
+        self.intervals.append((start_time, end_time))
+
+    def start(self):
+        self.started = True
+        self.position = 0
+        self.end = len(self.records)
+        if self.times is not None and self.intervals:
+            self.position = bisect_left(self.times, min(start for start, end in self.intervals))
+            ends = [end for start, end in self.intervals]
+            if None not in ends and -1 not in ends:
+                self.end = bisect_right(self.times, max(ends))
+
+    def _match_record(self, collector, record_type, timestamp):
+        if self.intervals and not any(
+                start <= timestamp and (end is None or end == -1 or timestamp <= end)
+                for start, end in self.intervals):
+            return False
+        if 'collector' in self.filters and \
+                not any(value[0] == collector for value in self.filters['collector']):
+            return False
+        if 'type' in self.filters and \
+                not any(value[0].rstrip('s') == record_type.rstrip('s')
+                        for value in self.filters['type']):
+            return False
+        return True
+
+    def _match_elem(self, elem):
+        if 'prefix' in self.filters:
+            prefix = elem.fields.get('prefix')
+            if prefix is None:
+                return False
+            matched = False
+            for op, value in self.filters['prefix']:
+                if op == 'exact':
+                    matched = prefix == value
+                elif op == 'more':
+                    matched = covers(value, prefix)
+                elif op == 'less':
+                    matched = covers(prefix, value)
+                else:
+                    matched = covers(value, prefix) or covers(prefix, value)
+                if matched:
+                    break
+            if not matched:
+                return False
+        if 'path' in self.filters:
+            path = elem.fields.get('as-path')
+            if path is None or not any(re.search(' '.join(value), path)
+                                       for value in self.filters['path']):
+                return False
+        return True
+
+    def get_next_record(self, rec):
+        while self.started and self.position < self.end:
+            collector, record_type, timestamp, elems = self.records[self.position]
+            self.position += 1
+            if not self._match_record(collector, record_type, timestamp):
+                continue
+            self.records_read += 1
+            self.elems_read += len(elems)
+            if self.decode_delay:
+                # sleep in slices of at least 1ms
+                self.owed_delay += self.decode_delay
+                if self.owed_delay >= 0.001:
+                    time.sleep(self.owed_delay)
+                    self.owed_delay = 0.0
+            rec.collector = collector
+            rec.type = record_type
+            rec.time = timestamp
+            rec.elems = [elem for elem in elems if self._match_elem(elem)]
+            rec.next_elem = 0
+            return True
+        return False
+
+
+class FakeBGPSource():
+    """ New FakeBGPStream/FakeBGPRecord over the same records on each call,
+    for HistoBGPStream(source=...) to read shards from.
+    """
+    def __init__(self, records, decode_delay=0.0):
+        self.records = records
+        self.decode_delay = decode_delay
+        self.times = [record[2] for record in records]
+        if self.times != sorted(self.times):
+            self.times = None
+        # streams handed out in this process
+        self.streams = []
+
+    def __call__(self):
+        stream = FakeBGPStream(self.records, self.decode_delay, self.times)
+        self.streams.append(stream)
+        return stream, FakeBGPRecord()
+
+    def records_read(self):
+        return sum(stream.records_read for stream in self.streams)
+
+
+def records_from_elems(elems):
+    """ Canned records for FakeBGPStream from elems
+    (collector, peer, prefix, time, record_type, as_path), one record
+    per run of elems sharing collector, time and kind.
+    """
+    records = []
+    for collector, peer, prefix, timestamp, record_type, as_path in elems:
+        kind = 'rib' if record_type == 'rib' else 'update'
+        if record_type == 'withdrawal':
+            elem = FakeBGPElem('W', peer, {'prefix': prefix})
+        else:
+            elem = FakeBGPElem('R' if kind == 'rib' else 'A', peer,
+                               {'prefix': prefix, 'as-path': as_path})
+        if records and records[-1][:3] == (collector, kind, timestamp):
+            records[-1][3].append(elem)
+        else:
+            records.append((collector, kind, timestamp, [elem]))
+    return records
+
+
+def elems_from_event(event, prefixes_time, peer=('rrc00', '10.255.0.1'), transit='64999'):
+    """ Elems a stream of a collected event gives: the entries of
+    event['as_paths'], and the prefixes of event['pfxes_of_hijacker']
+    announced at prefixes_time through transit.
+    :param event: with as_paths as ASPaths
+    :param prefixes_time: timestamp within the prefixes interval of the event
+    :return: elems (collector, peer, prefix, time, record_type, as_path) by time
+    """
+    elems = list(event['as_paths'].iter_entries())
+    collector, peer_address = peer
+    for origin_as, prefixes in sorted(event.get('pfxes_of_hijacker', {}).items()):
+        for prefix in sorted(prefixes):
+            elems.append((collector, peer_address, prefix, prefixes_time, 'updates',
+                          '%s %s' % (transit, origin_as)))
+    # sort is stable, the entries of a time line stay in order
+    elems.sort(key=lambda elem: elem[3])
+    return elems
+
+
+def _hege_paths(value):
+    # collect_hege_paths stores (hege_paths, hegemony of the ASes),
+    # old pickles the hege_paths alone
+    if isinstance(value, tuple) and len(value) == 2 and isinstance(value[1], dict):
+        return value[0]
+    return value
+
+
+def hegemony_table_from_event(event, timebin):
+    """ Table for FakeIHR with the hegemony of event['global_paths'] and
+    event['local_paths'] at timebin ('%Y-%m-%dT%H:%M', the hegemony time
+    of the event), ASes without hegemony left out.
+    """
+    table = dict()
+
+    def add(originasn, prefix, hege_paths):
+        hegemony = table.setdefault((originasn, 6 if ':' in prefix else 4, timebin), dict())
+        for path, heges in _hege_paths(hege_paths):
+            for asn, hege in zip(path, heges):
+                if hege and asn.isdigit():
+                    hegemony[int(asn)] = hege
+
+    for prefix, hege_paths in event.get('global_paths', {}).items():
+        add(0, prefix, hege_paths)
+    for prefix, origins in event.get('local_paths', {}).items():
+        for origin_as, hege_paths in origins.items():
+            origin_as = origin_as.strip('{}')
+            if origin_as.isdigit():
+                add(int(origin_as), prefix, hege_paths)
+    return table
+
+
+def synthetic_elem_stream(n_elems, n_keys=50, disorder=0.2, seed=0):
+    """ Elems for a few busy (collector, peer, prefix), with a share
+    of updates arriving out of order like merged collector dumps do.
+    """
+    rnd = random.Random(seed)
+    keys = [('rrc%02d' % (i % 20), '10.0.%s.%s' % (i // 250, i % 250),
+             '192.0.2.0/24') for i in range(n_keys)]
+    paths = ['3356 174 %s' % asn for asn in range(64500, 64510)]
+    elems = []
+    now = 1500000000
+    for i in range(n_elems):
+        now += rnd.randint(0, 3)
+        timestamp = now
+        if rnd.random() < disorder:
+            timestamp -= rnd.randint(1, 3600)
+        if rnd.random() < 0.05:
+            record_type, as_path = 'withdrawal', ''
+        else:
+            record_type, as_path = 'updates', rnd.choice(paths)
+        collector, peer, prefix = rnd.choice(keys)
+        elems.append((collector, peer, prefix, timestamp, record_type, as_path))
+    return elems
+
+
+def synthetic_hegemony_table(origins, timebins, ases_per_origin=30, seed=0):
+    """ {(originasn, af, timebin): {asn: hege}} for FakeIHR,
+    originasn 0 holds global hegemony of every AS.
+    """
+    rnd = random.Random(seed)
+    table = dict()
+    transit = range(100, 100 + 5 * ases_per_origin)
+    for timebin in timebins:
+        for origin in origins:
+            hegemony = dict((asn, round(rnd.random(), 4))
+                            for asn in rnd.sample(transit, ases_per_origin))
+            hegemony[origin] = 1.0
+            table[(origin, 4, timebin)] = hegemony
+        table[(0, 4, timebin)] = dict((asn, round(rnd.random(), 4))
+                                      for asn in transit + list(origins))
+    return table
+
+
+def synthetic_event_elems(start_time, n_elems, hijack_prefix='10.0.0.0/24',
+                          hijacker='64512', seed=0):
+    """ Elems around an event: the hijacked prefix, its less and more
+    specifics, prefixes of the hijacker and unrelated ones, from 10 hours
+    before to 3 hours after start_time (timestamp), ordered by time.
+    """
+    rnd = random.Random(seed)
+    less_specifics = [hijack_prefix, '10.0.0.0/16', '10.0.0.0/8']
+    more_specifics = ['10.0.0.0/25', '10.0.0.128/25']
+    hijacker_prefixes = ['20.%s.%s.0/24' % (i // 256, i % 256) for i in range(50)]
+    other_prefixes = ['30.%s.%s.0/24' % (i // 256, i % 256) for i in range(2000)]
+    peers = [('rrc%02d' % (i % 10), '10.1.%s.%s' % (i // 250, i % 250)) for i in range(40)]
+    transit = ['3356', '174', '1299', '2914', '6939']
+    times = sorted(rnd.randint(start_time - 10 * 3600, start_time + 3 * 3600)
+                   for i in range(n_elems))
+    elems = []
+    for timestamp in times:
+        r = rnd.random()
+        if r < 0.1:
+            prefix, origin = rnd.choice(less_specifics), rnd.choice(['64500', hijacker])
+        elif r < 0.15:
+            prefix, origin = rnd.choice(more_specifics), '64500'
+        elif r < 0.3:
+            prefix, origin = rnd.choice(hijacker_prefixes), hijacker
+        else:
+            prefix, origin = rnd.choice(other_prefixes), str(64600 + rnd.randint(0, 300))
+        collector, peer = rnd.choice(peers)
+        if rnd.random() < 0.05:
+            record_type, as_path = 'withdrawal', ''
+        else:
+            record_type = 'updates'
+            as_path = ' '.join(rnd.sample(transit, rnd.randint(1, 3)) + [origin])
+        elems.append((collector, peer, prefix, timestamp, record_type, as_path))
+    return elems
@@ -0,0 +1,29 @@
+import pickle
+from aspaths import ASPaths, path_to_asns
+
+NESTED = {'rrc00': {'10.0.0.1': {'10.0.0.0/24': [(10, 'updates', '3356 174 64500'),
+                                                 (20, 'withdrawal', '')],
+                                 '10.0.1.0/24': [(15, 'rib', '3356 {64501,64502}')]}},
+          'rrc01': {'10.1.0.1': {'10.0.0.0/24': [(12, 'updates', '1299 64512 64512')]}}}
+
+
+def test_nested_round_trip():
+    as_paths = ASPaths.from_nested(NESTED)
+    assert as_paths.to_nested() == NESTED
+    assert pickle.loads(pickle.dumps(as_paths, pickle.HIGHEST_PROTOCOL)).to_nested() == NESTED
+
+
+def test_nested_view():
+    as_paths = ASPaths.from_nested(NESTED)
+    assert sorted(as_paths.keys()) == ['rrc00', 'rrc01']
+    assert as_paths['rrc00']['10.0.0.1']['10.0.1.0/24'] == [(15, 'rib', '3356 {64501,64502}')]
+    assert 'rrc02' not in as_paths
+    assert sorted(as_paths.iter_entries()) == sorted(
+        (collector, peer, prefix) + entry
+        for collector, P in NESTED.items() for peer, A in P.items()
+        for prefix, entries in A.items() for entry in entries)
+
+
+def test_path_to_asns():
+    assert path_to_asns('3356 174 64500') == [3356, 174, 64500]
+    assert set(path_to_asns('3356 {64501,64502}')) == set([3356, 64501, 64502])
@@ -0,0 +1,94 @@
+import os
+import random
+import pytest
+from checkpoints import Checkpoint
+from histobgpstream import HistoBGPStream
+from standins import FakeBGPStream, FakeBGPRecord, FakeBGPSource, records_from_elems, \
+    synthetic_event_elems
+
+START_TIME = '2017-01-01 12:00:00'
+HIJACK_PREFIX, HIJACKER = '10.0.0.0/24', '64512'
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingStream(FakeBGPStream):
+    """ Dies after decoding crash_after records
+    """
+    def __init__(self, records, times, crash_after):
+        FakeBGPStream.__init__(self, records, times=times)
+        self.crash_after = crash_after
+
+    def get_next_record(self, rec):
+        if self.crash_after is not None and self.records_read >= self.crash_after:
+            raise Crash()
+        return FakeBGPStream.get_next_record(self, rec)
+
+
+@pytest.fixture(scope='module')
+def source():
+    start = HistoBGPStream(FakeBGPStream([]), FakeBGPRecord()).convert_dt_to_timestamp(START_TIME)
+    return FakeBGPSource(records_from_elems(
+        synthetic_event_elems(start, 5000, HIJACK_PREFIX, HIJACKER)))
+
+
+def collect(source, stage, checkpoint=None, crash_after=None):
+    """ :return: (result, records decoded by the streams of this run)
+    """
+    streams = []
+
+    def crashing_source():
+        streams.append(CrashingStream(source.records, source.times, crash_after))
+        return streams[-1], FakeBGPRecord()
+
+    handler = HistoBGPStream(source=crashing_source, checkpoint=checkpoint)
+    try:
+        if stage == 'get_paths':
+            handler.set_filter('prefix less ' + HIJACK_PREFIX)
+            return [list(handler.get_paths(START_TIME).iter_entries())], \
+                sum(stream.records_read for stream in streams)
+        paths, prefixes = handler.collect_events([(HIJACK_PREFIX, HIJACKER, START_TIME, None)])[0]
+        return [list(paths.iter_entries()), dict((k, sorted(v)) for k, v in prefixes.items())], \
+            sum(stream.records_read for stream in streams)
+    except Crash:
+        raise Crash(sum(stream.records_read for stream in streams))
+
+
+@pytest.mark.parametrize('stage', ['get_paths', 'collect_events'])
+def test_resumed_stream_is_the_uninterrupted_one(tmpdir, source, stage):
+    expected, records = collect(source, stage)
+    path = os.path.join(str(tmpdir), stage + '.checkpoint')
+    rnd = random.Random(0)
+    crashes, decoded, saved = 0, 0, 0
+    while True:
+        # a checkpoint every record
+        checkpoint = Checkpoint(path, 0)
+        crash_after = rnd.randint(1, records // 4) if crashes < 3 else None
+        try:
+            result, read = collect(source, stage, checkpoint, crash_after)
+        except Crash as e:
+            crashes += 1
+            decoded += e.args[0]
+            saved += checkpoint.saved
+            continue
+        decoded += read
+        break
+    assert result == expected
+    assert saved > 0
+    # resumed where they stopped, a few records of the same time decoded again
+    assert decoded - records <= crashes * 20
+    # removed once the stream is done
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_checkpoint_of_something_else_is_ignored(tmpdir):
+    path = os.path.join(str(tmpdir), 'event.checkpoint')
+    Checkpoint(path).save(('prefix less 10.0.0.0/24', 0, 100), {'time': 50})
+    checkpoint = Checkpoint(path)
+    assert checkpoint.load(('prefix less 10.0.0.0/24', 0, 100)) == {'time': 50}
+    assert checkpoint.load(('prefix less 10.0.0.0/8', 0, 100)) is None
+    with open(path, 'w') as f:
+        f.write('partial')
+    assert checkpoint.load(('prefix less 10.0.0.0/24', 0, 100)) is None
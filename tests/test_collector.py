@@ -0,0 +1,58 @@
+import random
+from datetime import datetime, timedelta
+from collector import plan_streams, collect_stream
+from eventstore import EventStore
+from histobgpstream import HistoBGPStream
+from standins import FakeBGPStream, FakeBGPRecord, FakeBGPSource, records_from_elems, \
+    synthetic_event_elems
+
+
+def test_clustered_streams_collect_each_event(tmpdir):
+    rnd = random.Random(0)
+    convert = HistoBGPStream(FakeBGPStream([]), FakeBGPRecord()).convert_dt_to_timestamp
+    events = []
+    elems = []
+    for i in range(6):
+        # families of events a few hours apart, like backconnect_1..6
+        start_time = datetime(2017, 1, 1) + timedelta(days=(i // 3) * 3, hours=rnd.randint(0, 6))
+        prefix, hijacker = '10.%s.0.0/24' % i, str(64512 + i)
+        events.append({'title': 'synthetic_%s' % i, 'hijack_prefix': prefix,
+                       'hijack_as': hijacker, 'innocent_as': '', 'victim_as': '64500',
+                       'start_time': str(start_time), 'end_time': ''})
+        elems.extend(synthetic_event_elems(convert(start_time), 2000, prefix, hijacker, seed=i))
+    elems.sort(key=lambda elem: elem[3])
+    records = records_from_elems(elems)
+
+    alone = dict()
+    records_alone = 0
+    for event in events:
+        source = FakeBGPSource(records)
+        alone[event['title']] = HistoBGPStream(source=source).collect_events(
+            [(event['hijack_prefix'], event['hijack_as'], event['start_time'], None)])[0]
+        records_alone += source.records_read()
+
+    directory = str(tmpdir)
+    for event in events:
+        EventStore(directory, event['title']).write_event(event)
+    clusters = plan_streams([{'title': event['title']} for event in events], directory,
+                            HistoBGPStream(FakeBGPStream([]), FakeBGPRecord()))
+    assert len(clusters) == 2
+    records_clustered = 0
+    counted_alone = 0
+    for cluster in clusters:
+        source = FakeBGPSource(records)
+        titles, records_read, records_each = collect_stream(cluster, directory,
+                                                            HistoBGPStream(source=source))
+        assert records_read == source.records_read()
+        records_clustered += records_read
+        counted_alone += records_each
+    assert records_clustered < records_alone
+    # what a stream per event would have decoded, counted on the shared streams
+    assert counted_alone == records_alone
+
+    for event in events:
+        stored = EventStore(directory, event['title']).load_event()
+        paths, prefixes = alone[event['title']]
+        assert list(stored['as_paths'].iter_entries()) == list(paths.iter_entries())
+        assert dict((k, sorted(v)) for k, v in stored['pfxes_of_hijacker'].items()) == \
+            dict((k, sorted(v)) for k, v in prefixes.items())
@@ -0,0 +1,58 @@
+import pytest
+from elemcache import ElemCache
+from histobgpstream import HistoBGPStream
+from standins import FakeBGPStream, FakeBGPRecord, FakeBGPSource, records_from_elems, \
+    synthetic_event_elems
+
+START_TIME = '2017-01-01 12:00:00'
+HIJACK_PREFIX, HIJACKER = '10.0.0.0/24', '64512'
+
+
+@pytest.fixture(scope='module')
+def source():
+    start = HistoBGPStream(FakeBGPStream([]), FakeBGPRecord()).convert_dt_to_timestamp(START_TIME)
+    # a day of elems around the event
+    elems = synthetic_event_elems(start, 5000, HIJACK_PREFIX, HIJACKER) + \
+        synthetic_event_elems(start + 13 * 3600, 5000, HIJACK_PREFIX, HIJACKER, seed=1)
+    elems.sort(key=lambda elem: elem[3])
+    return FakeBGPSource(records_from_elems(elems))
+
+
+def collect(source, cache, end_time=None, collector=None):
+    """ :return: (result, records decoded)
+    """
+    source.streams = []
+    handler = HistoBGPStream(*source(), source=source, cache=cache)
+    if collector is not None:
+        # the filter of the first pass of collect_events, for one collector
+        handler.set_filter('prefix less %s' % HIJACK_PREFIX)
+        handler.set_filter('collector %s' % collector)
+        result = [list(handler.get_paths(START_TIME, end_time).iter_entries())]
+    else:
+        paths, prefixes = handler.collect_events([(HIJACK_PREFIX, HIJACKER, START_TIME,
+                                                   end_time)])[0]
+        result = [list(paths.iter_entries()), dict((k, sorted(v)) for k, v in prefixes.items())]
+    return result, source.records_read()
+
+
+def test_replayed_stream_is_the_stream(tmpdir, source):
+    cache = ElemCache(str(tmpdir))
+    expected, records = collect(source, None)
+    cold, cold_records = collect(source, cache)
+    assert cold == expected
+    assert cold_records == records
+    warm, warm_records = collect(source, cache)
+    assert warm == expected
+    assert warm_records == 0
+    assert cache.counters['replayed'] > 0
+
+    # partly replayed, the rest of the window read and recorded
+    expected, records = collect(source, None, '2017-01-01 20:00:00')
+    longer, longer_records = collect(source, cache, '2017-01-01 20:00:00')
+    assert longer == expected
+    assert 0 < longer_records < records
+
+    # a collector from the segment of all collectors
+    expected, records = collect(source, None, '2017-01-01 20:00:00', 'rrc03')
+    assert records > 0
+    assert collect(source, cache, '2017-01-01 20:00:00', 'rrc03') == (expected, 0)
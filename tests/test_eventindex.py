@@ -0,0 +1,51 @@
+import os
+from aspaths import ASPaths
+from eventindex import EventIndex
+from eventstore import EventStore
+
+EVENTS = {
+    'a': {'rrc00': {'10.0.0.1': {'10.0.0.0/24': [(10, 'updates', '3356 174 64500'),
+                                                 (20, 'withdrawal', '')],
+                                 '10.0.1.0/24': [(15, 'updates', '3356 {64501,64502}')]}}},
+    'b': {'rrc01': {'10.1.0.1': {'10.0.0.0/16': [(12, 'updates', '1299 64512 64512')],
+                                 '10.0.0.0/24': [(14, 'updates', '1299 174 64500')]}}}}
+
+
+def write_events(directory):
+    for title, nested in EVENTS.items():
+        EventStore(directory, title).write_event({'title': title,
+                                                  'as_paths': ASPaths.from_nested(nested)})
+
+
+def titles(occurrences):
+    return sorted(set(occurrence.title for occurrence in occurrences))
+
+
+def test_queries(tmpdir):
+    directory = str(tmpdir)
+    write_events(directory)
+    index = EventIndex(os.path.join(directory, 'index.sqlite'))
+    assert sorted(index.update(directory)) == ['a', 'b']
+    assert titles(index.by_asn('174')) == ['a', 'b']
+    assert titles(index.by_asn('64501')) == ['a']
+    assert titles(index.by_asn('64512', origin=True)) == ['b']
+    assert titles(index.by_asn('174', origin=True)) == []
+    assert titles(index.by_prefix('10.0.0.0/24')) == ['a', 'b']
+    assert titles(index.by_prefix('10.0.0.0/16')) == ['b']
+    assert titles(index.by_prefix('10.0.0.0/16', more_specifics=True)) == ['a', 'b']
+    assert titles(index.by_path('174 64500', subpath=True)) == ['a', 'b']
+    assert titles(index.by_path('3356 174 64500')) == ['a']
+
+
+def test_update_only_reads_changed_events(tmpdir):
+    directory = str(tmpdir)
+    write_events(directory)
+    index = EventIndex(os.path.join(directory, 'index.sqlite'))
+    index.update(directory)
+    assert index.update(directory) == []
+    EventStore(directory, 'b').append('as_paths', ASPaths.from_nested(EVENTS['a']))
+    # a second later, for the mtime
+    stat = os.stat(EventStore(directory, 'b').path)
+    os.utime(EventStore(directory, 'b').path, (stat.st_atime, stat.st_mtime + 1))
+    assert index.update(directory) == ['b']
+    assert titles(index.by_asn('64512')) == []
@@ -0,0 +1,64 @@
+import os
+import pickle
+from eventstore import EventStore, migrate_pickle, migrate_pickles, get_titles
+from aspaths import ASPaths
+
+EVENT = {'title': 'event', 'hijack_prefix': '10.0.0.0/24', 'start_time': '2017-01-01 12:00:00',
+         'pfxes_of_hijacker': {'64512': ['10.0.0.0/24']}}
+
+
+def test_sections(tmpdir):
+    store = EventStore(str(tmpdir), 'event')
+    store.write_event(EVENT)
+    assert sorted(store.sections()) == ['metadata', 'pfxes_of_hijacker']
+    store.append('global_paths', {'10.0.0.0/24': []})
+    store.append('pfxes_of_hijacker', {'64512': []}, atomic=True)
+    store = EventStore(str(tmpdir), 'event')
+    assert store.load('pfxes_of_hijacker') == {'64512': []}
+    assert store.load_event(['global_paths']) == {
+        'title': 'event', 'hijack_prefix': '10.0.0.0/24', 'start_time': '2017-01-01 12:00:00',
+        'global_paths': {'10.0.0.0/24': []}}
+    # no temporary file left
+    assert os.listdir(str(tmpdir)) == ['event.event']
+
+
+def test_partial_section_is_ignored(tmpdir):
+    store = EventStore(str(tmpdir), 'event')
+    store.write_event(EVENT)
+    size = os.path.getsize(store.path)
+    store.append('global_paths', {'10.0.0.0/24': range(1000)})
+    # interrupted while appending
+    with open(store.path, 'r+b') as f:
+        f.truncate(size + 100)
+    store = EventStore(str(tmpdir), 'event')
+    assert 'global_paths' not in store
+    store.append('local_paths', {})
+    assert sorted(EventStore(str(tmpdir), 'event').sections()) == \
+        ['local_paths', 'metadata', 'pfxes_of_hijacker']
+
+
+def test_write_without_replace(tmpdir):
+    store = EventStore(str(tmpdir), 'event')
+    assert store.write_event(EVENT, replace=False)
+    store.append('global_paths', {})
+    assert not EventStore(str(tmpdir), 'event').write_event({'title': 'event'}, replace=False)
+    assert 'global_paths' in EventStore(str(tmpdir), 'event')
+    assert os.listdir(str(tmpdir)) == ['event.event']
+
+
+def test_migration_keeps_appended_sections(tmpdir):
+    directory = str(tmpdir)
+    event = dict(EVENT, as_paths={'rrc00': {'10.0.0.1': {'10.0.0.0/24': [(10, 'updates', '1 2')]}}})
+    with open(os.path.join(directory, 'event.pickle'), 'w') as f:
+        pickle.dump(event, f)
+    store = migrate_pickle(os.path.join(directory, 'event.pickle'))
+    assert isinstance(store.load('as_paths'), ASPaths)
+    assert store.load('as_paths').to_nested() == event['as_paths']
+    # another host appended a stage meanwhile
+    store.append('global_paths', {})
+    assert migrate_pickle(os.path.join(directory, 'event.pickle')) is None
+    assert migrate_pickles(directory) == 0
+    assert 'global_paths' in EventStore(directory, 'event')
+    assert migrate_pickles(directory, overwrite=True) == 1
+    assert 'global_paths' not in EventStore(directory, 'event')
+    assert get_titles(directory) == ['event']
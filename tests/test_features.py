@@ -0,0 +1,45 @@
+import os
+import csv
+import pytest
+from features import COLUMNS, edit_distance, extract_all, format_row
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+COLLECTIONS = os.path.join(ROOT, 'collections')
+RESULTS_PATH = os.path.join(ROOT, 'datasets', 'results_news_updated_2.csv')
+
+
+def same_feature(value, expected, tolerance=1e-6):
+    """ Fields of two feature CSVs, numbers within a relative tolerance
+    """
+    if value == expected:
+        return True
+    try:
+        value, expected = float(value), float(expected)
+    except ValueError:
+        return False
+    return abs(value - expected) <= tolerance * max(abs(value), abs(expected))
+
+
+def test_edit_distance():
+    assert edit_distance([], ['1', '2']) == 2
+    assert edit_distance(['1', '2', '3'], ['1', '2', '3']) == 0
+    assert edit_distance(['1', '2', '3'], ['1', '4', '3']) == 1
+    # an adjacent swap is one edit
+    assert edit_distance(['1', '2', '3'], ['2', '1', '3']) == 1
+
+
+@pytest.mark.skipif(not os.path.isdir(COLLECTIONS) or not os.path.exists(RESULTS_PATH),
+                    reason='needs the recorded events and the results file')
+def test_columns_agree_with_the_results_file():
+    rows = dict((title, dict(zip(COLUMNS, format_row(row))))
+                for title, row in extract_all(COLLECTIONS) if row is not None)
+    with open(RESULTS_PATH, 'r') as f:
+        expected = dict((row['title'].split('.pickle')[0], row) for row in csv.DictReader(f))
+    titles = sorted(set(rows) & set(expected))
+    assert titles
+    disagreements = ['%s of %s: %s, %s in the results file'
+                     % (column, title, rows[title][column], expected[title][column])
+                     for column in COLUMNS if column != 'title'
+                     for title in titles
+                     if not same_feature(rows[title][column], expected[title][column])]
+    assert disagreements == []
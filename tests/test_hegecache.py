@@ -0,0 +1,104 @@
+import os
+import pytest
+import requests
+from datetime import datetime, timedelta
+from hegecache import HegemonyCache
+from hegemony import GetHegemony
+from ihr import IHRClient
+from standins import FakeIHR, synthetic_hegemony_table
+
+DT_TIME = datetime(2018, 6, 29, 11, 0)
+# start_time of an event with DT_TIME as hegemony time
+START_TIME = DT_TIME + timedelta(hours=2)
+TIMEBINS = [datetime.strftime(DT_TIME + timedelta(minutes=15 * i), '%Y-%m-%dT%H:%M')
+            for i in range(-8, 9)]
+
+
+def test_disk_tier_shared_by_instances(tmpdir):
+    path = os.path.join(str(tmpdir), 'hegemony.sqlite')
+    HegemonyCache(path).put('local', '{65000}', 4, DT_TIME, {65000: 1.0, 3356: 0.5})
+    cache = HegemonyCache(path)
+    assert cache.get('local', '65000', '4', '2018-06-29T11:00') == {65000: 1.0, 3356: 0.5}
+    assert cache.counters['disk_hits'] == 1
+    cache.get('local', '65000', '4', DT_TIME)
+    assert cache.counters['memory_hits'] == 1
+    assert cache.get('local', '65001', '4', DT_TIME) is None
+    assert cache.counters['misses'] == 1
+
+
+def test_memory_tier_is_bounded():
+    cache = HegemonyCache(None, memory_size=2)
+    for asn in range(3):
+        cache.put('global', asn, '4', DT_TIME, {asn: 0.1})
+    assert len(cache.memory) == 2
+    assert cache.get('global', 0, '4', DT_TIME) is None
+
+
+def test_negative_entry_is_a_hit(tmpdir):
+    path = os.path.join(str(tmpdir), 'hegemony.sqlite')
+    HegemonyCache(path).put('local_window', '65000', '4', DT_TIME, {})
+    cache = HegemonyCache(path)
+    assert cache.get('local_window', '65000', '4', DT_TIME) == {}
+    assert cache.counters['misses'] == 0
+
+
+def _handler(base_url, cache):
+    return GetHegemony('test', cache=cache, base_url=base_url, client=IHRClient(rate=None))
+
+
+def test_local_hegemony_unknown_origins_not_queried_again():
+    known = range(65000, 65010)
+    fake = FakeIHR(synthetic_hegemony_table(known, TIMEBINS))
+    base_url = fake.start()
+    try:
+        cache = HegemonyCache(None)
+        origins = [str(asn) for asn in known] + ['65100', '65101']
+        _handler(base_url, cache).prefetch_local_hegemony(origins, START_TIME, '4')
+        assert fake.requests > 0
+        assert cache.get('local_window', '65100', '4', DT_TIME) == {}
+        assert cache.get('local', '65100', '4', DT_TIME) == {}
+        assert cache.get('local', '65000', '4', DT_TIME)[65000] == 1.0
+
+        fake.reset_counters()
+        hege_handler = _handler(base_url, cache)
+        hege_handler.prefetch_local_hegemony(origins, START_TIME, '4')
+        hege_paths, local_hege = hege_handler.get_batch_local_hege_path(
+            ['3356 65100'], '192.0.2.0/24', START_TIME, '65100')
+        assert fake.requests == 0
+        assert hege_paths == [(['3356', '65100'], [0, 0])]
+        assert local_hege == {}
+    finally:
+        fake.stop()
+
+
+def test_global_hegemony_unknown_ases_not_queried_again():
+    query_time = datetime.strftime(DT_TIME, '%Y-%m-%dT%H:%M')
+    table = synthetic_hegemony_table([64999], [query_time])
+    fake = FakeIHR(table)
+    base_url = fake.start()
+    try:
+        cache = HegemonyCache(None)
+        ases = set(str(asn) for asn in table[(0, 4, query_time)]) | set(['65100', '65101'])
+        hegemony = _handler(base_url, cache).get_global_hegemony(ases, DT_TIME, '4')
+        assert hegemony == dict((str(asn), hege)
+                                for asn, hege in table[(0, 4, query_time)].items())
+        assert cache.get('global', '65100', '4', DT_TIME) == {}
+
+        fake.reset_counters()
+        assert _handler(base_url, cache).get_global_hegemony(ases, DT_TIME, '4') == hegemony
+        assert fake.requests == 0
+    finally:
+        fake.stop()
+
+
+def test_unanswered_queries_are_not_cached():
+    fake = FakeIHR(synthetic_hegemony_table([65000], TIMEBINS))
+    base_url = fake.start()
+    fake.stop()
+    cache = HegemonyCache(None)
+    # nobody listens there anymore
+    hege_handler = GetHegemony('test', cache=cache, base_url=base_url,
+                               client=IHRClient(rate=None, retries=0))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        hege_handler.prefetch_local_hegemony(['65000'], START_TIME, '4')
+    assert cache.get('local_window', '65000', '4', DT_TIME) is None
@@ -0,0 +1,75 @@
+import random
+from datetime import datetime, timedelta
+from hegecache import HegemonyCache
+from hegemony import GetHegemony
+from ihr import IHRClient
+from standins import FakeIHR, synthetic_hegemony_table
+
+DT_TIME = datetime(2018, 6, 29, 11, 0)
+QUERY_TIME = datetime.strftime(DT_TIME, '%Y-%m-%dT%H:%M')
+# start_time of an event with DT_TIME as hegemony time
+START_TIME = DT_TIME + timedelta(hours=2)
+
+
+def hops(path):
+    """ as-path as a list, prepending collapsed
+    """
+    path = path.split(' ')
+    return [asn for i, asn in enumerate(path) if i == 0 or asn != path[i - 1]]
+
+
+def test_local_hegemony_in_batches():
+    timebins = [datetime.strftime(DT_TIME + timedelta(minutes=15 * i), '%Y-%m-%dT%H:%M')
+                for i in range(-8, 9)]
+    origins = range(65000, 65045)
+    table = synthetic_hegemony_table(origins, timebins)
+    fake = FakeIHR(table, page_size=500)
+    base_url = fake.start()
+    try:
+        hege_handler = GetHegemony('test', cache=HegemonyCache(None), base_url=base_url,
+                                   client=IHRClient(rate=None))
+        hege_handler.prefetch_local_hegemony([str(asn) for asn in origins], START_TIME, '4')
+        # a window query per 20 origins, with their pages
+        prefetch_requests = fake.requests
+        for origin in origins:
+            asn = sorted(table[(origin, 4, QUERY_TIME)])[0]
+            path = '3356 %s %s %s' % (asn, origin, origin)
+            hege_paths, local_hege = hege_handler.get_batch_local_hege_path(
+                [path], '192.0.2.0/24', START_TIME, str(origin))
+            hegemony = table[(origin, 4, QUERY_TIME)]
+            assert hege_paths == [(hops(path), [hegemony.get(int(a), 0) for a in hops(path)])]
+            assert local_hege == dict((timebin + ':00Z', table[(origin, 4, timebin)])
+                                      for timebin in timebins
+                                      if abs(datetime.strptime(timebin, '%Y-%m-%dT%H:%M') -
+                                             DT_TIME) <= timedelta(hours=2))
+        assert fake.requests == prefetch_requests
+    finally:
+        fake.stop()
+
+
+def test_global_hegemony_in_chunks():
+    table = synthetic_hegemony_table([64999], [QUERY_TIME], ases_per_origin=60)
+    fake = FakeIHR(table, page_size=100)
+    base_url = fake.start()
+    rnd = random.Random(0)
+    transit = sorted(table[(0, 4, QUERY_TIME)])
+    try:
+        hege_handler = GetHegemony('test', cache=HegemonyCache(None), base_url=base_url,
+                                   client=IHRClient(rate=None))
+        hegemony = table[(0, 4, QUERY_TIME)]
+        for i in range(3):
+            paths = set()
+            while len(paths) < 50:
+                path = [str(asn) for asn in rnd.sample(transit, rnd.randint(1, 5))] + ['64999']
+                # some prepended
+                paths.add(' '.join(path + path[-1:] * rnd.randint(0, 2)))
+            ases = set(asn for path in paths for asn in path.split(' ')) | set(['65100'])
+            hege_paths, hj_as = hege_handler.get_batch_global_hege_path(
+                ases, paths, '10.%s.0.0/16' % i, START_TIME, hj_as=['65100', '64999'])
+            assert sorted(hege_paths) == sorted(
+                (hops(path), [hegemony.get(int(asn), 0) for asn in hops(path)]) for path in paths)
+            assert hj_as == {'64999': hegemony[64999]}
+        # more ASes than fit in a query
+        assert fake.requests > 1
+    finally:
+        fake.stop()
@@ -0,0 +1,57 @@
+import os
+import pickle
+import random
+from histobgpstream import HistoBGPStream
+from sinks import TimelineSink, PrefixOriginSink, ElemWriterSink, read_elems
+from standins import FakeBGPStream, FakeBGPRecord, FakeBGPSource, records_from_elems, \
+    synthetic_elem_stream
+
+
+def handler(records):
+    return HistoBGPStream(FakeBGPStream(records), FakeBGPRecord())
+
+
+def test_sinks_on_one_pass(tmpdir):
+    records = records_from_elems(synthetic_elem_stream(20000))
+    paths = handler(records).get_bgpstream(0, None)
+    origins = dict()
+    for collector, peer, prefix, t, record_type, path in paths.iter_entries():
+        if record_type != 'withdrawal':
+            origins.setdefault(path.split(' ')[-1], set()).add(prefix)
+
+    prefixes = PrefixOriginSink()
+    timelines = TimelineSink()
+    writer = ElemWriterSink(os.path.join(str(tmpdir), 'elems'))
+    handler(records).consume(0, None, [prefixes, timelines, writer])
+    writer.result()
+    assert prefixes.prefixes == origins
+    assert list(timelines.result().iter_entries()) == list(paths.iter_entries())
+    # the written stream replays the same
+    replayed = TimelineSink()
+    for elem in read_elems(writer.fpath):
+        replayed.add(elem)
+    assert list(replayed.result().iter_entries()) == list(paths.iter_entries())
+
+
+def test_shards_read_the_sequential_stream():
+    rnd = random.Random(0)
+    start = 1500000000
+    end = start + 3 * 86400
+    collectors = ['rrc%02d' % i for i in range(4)]
+    elems = []
+    for timestamp in sorted(rnd.randint(start, end) for i in range(20000)):
+        collector = rnd.choice(collectors)
+        peer = '10.0.%s.%s' % (collectors.index(collector), rnd.randint(0, 9))
+        if rnd.random() < 0.05:
+            record_type, as_path = 'withdrawal', ''
+        else:
+            record_type, as_path = 'updates', '3356 %s' % rnd.randint(64500, 64510)
+        elems.append((collector, peer, '10.0.%s.0/24' % rnd.randint(0, 50), timestamp,
+                      record_type, as_path))
+    source = FakeBGPSource(records_from_elems(elems))
+    expected = pickle.dumps(HistoBGPStream(*source()).get_bgpstream(start, end),
+                            pickle.HIGHEST_PROTOCOL)
+    for collector_shards in (None, collectors):
+        paths = HistoBGPStream(*source(), processes=2, shard_seconds=12 * 3600,
+                               collectors=collector_shards, source=source).get_bgpstream(start, end)
+        assert pickle.dumps(paths, pickle.HIGHEST_PROTOCOL) == expected
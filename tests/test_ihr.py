@@ -0,0 +1,56 @@
+import time
+from multiprocessing import Pool
+from datetime import datetime
+from ihr import TokenBucket, IHRClient, configure_shared_client, get_shared_client
+from standins import FakeIHR, synthetic_hegemony_table
+
+
+def _take(n):
+    bucket = get_shared_client().bucket
+    for i in range(n):
+        bucket.acquire()
+    return time.time()
+
+
+def test_bucket_burst_then_rate():
+    bucket = TokenBucket(20.0, 5)
+    stime = time.time()
+    for i in range(5):
+        assert bucket.acquire() == 0.0
+    assert time.time() - stime < 0.1
+    # 10 more at 20 per second
+    waited = sum(bucket.acquire() for i in range(10))
+    assert 0.4 <= time.time() - stime < 0.8
+    assert waited > 0.4
+
+
+def test_bucket_without_limit():
+    bucket = TokenBucket(None, 1)
+    assert sum(bucket.acquire() for i in range(1000)) == 0.0
+
+
+def test_shared_bucket_limits_all_workers():
+    bucket = TokenBucket(20.0, 5, shared=True)
+    pool = Pool(4, configure_shared_client, (20.0, 1, bucket))
+    try:
+        stime = time.time()
+        ends = pool.map(_take, [10] * 4, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    # 40 tokens, 5 at once then 20 per second: one bucket, not 4
+    assert max(ends) - stime >= 1.6
+
+
+def test_client_follows_pages():
+    query_time = datetime.strftime(datetime(2018, 6, 29, 11, 0), '%Y-%m-%dT%H:%M')
+    table = synthetic_hegemony_table(range(65000, 65010), [query_time])
+    fake = FakeIHR(table, page_size=7)
+    base_url = fake.start()
+    try:
+        client = IHRClient(rate=None)
+        rsp = client.get_all(base_url + "originasn=0&af=4&timebin=%s&format=json" % query_time)
+    finally:
+        fake.stop()
+    assert len(rsp['results']) == len(table[(0, 4, query_time)])
+    assert fake.requests == (len(rsp['results']) + 6) // 7
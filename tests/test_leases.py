@@ -0,0 +1,66 @@
+import os
+import time
+import pytest
+from leases import Lease, LeaseLost, Task, run_claimed, count_failures
+
+
+def _abandon(lease, seconds):
+    old = time.time() - seconds
+    os.utime(lease.path, (old, old))
+
+
+def test_held_lease_is_not_taken(tmpdir):
+    first = Lease(str(tmpdir), 'event.stream', 'host1', ttl=10)
+    assert first.acquire()
+    second = Lease(str(tmpdir), 'event.stream', 'host2', ttl=10)
+    assert not second.acquire()
+    assert first.held() and not second.held()
+
+
+def test_abandoned_lease_is_taken_over(tmpdir):
+    first = Lease(str(tmpdir), 'event.stream', 'host1', ttl=10)
+    assert first.acquire()
+    _abandon(first, 20)
+    second = Lease(str(tmpdir), 'event.stream', 'host2', ttl=10)
+    assert second.acquire()
+    assert second.held()
+    # the first owner comes back, it must not store anything
+    with pytest.raises(LeaseLost):
+        first.check()
+    second.check()
+    # nothing left but the lease
+    assert os.listdir(str(tmpdir)) == ['event.stream.lease']
+
+
+def test_release_only_removes_own_lease(tmpdir):
+    first = Lease(str(tmpdir), 'event.stream', 'host1', ttl=10)
+    assert first.acquire()
+    _abandon(first, 20)
+    second = Lease(str(tmpdir), 'event.stream', 'host2', ttl=10)
+    assert second.acquire()
+    first.release()
+    assert second.held()
+    second.release()
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_run_claimed_takes_over_and_gives_up(tmpdir):
+    directory = str(tmpdir)
+    done = set()
+
+    def task(name, fail=False):
+        def run(lease):
+            if fail:
+                raise RuntimeError(name)
+            lease.check()
+            done.add(name)
+        return Task(name, lambda: name in done, lambda: True, run)
+
+    crashed = Lease(directory, 'a', 'crashed host', ttl=10)
+    assert crashed.acquire()
+    _abandon(crashed, 20)
+    ran = run_claimed([task('a'), task('b', fail=True)], directory, ttl=10, poll=0.01,
+                      max_failures=2)
+    assert ran == ['a']
+    assert done == set(['a'])
+    assert count_failures(directory, 'b') == 2
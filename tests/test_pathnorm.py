@@ -0,0 +1,32 @@
+from aspaths import ASPaths
+from pathnorm import NormalizedPath, group_paths
+
+NESTED = {'rrc00': {'10.0.0.1': {'10.0.0.0/24': [(10, 'updates', '3356 174 64500'),
+                                                 (20, 'withdrawal', ''),
+                                                 (30, 'updates', '3356 64512 64512')],
+                                 '10.0.1.0/24': [(15, 'rib', '3356 {64501,64502}')]}},
+          'rrc01': {'10.1.0.1': {'10.0.0.0/24': [(12, 'updates', '3356 174 64500')]}}}
+
+
+def test_normalized_path():
+    path = NormalizedPath('3356 174 174 {64501,64502}')
+    assert path.hops == ('3356', '174', '{64501,64502}')
+    assert path.asns == frozenset(['3356', '174', '64501', '64502'])
+    assert path.origin == '{64501,64502}'
+
+
+def test_groups():
+    groups = group_paths(ASPaths.from_nested(NESTED))
+    assert groups.unique_ases == {'10.0.0.0/24': set(['3356', '174', '64500', '64512']),
+                                  '10.0.1.0/24': set(['3356', '64501', '64502'])}
+    assert dict((prefix, sorted(path.path for path in paths))
+                for prefix, paths in groups.unique_paths.items()) == \
+        {'10.0.0.0/24': ['3356 174 64500', '3356 64512 64512'],
+         '10.0.1.0/24': ['3356 {64501,64502}']}
+    assert dict((origin, [path.path for path in paths])
+                for origin, paths in groups.paths_by_origin['10.0.0.0/24'].items()) == \
+        {'64500': ['3356 174 64500'], '64512': ['3356 64512 64512']}
+    # a path is normalized once
+    by_origin = [path for paths in groups.paths_by_origin['10.0.0.0/24'].values()
+                 for path in paths]
+    assert sorted(map(id, by_origin)) == sorted(map(id, groups.unique_paths['10.0.0.0/24']))
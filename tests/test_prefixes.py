@@ -0,0 +1,75 @@
+import random
+import pytest
+from prefixes import PrefixTrie, covers, parse_prefix
+
+
+def random_prefixes(n, seed=0):
+    """ Nested IPv4 and IPv6 prefixes, many of them sharing bits
+    """
+    rnd = random.Random(seed)
+    prefixes = set()
+    while len(prefixes) < n:
+        if rnd.random() < 0.8:
+            length = rnd.randint(8, 28)
+            address = (10 << 24) | (rnd.getrandbits(12) << 12)
+            address &= ~((1 << (32 - length)) - 1) & 0xffffffff
+            prefixes.add('%d.%d.%d.%d/%d' % (address >> 24, (address >> 16) & 255,
+                                             (address >> 8) & 255, address & 255, length))
+        else:
+            length = rnd.choice([32, 48, 56])
+            words = ['2001', 'db8'] + ['%x' % rnd.getrandbits(4) for i in range(length // 16 - 2)]
+            prefixes.add('%s::/%d' % (':'.join(words), length))
+    return sorted(prefixes)
+
+
+@pytest.fixture(scope='module')
+def prefixes():
+    return random_prefixes(600)
+
+
+@pytest.fixture(scope='module')
+def trie(prefixes):
+    return PrefixTrie((prefix, i) for i, prefix in enumerate(prefixes))
+
+
+def queries(prefixes):
+    return prefixes[::5] + random_prefixes(100, seed=1)
+
+
+def test_items(prefixes, trie):
+    assert len(trie) == len(prefixes)
+    assert sorted(trie.items()) == sorted((prefix, i) for i, prefix in enumerate(prefixes))
+    assert all(trie[prefix] == i for i, prefix in enumerate(prefixes))
+    assert '11.0.0.0/8' not in trie
+
+
+def test_covering_against_a_scan(prefixes, trie):
+    for query in queries(prefixes):
+        expected = [prefix for prefix in prefixes if covers(prefix, query)]
+        # least specific first
+        expected.sort(key=lambda prefix: parse_prefix(prefix)[2])
+        assert [prefix for prefix, value in trie.covering(query)] == expected
+        match = trie.longest_match(query)
+        assert (match[0] if match else None) == (expected[-1] if expected else None)
+
+
+def test_covered_against_a_scan(prefixes, trie):
+    for query in queries(prefixes):
+        expected = sorted(prefix for prefix in prefixes if covers(query, prefix))
+        assert sorted(prefix for prefix, value in trie.covered(query)) == expected
+
+
+def test_overlapping_against_a_scan(prefixes, trie):
+    for query in queries(prefixes):
+        expected = sorted(prefix for prefix in prefixes if prefix != query and
+                          (covers(prefix, query) or covers(query, prefix)))
+        assert sorted(prefix for prefix, value in trie.overlapping(query)) == expected
+
+
+def test_setdefault():
+    trie = PrefixTrie()
+    trie.setdefault('10.0.0.0/8', set()).add('64500')
+    trie.setdefault('10.0.0.0/8', set()).add('64501')
+    trie.setdefault('10.0.0.0/16', set())
+    assert trie['10.0.0.0/8'] == set(['64500', '64501'])
+    assert len(trie) == 2
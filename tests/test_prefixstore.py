@@ -0,0 +1,33 @@
+import os
+import pickle
+from prefixstore import PrefixStore, LazyPrefixStore, write_store
+
+PREFIXES_OF = {'64500': ['10.0.0.0/24', '10.0.1.0/24'], '3356': ['4.0.0.0/9'],
+               '64512': ['2001:db8::/32'], '100000': []}
+
+
+def test_lookups_like_the_dict(tmpdir):
+    path = os.path.join(str(tmpdir), 'asn2pfx.store')
+    write_store(PREFIXES_OF, path)
+    store = PrefixStore(path)
+    try:
+        assert len(store) == len(PREFIXES_OF)
+        for asn, prefixes in PREFIXES_OF.items():
+            assert store.get(asn) == prefixes
+            assert asn in store
+        assert store.get('64501') is None
+        assert '64501' not in store
+        assert dict(store.items()) == PREFIXES_OF
+    finally:
+        store.close()
+
+
+def test_lazy_store_converts_the_pickle(tmpdir):
+    directory = str(tmpdir)
+    with open(os.path.join(directory, 'asn2pfx.pickle'), 'wb') as f:
+        pickle.dump(PREFIXES_OF, f, pickle.HIGHEST_PROTOCOL)
+    store = LazyPrefixStore(os.path.join(directory, 'asn2pfx.store'),
+                            os.path.join(directory, 'asn2pfx.pickle'))
+    assert not os.path.exists(os.path.join(directory, 'asn2pfx.store'))
+    assert store.get('3356') == ['4.0.0.0/9']
+    assert os.path.exists(os.path.join(directory, 'asn2pfx.store'))
@@ -0,0 +1,50 @@
+import pytest
+from aspaths import path_to_asns
+from histobgpstream import HistoBGPStream
+from ribs import RibHistory, propagation_over_time
+from standins import FakeBGPStream, FakeBGPRecord, records_from_elems, synthetic_event_elems
+
+HIJACKER = '64512'
+
+
+@pytest.fixture(scope='module')
+def as_paths():
+    elems = synthetic_event_elems(1500000000, 5000, hijacker=HIJACKER)
+    return HistoBGPStream(FakeBGPStream(records_from_elems(elems)),
+                          FakeBGPRecord()).get_bgpstream(0, None)
+
+
+def walk(as_paths, t):
+    """ RIB at t by walking every time line, withdrawals included
+    """
+    snapshot = dict()
+    for collector, peer, prefix, timestamp, record_type, path in as_paths.iter_entries():
+        if timestamp <= t:
+            snapshot[(collector, peer, prefix)] = None if record_type == 'withdrawal' else path
+    return dict((key, path) for key, path in snapshot.items() if path is not None)
+
+
+def test_snapshots_against_a_walk(as_paths):
+    history = RibHistory(as_paths)
+    start, end = min(as_paths.times), max(as_paths.times)
+    for t in [start - 1] + [start + (end - start) * i // 6 for i in range(7)]:
+        assert history.snapshot(t) == walk(as_paths, t)
+    collector, peer, prefix = history.keys[0]
+    assert history.path((collector, peer, prefix), end) == walk(as_paths, end).get(
+        (collector, peer, prefix))
+
+
+def test_propagation_against_a_walk(as_paths):
+    history = RibHistory(as_paths)
+    start, end, step = min(as_paths.times), max(as_paths.times), 1800
+    peers = set(key[:2] for key in history.keys)
+    expected = []
+    t = start
+    while t <= end:
+        reached = set(key[:2] for key, path in walk(as_paths, t).items()
+                      if int(HIJACKER) in path_to_asns(path))
+        expected.append((t, len(reached) / float(len(peers))))
+        t += step
+    shares = propagation_over_time(history, [HIJACKER], start, end, step)
+    assert shares == expected
+    assert any(share for t, share in shares)
@@ -0,0 +1,47 @@
+import os
+import signal
+import time
+from scheduler import Scheduler, Job
+
+
+def stage(name):
+    if name.startswith('fail'):
+        raise RuntimeError(name)
+    if name.startswith('kill'):
+        os.kill(os.getpid(), signal.SIGKILL)
+    return name
+
+
+def run(stream_jobs, hegemony_jobs):
+    finished = []
+    stats = Scheduler(2, 2, poll_seconds=0.2).run(
+        stage, stage, stream_jobs, hegemony_jobs,
+        lambda stage, job, result: finished.append((stage, result)))
+    return finished, stats
+
+
+def test_followups_run_once_their_job_is_done():
+    followup = Job('h1', 1.0, ('h1',))
+    finished, stats = run([Job('s1', 2.0, ('s1',), [followup]), Job('s2', 1.0, ('s2',))],
+                          [Job('h2', 1.0, ('h2',))])
+    assert sorted(finished) == [('hegemony', 'h1'), ('hegemony', 'h2'),
+                                ('stream', 's1'), ('stream', 's2')]
+    assert finished.index(('stream', 's1')) < finished.index(('hegemony', 'h1'))
+    assert stats['stream']['jobs'] == 2 and stats['hegemony']['jobs'] == 2
+
+
+def test_failed_job_does_not_release_its_followups():
+    finished, stats = run([Job('fail', 1.0, ('fail',), [Job('h1', 1.0, ('h1',))])],
+                          [Job('h2', 1.0, ('h2',))])
+    assert finished == [('hegemony', 'h2')]
+    assert stats['stream']['errors'] == 1
+
+
+def test_job_of_a_dead_worker_fails():
+    stime = time.time()
+    finished, stats = run([Job('kill', 2.0, ('kill',), [Job('h1', 1.0, ('h1',))]),
+                           Job('s1', 1.0, ('s1',))],
+                          [Job('kill h2', 1.0, ('kill h2',)), Job('h3', 1.0, ('h3',))])
+    assert sorted(finished) == [('hegemony', 'h3'), ('stream', 's1')]
+    assert stats['stream']['errors'] == 1 and stats['hegemony']['errors'] == 1
+    assert time.time() - stime < 10
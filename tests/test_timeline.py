@@ -0,0 +1,39 @@
+from timeline import Timeline
+
+
+def test_in_order():
+    timeline = Timeline()
+    assert timeline.insert(10, 'updates', '1 2')
+    # same path, nothing changed
+    assert not timeline.insert(20, 'updates', '1 2')
+    assert timeline.insert(30, 'updates', '1 3')
+    assert timeline.insert(40, 'withdrawal', '')
+    assert timeline.to_list() == [(10, 'updates', '1 2'), (30, 'updates', '1 3'),
+                                  (40, 'withdrawal', '')]
+
+
+def test_out_of_order():
+    timeline = Timeline()
+    timeline.insert(10, 'updates', '1 2')
+    timeline.insert(30, 'updates', '1 3')
+    timeline.insert(20, 'updates', '1 4')
+    assert timeline.to_list() == [(10, 'updates', '1 2'), (20, 'updates', '1 4'),
+                                  (30, 'updates', '1 3')]
+    # the following entry has the same path, the earlier one replaces it
+    timeline.insert(25, 'updates', '1 3')
+    assert timeline.to_list() == [(10, 'updates', '1 2'), (20, 'updates', '1 4'),
+                                  (25, 'updates', '1 3')]
+    # before everything
+    timeline.insert(5, 'updates', '1 2')
+    assert timeline.to_list() == [(5, 'updates', '1 2'), (20, 'updates', '1 4'),
+                                  (25, 'updates', '1 3')]
+
+
+def test_old_withdrawal_is_ignored():
+    timeline = Timeline()
+    assert timeline.insert(10, 'updates', '1 2')
+    assert not timeline.insert(5, 'withdrawal', '')
+    assert len(timeline) == 1
+    # on an empty time line it is kept
+    timeline = Timeline()
+    assert timeline.insert(5, 'withdrawal', '')
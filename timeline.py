@@ -0,0 +1,58 @@
+from bisect import bisect_right
+
+
+class Timeline(object):
+    """ Time ordered routing history of a single (collector, peer, prefix).
+    Entries are (time, record_type, as_path) tuples, the same tuples we
+    store in event['as_paths'].
+    """
+    __slots__ = ('times', 'entries')
+
+    def __init__(self):
+        # times[i] == entries[i][0], kept separately for bisect
+        self.times = []
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def insert(self, timestamp, record_type, as_path):
+        """ Put an update into its place on the time line.
+        - If the preceding entry has the same as-path, nothing changed
+          and the update is dropped.
+        - If the following entry has the same as-path, it is replaced
+          by this (earlier) one.
+        - Withdrawals older than everything we have seen are ignored.
+        :param timestamp:(int) record time
+        :param record_type: 'rib', 'updates' or 'withdrawal'
+        :param as_path:(str) empty for withdrawals
+        :return: True if the time line changed
+        """
+        times = self.times
+        entries = self.entries
+        # Updates mostly arrive in order, so this is usually len(entries)
+        if not times or timestamp >= times[-1]:
+            index = len(times)
+        else:
+            index = bisect_right(times, timestamp)
+
+        if index == 0:
+            if entries and record_type == 'withdrawal':
+                return False
+        elif entries[index - 1][2] == as_path:
+            return False
+
+        if index < len(entries) and entries[index][2] == as_path:
+            times[index] = timestamp
+            entries[index] = (timestamp, record_type, as_path)
+        else:
+            times.insert(index, timestamp)
+            entries.insert(index, (timestamp, record_type, as_path))
+        return True
+
+    def to_list(self):
+        return list(self.entries)
+